@@ -0,0 +1,119 @@
+"""Замер LotHistory: поиск /search по миллиону лотов, память на лот и перечитывание с диска.
+
+Лоты распределены по 336 часовым секциям (14 дней) и 1000 источникам; заголовки —
+6–10 слов из словаря в 20 000 слов с распределением Ципфа, у каждого пятого лота есть
+кадастровый номер. Запросы — одно или два слова того же распределения и кадастровые
+номера, по подпискам пользователя из 20 ссылок и по всем 1000, не больше 10 результатов.
+Память — прирост пикового RSS процесса при наполнении (на лот), так что это верхняя оценка.
+
+Запуск из корня репозитория: python benchmarks/lot_history.py [--lots N]
+"""
+import argparse
+import logging
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+
+from lot_history import LotHistory, PARTITION_SECONDS
+from models import Lot
+
+HOURS = 14 * 24
+SOURCES = 1000
+VOCABULARY = 20000
+SUBSCRIPTIONS = 20
+QUERIES = 300
+LIMIT = 10
+
+
+def peak_rss_kb() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss # Linux: килобайты
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lots", type=int, default=1_000_000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    rng = random.Random(args.seed)
+    words = [f"{rng.choice('бвгдклмнпрст')}{rng.choice('аеиоу')}{rng.choice('бвгдклмнпрст')}{rng.choice('аеиоу')}{rank}"
+             for rank in range(VOCABULARY)]
+    cum_weights = []
+    total = 0.0
+    for rank in range(VOCABULARY):
+        total += 1 / (rank + 1)
+        cum_weights.append(total)
+    sources = [f"https://example.com/rss?region={i}" for i in range(SOURCES)]
+    cadastral_numbers = []
+
+    tmp = tempfile.TemporaryDirectory() # файлы секций миллиона лотов занимают сотни мегабайт
+    directory = os.path.join(tmp.name, "lot_history")
+    history = LotHistory(directory, retention_days=14, max_lots=args.lots * 2)
+    history.load() # пустой каталог: дальше add() кладёт лоты и в память
+
+    now = int(time.time())
+    first_hour = now - now % PARTITION_SECONDS - (HOURS - 1) * PARTITION_SECONDS
+    per_hour = args.lots // HOURS
+    rss_before = peak_rss_kb()
+    started = time.perf_counter()
+    guid = 0
+    for hour in range(HOURS):
+        by_source = {}
+        for _ in range(per_hour):
+            guid += 1
+            title = " ".join(rng.choices(words, cum_weights=cum_weights, k=rng.randint(6, 10)))
+            cadastral_number = None
+            if guid % 5 == 0:
+                cadastral_number = f"{rng.randint(10, 99)}:{rng.randint(10, 99)}:{rng.randint(100000, 9999999):07d}:{rng.randint(1, 9999)}"
+                if len(cadastral_numbers) < QUERIES:
+                    cadastral_numbers.append(cadastral_number)
+            by_source.setdefault(rng.choice(sources), []).append(
+                Lot(str(guid), title, f"https://example.com/lot/{guid}", cadastral_number))
+        seen_at = min(now, first_hour + hour * PARTITION_SECONDS + PARTITION_SECONDS // 2)
+        for source, lots in by_source.items():
+            history.add(source, lots, seen_at)
+    fill_seconds = time.perf_counter() - started
+    lots = per_hour * HOURS
+    print(f"filled {lots} lot(s) in {HOURS} partition(s), {SOURCES} source(s) in {fill_seconds:.1f}s; "
+          f"peak RSS +{(peak_rss_kb() - rss_before) * 1024 / lots:.0f} B/lot")
+
+    subscribed = rng.sample(sources, SUBSCRIPTIONS)
+    queries = {
+        "1 word": [rng.choices(words, cum_weights=cum_weights)[0] for _ in range(QUERIES)],
+        "2 words": [" ".join(rng.choices(words, cum_weights=cum_weights, k=2)) for _ in range(QUERIES)],
+        "cadastral": cadastral_numbers,
+    }
+    for label, urls in ((f"{SUBSCRIPTIONS} subscriptions", subscribed), (f"{SOURCES} subscriptions", sources)):
+        for kind, texts in queries.items():
+            timings, found = [], 0
+            for text in texts:
+                started = time.perf_counter()
+                found += len(history.search(urls, text, LIMIT))
+                timings.append((time.perf_counter() - started) * 1000)
+            print(f"search, {label}, {kind}: median {statistics.median(timings):.2f} ms, "
+                  f"p99 {percentile(timings, 0.99):.2f} ms, max {max(timings):.2f} ms, {found / len(texts):.1f} result(s)/query")
+    history.close()
+
+    reloaded = LotHistory(directory, retention_days=14, max_lots=args.lots * 2)
+    started = time.perf_counter()
+    reloaded.load()
+    print(f"reload from disk: {time.perf_counter() - started:.1f}s")
+    reloaded.close()
+    tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""Замер памяти DataManager: словари исходной версии против записей со __slots__.
+
+Генерируются снимки в формате исходной версии: N пользователей по 3 подписки и N ссылок
+с --guids известными GUID. Каждая раскладка загружается в отдельном процессе, после
+загрузки трижды проходит get_all_active_subscribed_links_info (как циклы проверки),
+и процесс сообщает пиковый RSS. Исходная версия — data_manager.py из первого коммита
+репозитория (или --baseline РЕВИЗИЯ).
+
+Запуск из корня репозитория: python benchmarks/memory_layout.py [--users N] [--links N] [--guids N]
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SUBSCRIPTIONS_PER_USER = 3
+SCANS = 3
+
+
+def peak_rss_mb() -> float:
+    # VmHWM сбрасывается при exec, а ru_maxrss на Linux наследует пик родителя, записавшего снимки.
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # Linux: килобайты
+
+
+def write_snapshots(directory: str, users: int, links: int, guids: int, seed: int):
+    rng = random.Random(seed)
+    joined_at = datetime(2024, 1, 1, tzinfo=timezone.utc).isoformat()
+    urls = [f"https://torgi.gov.ru/new/api/public/lotcards/rss?lotStatus=PUBLISHED,APPLICATIONS_SUBMISSION"
+            f"&subjRF={i % 99}&catCode={i}&byFirstVersion=true" for i in range(links)]
+    with open(os.path.join(directory, "link_data.json"), "w", encoding="utf-8") as f:
+        json.dump({url: {
+            "original_url_example": url, "last_checked": joined_at, "error_count": 0, "is_active": True,
+            "known_lot_guids": [f"https://torgi.gov.ru/new/public/lots/lot/{21000000000000000000 + i * guids + g}_1" for g in range(guids)],
+            "added_at": joined_at,
+        } for i, url in enumerate(urls)}, f, ensure_ascii=False)
+    with open(os.path.join(directory, "user_data.json"), "w", encoding="utf-8") as f:
+        json.dump({str(100000000 + i): {
+            "chat_id": 100000000 + i, "first_name": f"Пользователь {i}", "username": f"user{i}", "is_active": True,
+            "subscriptions": [{"url": url, "alias": None} for url in rng.sample(urls, SUBSCRIPTIONS_PER_USER)],
+            "joined_at": joined_at,
+        } for i in range(users)}, f, ensure_ascii=False)
+
+
+def run_child(layout: str, data_dir: str, module_dir: str):
+    sys.path.insert(0, module_dir)
+    os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+    logging.disable(logging.CRITICAL)
+    os.chdir(data_dir)
+    import data_manager
+
+    before = peak_rss_mb()
+    started = time.perf_counter()
+    dm = data_manager.DataManager(fsync_policy="never") if layout == "slots" else data_manager.DataManager()
+    loaded = time.perf_counter() - started
+    started = time.perf_counter()
+    for _ in range(SCANS):
+        active = len(dm.get_all_active_subscribed_links_info())
+    scan = (time.perf_counter() - started) / SCANS
+    print(json.dumps({"peak_mb": peak_rss_mb(), "interpreter_mb": before, "load_s": loaded, "scan_s": scan, "active": active}))
+
+
+def measure(layout: str, data_dir: str, module_dir: str) -> dict:
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", layout, "--data", data_dir,
+                             "--module-dir", module_dir], check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--links", type=int, default=100_000)
+    parser.add_argument("--guids", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--baseline", default=None, help="ревизия git с исходным data_manager.py (по умолчанию первый коммит)")
+    parser.add_argument("--child", choices=("baseline", "slots"), help=argparse.SUPPRESS)
+    parser.add_argument("--data", help=argparse.SUPPRESS)
+    parser.add_argument("--module-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return run_child(args.child, args.data, args.module_dir)
+
+    baseline = args.baseline or subprocess.run(["git", "rev-list", "--max-parents=0", "HEAD"], cwd=REPO_DIR, check=True,
+                                               capture_output=True, text=True).stdout.split()[0]
+    with tempfile.TemporaryDirectory() as tmp:
+        baseline_dir = os.path.join(tmp, "baseline")
+        os.mkdir(baseline_dir)
+        with open(os.path.join(baseline_dir, "data_manager.py"), "w", encoding="utf-8") as f:
+            f.write(subprocess.run(["git", "show", f"{baseline}:data_manager.py"], cwd=REPO_DIR, check=True,
+                                   capture_output=True, text=True).stdout)
+
+        data_dir = os.path.join(tmp, "data")
+        os.mkdir(data_dir)
+        write_snapshots(data_dir, args.users, args.links, args.guids, args.seed)
+        size_mb = sum(os.path.getsize(os.path.join(data_dir, name)) for name in os.listdir(data_dir)) / 2**20
+        print(f"{args.users} users x {SUBSCRIPTIONS_PER_USER} subscriptions, {args.links} links x {args.guids} GUIDs, "
+              f"snapshots {size_mb:.0f} MB")
+
+        for label, layout, module_dir in (("baseline dicts", "baseline", baseline_dir), ("slotted records", "slots", REPO_DIR)):
+            # Каждый процесс получает свою копию снимков: новая версия может их переписать.
+            copy_dir = os.path.join(tmp, f"data-{layout}")
+            shutil.copytree(data_dir, copy_dir)
+            result = measure(layout, copy_dir, module_dir)
+            shutil.rmtree(copy_dir)
+            print(f"{label}: peak RSS {result['peak_mb']:.0f} MB (interpreter {result['interpreter_mb']:.0f} MB), "
+                  f"load {result['load_s']:.1f}s, active-link scan {result['scan_s'] * 1000:.0f} ms, {result['active']} active link(s)")
+
+if __name__ == "__main__":
+    main()
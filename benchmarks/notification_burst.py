@@ -0,0 +1,110 @@
+"""Замер рассылки одного лота пачке получателей: время на отправку и объём логов.
+
+NotificationService.send_new_lot_notifications рассылает лот 5000 подписчикам одной
+ссылки через бота-заглушку, send_message которого ничего не делает, — остаются
+сборка сообщения, поиск псевдонима и логирование. Каждый прогон идёт в отдельном
+процессе с LOG_LEVEL=INFO и stderr в файл: так настройки логов из окружения
+читаются заново, а объём и число строк лога считаются по файлу. В текущем дереве
+сравниваются настройки по умолчанию (очередь и ограничение частоты) и запись без
+ограничения — в том же потоке и через очередь; в дереве без logging_setup логи
+настраиваются как раньше, через logging.basicConfig.
+
+Запуск из корня репозитория: python benchmarks/notification_burst.py [--tree ПУТЬ] [--recipients N]
+--tree — другое дерево (например, git worktree предыдущей версии) для сравнения.
+"""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROUNDS = 3
+FEED_URL = "https://torgi.gov.ru/new/api/public/lotcards/rss?catCode=2"
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(threadName)s - %(message)s'
+
+CONFIGURATIONS = [
+    ("defaults (async, rate limit 60/min)", {}),
+    ("no rate limit, synchronous", {"LOG_RATE_LIMIT_PER_MINUTE": "0", "LOG_ASYNC": "0"}),
+    ("no rate limit, async", {"LOG_RATE_LIMIT_PER_MINUTE": "0", "LOG_ASYNC": "1"}),
+]
+
+
+class NoOpBot:
+    def send_message(self, chat_id, text, **kwargs):
+        return None
+
+
+def run_burst(tree: str, recipients_count: int):
+    """Один прогон в дочернем процессе: печатает в stdout JSON с временем на отправку."""
+    sys.path.insert(0, os.path.abspath(tree))
+    os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp) # DataManager пишет файлы данных в текущий каталог
+        logging.disable(logging.CRITICAL) # подготовка данных в замер логов не входит
+        from data_manager import DataManager
+        from models import Lot
+        from services.notification_service import NotificationService
+
+        dm = DataManager(fsync_policy="never")
+        recipients = []
+        for user_id in range(1, recipients_count + 1):
+            dm.get_or_create_user(user_id, user_id * 10, f"user{user_id}", None)
+            dm.add_subscriptions_bulk(user_id, [(FEED_URL, FEED_URL, None)])
+            recipients.append((user_id * 10, user_id))
+        lot = Lot("lot-1", "Земельный участок под ИЖС, 12 соток, Московская область", "https://torgi.gov.ru/new/public/lots/lot/1",
+                  "50:20:0010203:456")
+
+        listener = None
+        try:
+            from logging_setup import setup_logging
+            listener = setup_logging()
+        except ImportError:
+            logging.basicConfig(format=TEXT_FORMAT, level=logging.INFO)
+        logging.disable(logging.NOTSET)
+
+        started = time.perf_counter()
+        NotificationService(dm).send_new_lot_notifications(NoOpBot(), recipients, lot, FEED_URL)
+        elapsed = time.perf_counter() - started
+
+        if listener is not None:
+            listener.stop() # дописать очередь в файл до подсчёта строк
+        logging.disable(logging.CRITICAL)
+        dm.close()
+    print(json.dumps({"us_per_send": elapsed / recipients_count * 1e6}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tree", default=REPO_DIR)
+    parser.add_argument("--recipients", type=int, default=5000)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        run_burst(args.tree, args.recipients)
+        return
+
+    configurations = CONFIGURATIONS
+    if not os.path.exists(os.path.join(args.tree, "logging_setup.py")):
+        configurations = [("logging.basicConfig", {})]
+    for label, overrides in configurations:
+        env = dict(os.environ, LOG_LEVEL="INFO", LOG_FORMAT="text", **overrides)
+        timings, log_bytes, log_lines = [], 0, 0
+        for _ in range(ROUNDS):
+            with tempfile.TemporaryFile() as log:
+                result = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", "--tree", args.tree,
+                                         "--recipients", str(args.recipients)],
+                                        stdout=subprocess.PIPE, stderr=log, env=env, check=True, text=True)
+                log.seek(0)
+                content = log.read()
+            timings.append(json.loads(result.stdout)["us_per_send"])
+            log_bytes, log_lines = len(content), content.count(b"\n")
+        print(f"{args.tree}, {label}: {min(timings):.1f}-{max(timings):.1f} us/send over {ROUNDS} run(s), "
+              f"log {log_bytes / 1e6:.2f} MB / {log_lines} line(s) per {args.recipients}-recipient burst")
+
+
+if __name__ == "__main__":
+    main()
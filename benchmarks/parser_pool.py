@@ -0,0 +1,89 @@
+"""Замер разбора лент в вызывающем потоке и в пуле процессов (PARSER_PROCESSES).
+
+Лента — RSS на ITEMS записей с HTML-описаниями (~350 КБ). Пропускная способность:
+CALLING_THREADS потоков разбирают одну и ту же ленту для разного числа ссылок.
+Влияние GIL: пока разбирается PARSED_FEEDS лент, другой поток спит по 1 мс, и
+измеряется, насколько он просыпается позже.
+
+Запуск из корня репозитория: python benchmarks/parser_pool.py [--processes 4]
+"""
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+
+from services.parser_service import ParserService
+
+ITEMS = 300
+CALLING_THREADS = 4
+LINK_COUNTS = (8, 32, 128)
+PARSED_FEEDS = 16
+
+
+def make_feed(items: int = ITEMS) -> bytes:
+    description = ("&lt;p&gt;Земельный участок, кадастровый номер 50:21:0110501:1234, площадь 1500 кв.м. "
+                   + "Описание лота. " * 30 + "&lt;/p&gt;")
+    entries = "".join(
+        f"<item><title>Лот {i} аренда земельного участка</title>"
+        f"<link>https://torgi.gov.ru/new/public/lots/lot/{i}</link><guid>g{i}</guid>"
+        f"<description>{description}</description><pubDate>Mon, 01 Jan 2026 00:00:00 GMT</pubDate></item>"
+        for i in range(items))
+    return f'<?xml version="1.0" encoding="utf-8"?><rss version="2.0"><channel><title>t</title>{entries}</channel></rss>'.encode()
+
+
+def throughput(parser_service: ParserService, feed: bytes, links: int) -> float:
+    started = time.perf_counter()
+    with ThreadPoolExecutor(CALLING_THREADS) as executor:
+        list(executor.map(parser_service.parse_rss_feed, [feed] * links))
+    return links / (time.perf_counter() - started)
+
+
+def wakeup_delays_ms(parser_service: ParserService, feed: bytes) -> list:
+    delays = []
+    stop = threading.Event()
+
+    def ticker():
+        while not stop.is_set():
+            started = time.perf_counter()
+            time.sleep(0.001)
+            delays.append((time.perf_counter() - started - 0.001) * 1000)
+
+    thread = threading.Thread(target=ticker)
+    thread.start()
+    for _ in range(PARSED_FEEDS):
+        parser_service.parse_rss_feed(feed)
+    stop.set()
+    thread.join()
+    return sorted(delays)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--processes", type=int, default=4)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    feed = make_feed()
+    print(f"feed: {len(feed) // 1024} KB, {ITEMS} items, {CALLING_THREADS} calling threads, {os.cpu_count()} CPU(s)")
+    for processes in (0, args.processes):
+        # Пул форкается в конструкторе — до запуска потоков замера.
+        parser_service = ParserService(processes)
+        try:
+            rates = [throughput(parser_service, feed, links) for links in LINK_COUNTS]
+            delays = wakeup_delays_ms(parser_service, feed)
+        finally:
+            parser_service.close()
+        label = "in-thread" if processes == 0 else f"{processes} procs"
+        print(f"{label:>9}: " + " / ".join(f"{rate:.1f}" for rate in rates)
+              + f" feeds/s at {' / '.join(map(str, LINK_COUNTS))} links; other thread's 1 ms sleep overran by "
+              f"p50 {delays[len(delays) // 2]:.2f} ms / p99 {delays[int(len(delays) * 0.99)]:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
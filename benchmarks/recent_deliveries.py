@@ -0,0 +1,122 @@
+"""Замер RecentDeliveries: память индекса, время проверки с отметкой и доля повторов в пересекающихся лентах.
+
+Память — прирост выделений по tracemalloc при заполнении индекса до max_entries
+(по умолчанию DELIVERY_DEDUP_MAX_ENTRIES). Время — was_delivered() и add() для новой
+пары на полном индексе, то есть вместе с вытеснением самой старой записи.
+
+Доля повторов: лоты публикуются в 20 региональных и 10 категорийных лентах — каждый
+лот в одной ленте каждого вида, причём в категорийной на 200 лотов позже; у пользователя
+одна региональная подписка и одна-две категорийные. Лоты доставляются подписчикам ленты
+так же, как в DeliveryService, и hit rate из stats() сравнивается с точной долей повторов,
+посчитанной по множеству всех доставленных пар: расхождение — пропуски из-за вытеснения.
+
+Запуск из корня репозитория: python benchmarks/recent_deliveries.py [--entries N] [--lots N]
+"""
+import argparse
+import logging
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+
+from config import DELIVERY_DEDUP_MAX_ENTRIES
+from services.delivery_service import RecentDeliveries
+
+ROUNDS = 5
+OPERATIONS = 100_000
+USERS = 1000
+REGION_FEEDS = 20
+CATEGORY_FEEDS = 10
+CATEGORY_LAG_LOTS = 200 # копия лота в категорийной ленте приходит позже региональной
+
+
+def measure_memory(entries: int) -> float:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    recent = RecentDeliveries(max_entries=entries)
+    for i in range(entries):
+        recent.add(i % USERS, f"lot-{i}")
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used
+
+
+def measure_check_and_mark(entries: int) -> list:
+    recent = RecentDeliveries(max_entries=entries)
+    for i in range(entries):
+        recent.add(i % USERS, f"lot-{i}")
+    next_lot = entries
+    timings = []
+    for _ in range(ROUNDS):
+        guids = [f"lot-{next_lot + i}" for i in range(OPERATIONS)]
+        next_lot += OPERATIONS
+        started = time.perf_counter()
+        for i, guid in enumerate(guids):
+            user_id = i % USERS
+            if not recent.was_delivered(user_id, guid):
+                recent.add(user_id, guid)
+        timings.append((time.perf_counter() - started) / OPERATIONS * 1e6)
+    return timings
+
+
+def measure_hit_rate(entries: int, lots: int, rng: random.Random):
+    region_subscribers = {feed: [] for feed in range(REGION_FEEDS)}
+    category_subscribers = {feed: [] for feed in range(CATEGORY_FEEDS)}
+    for user_id in range(USERS):
+        region_subscribers[rng.randrange(REGION_FEEDS)].append(user_id)
+        for feed in rng.sample(range(CATEGORY_FEEDS), rng.randint(1, 2)):
+            category_subscribers[feed].append(user_id)
+
+    regions = [rng.randrange(REGION_FEEDS) for _ in range(lots)]
+    categories = [rng.randrange(CATEGORY_FEEDS) for _ in range(lots)]
+    recent = RecentDeliveries(max_entries=entries)
+    delivered = set()
+    lookups = duplicates = 0
+    for step in range(lots + CATEGORY_LAG_LOTS):
+        copies = []
+        if step < lots:
+            copies.append((step, region_subscribers[regions[step]]))
+        if step >= CATEGORY_LAG_LOTS:
+            lot = step - CATEGORY_LAG_LOTS
+            copies.append((lot, category_subscribers[categories[lot]]))
+        for lot, subscribers in copies:
+            guid = f"lot-{lot}"
+            for user_id in subscribers:
+                lookups += 1
+                if (user_id, guid) in delivered:
+                    duplicates += 1
+                else:
+                    delivered.add((user_id, guid))
+                if not recent.was_delivered(user_id, guid):
+                    recent.add(user_id, guid)
+    return recent.stats(), duplicates / lookups
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, default=DELIVERY_DEDUP_MAX_ENTRIES)
+    parser.add_argument("--lots", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    used = measure_memory(args.entries)
+    print(f"memory at {args.entries} entries: {used / 2**20:.1f} MB ({used / args.entries:.0f} B/entry)")
+
+    timings = measure_check_and_mark(args.entries)
+    print(f"check-and-mark on a full index: median {statistics.median(timings):.2f} us "
+          f"(min {min(timings):.2f}, max {max(timings):.2f}) over {ROUNDS} x {OPERATIONS}")
+
+    for entries in (args.entries, args.entries // 10):
+        stats, exact = measure_hit_rate(entries, args.lots, random.Random(args.seed))
+        print(f"overlapping feeds, {args.lots} lot(s), max_entries {entries}: hit rate {stats['hit_rate']:.3f} "
+              f"(exact duplicate share {exact:.3f}), {stats['lookups']} lookup(s), {stats['entries']} entries")
+
+
+if __name__ == "__main__":
+    main()
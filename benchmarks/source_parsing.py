@@ -0,0 +1,64 @@
+"""Замер разбора одних и тех же лотов torgi.gov.ru в виде RSS (feedparser) и JSON поиска (TorgiGovAdapter).
+
+Для каждого размера выдачи берётся лучшее из ROUNDS повторов; печатаются время,
+лотов в секунду и размер данных.
+
+Запуск из корня репозитория: python benchmarks/source_parsing.py
+"""
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+
+from services.parser_service import parse_feed_entries, parse_torgi_search
+
+LOT_COUNTS = (100, 1000)
+ROUNDS = 5
+
+
+def lot_id(i: int) -> str:
+    return f"2100000{i}00000000{i}"
+
+
+def make_search_json(lots: int) -> bytes:
+    return json.dumps({"content": [{
+        "id": lot_id(i),
+        "lotName": f"Земельный участок {i} 50:21:0100111:{i}",
+        "priceMin": 100000.0 + i,
+        "firstVersionPublicationDate": "2026-10-18T10:00:00.000+03:00",
+        "characteristics": [{"code": "CadastralNumber", "characteristicValue": f"50:21:0100111:{i}"},
+                            {"code": "SquareZU", "characteristicValue": 600}],
+    } for i in range(lots)]}, ensure_ascii=False).encode()
+
+
+def make_rss(lots: int) -> bytes:
+    items = "".join(
+        f"<item><title>Земельный участок {i}</title>"
+        f"<link>https://torgi.gov.ru/new/public/lots/lot/{lot_id(i)}/(lotInfo:info)</link>"
+        f"<guid>https://torgi.gov.ru/new/public/lots/lot/{lot_id(i)}/(lotInfo:info)?x=1</guid>"
+        f"<description>&lt;p&gt;Кадастровый номер 50:21:0100111:{i}, площадь 600 кв.м, начальная цена {100000 + i} руб.&lt;/p&gt;</description>"
+        f"<pubDate>Sat, 18 Oct 2026 07:00:00 GMT</pubDate></item>"
+        for i in range(lots))
+    return f'<?xml version="1.0" encoding="UTF-8"?><rss version="2.0"><channel><title>torgi</title>{items}</channel></rss>'.encode()
+
+
+def best_seconds(parse, content: bytes, number: int) -> float:
+    return min(timeit.repeat(lambda: parse(content), number=number, repeat=ROUNDS)) / number
+
+
+def main():
+    parse_feed_entries(make_rss(1)) # импорт feedparser не должен попасть в замер
+    for lots in LOT_COUNTS:
+        search_json, rss = make_search_json(lots), make_rss(lots)
+        json_seconds = best_seconds(parse_torgi_search, search_json, 20)
+        rss_seconds = best_seconds(parse_feed_entries, rss, 5)
+        print(f"{lots:>5} lots: feedparser {rss_seconds * 1e3:.1f} ms ({lots / rss_seconds:,.0f} lots/s, {len(rss)} B), "
+              f"JSON {json_seconds * 1e3:.2f} ms ({lots / json_seconds:,.0f} lots/s, {len(search_json)} B), "
+              f"x{rss_seconds / json_seconds:.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""Замер запуска бота: время `import bot` (python -X importtime) и время до первого getUpdates.
+
+Хранилище генерируется во временном каталоге: USERS пользователей, LINKS ссылок по
+GUIDS_PER_LINK известных лотов и UNPOPULATED_LINKS ссылок без лотов на недоступный
+адрес — их первичное заполнение не должно задерживать опрос. Bot API подменяется
+локальным сервером-заглушкой (TELEGRAM_API_URL), время до опроса берётся из строки
+"Ready to receive updates N s after start", которую бот пишет после первого getUpdates
+(заглушка отвечает сразу, без ожидания long polling).
+
+Запуск из корня репозитория: python benchmarks/startup.py [--runs 3]
+"""
+import argparse
+import http.server
+import json
+import os
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+USERS = 3000
+LINKS = 1000
+GUIDS_PER_LINK = 300
+UNPOPULATED_LINKS = 3
+UNREACHABLE_URL = "http://10.255.255.1/feed/{}" # немаршрутизируемый адрес: соединение висит до таймаута
+READY_RE = re.compile(r"Ready to receive updates ([\d.]+)s after start")
+
+GENERATE_STORE = f"""
+from data_manager import DataManager
+from models import Lot
+dm = DataManager()
+for user_id in range({USERS}):
+    url = f"https://example.com/rss?q={{user_id % {LINKS}}}"
+    dm.get_or_create_user(user_id, user_id, "user", None)
+    dm.add_subscriptions_bulk(user_id, [(url, url, None)])
+for link in range({LINKS}):
+    lots = [Lot(f"https://example.com/lot/{{link}}-{{i}}", "title", "https://example.com/lot", None) for i in range({GUIDS_PER_LINK})]
+    dm.diff_and_record(f"https://example.com/rss?q={{link}}", lots, notify=False)
+for i in range({UNPOPULATED_LINKS}):
+    url = "{UNREACHABLE_URL}".format(i)
+    dm.add_subscriptions_bulk(0, [(url, url, None)])
+dm.compact()
+dm.close()
+"""
+
+
+class StubBotApiHandler(http.server.BaseHTTPRequestHandler):
+    """Отвечает на методы Bot API, нужные для запуска в режиме опроса; getUpdates — пустой список."""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if "/getUpdates" in self.path:
+            result = []
+        elif "/getMe" in self.path:
+            result = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        else:
+            result = True
+        body = json.dumps({"ok": True, "result": result}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST
+
+
+def import_time_ms(env: dict, workdir: str) -> float:
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import bot"], cwd=workdir, env=env,
+                            capture_output=True, text=True, check=True)
+    # Формат строк: "import time: self [us] | cumulative | имя"; у самого модуля bot отступа нет.
+    for line in result.stderr.splitlines():
+        parts = [part.strip() for part in line.split("|")]
+        if len(parts) == 3 and parts[2] == "bot":
+            return int(parts[1]) / 1000
+    raise RuntimeError("bot not found in -X importtime output")
+
+
+def time_to_first_poll(env: dict, workdir: str, timeout: float = 60) -> float:
+    started = time.monotonic()
+    process = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, "bot.py")], cwd=workdir, env=env,
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    try:
+        for line in process.stdout:
+            match = READY_RE.search(line)
+            if match:
+                return float(match.group(1))
+            if time.monotonic() - started > timeout:
+                break
+        raise RuntimeError("bot did not report readiness")
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=40)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StubBotApiHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(os.environ, PYTHONPATH=REPO_DIR, BOT_TOKEN=os.environ.get("BOT_TOKEN", "0:benchmark"),
+                   TELEGRAM_API_URL=f"http://127.0.0.1:{server.server_port}/bot{{0}}/{{1}}", MONITOR_WORKERS="0", BOT_MODE="polling")
+        started = time.monotonic()
+        subprocess.run([sys.executable, "-c", GENERATE_STORE], cwd=workdir, env=env, check=True, capture_output=True)
+        print(f"store: {USERS} users, {LINKS} links x {GUIDS_PER_LINK} GUIDs, {UNPOPULATED_LINKS} unpopulated "
+              f"(generated in {time.monotonic() - started:.1f}s)")
+        imports = [import_time_ms(env, workdir) for _ in range(args.runs)]
+        print("import bot (-X importtime, includes loading the store): " + ", ".join(f"{ms:.0f}" for ms in imports) + " ms")
+        polls = [time_to_first_poll(env, workdir) for _ in range(args.runs)]
+        print("time to first getUpdates: " + ", ".join(f"{seconds:.2f}" for seconds in polls) + " s")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Замер отправки сообщений через Bot API при разных стратегиях соединений.
+
+Локальный TLS-сервер (самоподписанный сертификат, нужен openssl) отвечает на
+sendMessage; THREADS потоков отправляют по SENDS_PER_THREAD сообщений:
+  fresh      — новое соединение на каждый вызов (сессия telebot без повторного использования);
+  per-thread — сессии telebot по умолчанию, своя в каждом потоке;
+  shared     — общий пул configure_telegram_api().
+На loopback выигрыш пула — только TLS-рукопожатие; каждый режим идёт в отдельном процессе.
+
+Запуск из корня репозитория: python benchmarks/telegram_pool.py
+"""
+import argparse
+import http.server
+import json
+import os
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODES = ("fresh", "per-thread", "shared")
+THREADS = 3
+SENDS_PER_THREAD = 300
+
+
+class StubSendMessageHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        body = json.dumps({"ok": True, "result": {"message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"}}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST
+
+
+def run_mode(mode: str, port: int):
+    sys.path.insert(0, REPO_DIR)
+    os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+    import telebot
+    from telebot import apihelper
+
+    api_url = f"https://localhost:{port}/bot{{0}}/{{1}}"
+    if mode == "shared":
+        from services.telegram_api_service import configure_telegram_api
+        configure_telegram_api(api_url=api_url)
+    else:
+        apihelper.API_URL = api_url
+        if mode == "fresh":
+            apihelper.SESSION_TIME_TO_LIVE = 0
+    bot = telebot.TeleBot("0:benchmark")
+
+    def send_all():
+        for _ in range(SENDS_PER_THREAD):
+            bot.send_message(1, "benchmark")
+
+    threads = [threading.Thread(target=send_all) for _ in range(THREADS)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    print(f"{mode:>10}: {THREADS * SENDS_PER_THREAD / elapsed:.0f} sends/s ({THREADS} threads x {SENDS_PER_THREAD})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.mode:
+        return run_mode(args.mode, args.port)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        cert, key = os.path.join(workdir, "cert.pem"), os.path.join(workdir, "key.pem")
+        subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=localhost",
+                        "-addext", "subjectAltName=DNS:localhost", "-keyout", key, "-out", cert],
+                       check=True, capture_output=True)
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StubSendMessageHandler)
+        server.daemon_threads = True
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert, key)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        env = dict(os.environ, REQUESTS_CA_BUNDLE=cert)
+        print(f"{os.cpu_count()} CPU(s), TLS stand-in on 127.0.0.1:{server.server_port}")
+        for mode in MODES:
+            subprocess.run([sys.executable, os.path.abspath(__file__), "--mode", mode, "--port", str(server.server_port)],
+                           env=env, check=True)
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
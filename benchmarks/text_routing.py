@@ -0,0 +1,64 @@
+"""Замер маршрутизации текстовых сообщений: TeleBot.process_new_messages на записанных обновлениях.
+
+Двенадцать сообщений — команды, кнопки клавиатуры, ссылка torgi.gov.ru и свободный
+текст — прогоняются через обработчики бота, тела которых заменены: остаётся только
+выбор обработчика (resolve_text_route, если он есть в дереве). Так измеряется
+стоимость маршрутизации, а не самих команд.
+
+Запуск из корня репозитория: python benchmarks/text_routing.py [--tree ПУТЬ]
+--tree — другое дерево с bot.py (например, git worktree предыдущей версии) для сравнения.
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROUNDS = 5
+ITERATIONS = 3000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tree", default=REPO_DIR)
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.abspath(args.tree))
+    os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+    logging.disable(logging.CRITICAL)
+    os.chdir(tempfile.mkdtemp()) # bot.py при импорте создаёт файлы данных в текущем каталоге
+    import bot
+    from telebot.types import Update
+
+    route = getattr(bot, "resolve_text_route", None)
+    for handler in bot.bot.message_handlers:
+        handler["function"] = (lambda message: route(message.text)) if route else (lambda message: None)
+    bot.bot.threaded = False
+
+    texts = [
+        "/start", "/help", "/add https://torgi.gov.ru/new/api/public/lotcards/rss?catCode=2", "/mylinks", "/remove 1",
+        "/alias 1 дом", bot.BUTTON_MY_LINKS, bot.BUTTON_INSTRUCTION, bot.BUTTON_ADD_TRACKING,
+        "https://torgi.gov.ru/new/api/public/lotcards/rss?lotStatus=PUBLISHED,APPLICATIONS_SUBMISSION&catCode=2&byFirstVersion=true",
+        "привет, как дела?", "что-то непонятное " * 10,
+    ]
+    messages = [Update.de_json(json.dumps({"update_id": i, "message": {
+        "message_id": i, "date": 0, "chat": {"id": 1, "type": "private"},
+        "from": {"id": 1, "is_bot": False, "first_name": "bench"}, "text": text}})).message
+        for i, text in enumerate(texts)]
+
+    per_message_us = []
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        for _ in range(ITERATIONS):
+            bot.bot.process_new_messages(messages)
+        per_message_us.append((time.perf_counter() - started) / (ITERATIONS * len(messages)) * 1e6)
+    print(f"{args.tree}: routing per message median {statistics.median(per_message_us):.2f} us "
+          f"(min {min(per_message_us):.2f}, {len(bot.bot.message_handlers)} message handler(s))")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,37 @@
 
+import time
+STARTED_AT = time.monotonic() # для замера времени до начала опроса
+
 import telebot
 import logging
-import time
 import re
 import os
+import io
+import signal
 from urllib.parse import urlparse 
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.interval import IntervalTrigger
 import threading 
 
-from config import BOT_TOKEN, CHECK_INTERVAL_SECONDS, LOG_LEVEL, MAX_FETCH_ERRORS
+from config import BOT_TOKEN, CHECK_INTERVAL_SECONDS, LOG_LEVEL, MONITOR_WORKERS, BOT_MODE, WEBHOOK_URL, SHUTDOWN_TIMEOUT_SECONDS, WEBSUB_CALLBACK_URL, ADMIN_IDS, HISTORY_RETENTION_DAYS, GC_INTERVAL_HOURS
+from logging_setup import setup_logging
 from data_manager import DataManager 
+from lot_history import LotHistory
 from services.link_service import LinkService
 from services.subscription_service import SubscriptionService
 from services.fetcher_service import FetcherService
 from services.parser_service import ParserService
 from services.notification_service import NotificationService
 from services.app_service import AppService
+from services.delivery_service import DeliveryService
+from services.monitoring_service import MonitoringService
+from services.telegram_api_service import configure_telegram_api
+from services.stats_service import StatsService
+from services.rate_limit_service import RateLimitService, COST_CHEAP, COST_EXPENSIVE
 from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
 
 
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(threadName)s - %(message)s',
-    level=getattr(logging, LOG_LEVEL, logging.INFO)
-)
+# Пул разбора форкается до первого потока процесса (поток логирования, сжатие журнала) — см. ParserService.
+parser_service = ParserService()
+log_listener = setup_logging()
 logger = logging.getLogger(__name__)
 
 logging.getLogger("apscheduler.scheduler").setLevel(logging.WARNING)
@@ -33,12 +41,12 @@ logging.getLogger("requests.packages.urllib3.connectionpool").setLevel(logging.I
 
 
 # --- Инициализация сервисов ---
-data_manager = DataManager() 
+lot_history = LotHistory() if HISTORY_RETENTION_DAYS > 0 else None
+data_manager = DataManager(lot_history=lot_history)
 
 link_service = LinkService(data_manager)
 subscription_service = SubscriptionService(data_manager)
 fetcher_service = FetcherService()
-parser_service = ParserService()
 notification_service = NotificationService(data_manager)
 app_service = AppService(data_manager, link_service, subscription_service)
 
@@ -73,129 +81,31 @@ def create_device_selection_keyboard():
     markup.add(btn_phone, btn_pc)
     return markup
 
-# --- Monitoring Service (Background Worker) ---
-class MonitoringService:
-    def __init__(self, bot_instance: telebot.TeleBot, dm: DataManager, fs: FetcherService, ps: ParserService, ns: NotificationService, ls: LinkService):
-        self.bot = bot_instance
-        self.data_manager = dm
-        self.fetcher_service = fs
-        self.parser_service = ps
-        self.notification_service = ns
-        self.link_service = ls 
-
-    def _process_single_link(self, link_info_dict: dict):
-        normalized_url = link_info_dict['normalized_url']
-        logger.info(f"Checking link: {normalized_url}")
-
-        try:
-            content = self.fetcher_service.fetch_url_content(normalized_url)
-            if content is None:
-                logger.warning(f"Failed to fetch content for link {normalized_url} after retries.")
-                self.data_manager.update_link_check_status(normalized_url, error_increment=1)
-                link_data_for_deactivation_check = self.data_manager.get_link(normalized_url) 
-                if link_data_for_deactivation_check and self.link_service.deactivate_link_due_to_errors(normalized_url, MAX_FETCH_ERRORS): 
-                    subscribers = self.data_manager.get_active_subscribers_for_link(normalized_url)
-                    original_url_display = link_data_for_deactivation_check.get('original_url_example', normalized_url)
-                    for sub_user_info in subscribers:
-                        self.notification_service.send_link_deactivated_notification(
-                            self.bot, sub_user_info['chat_id'], sub_user_info['user_id'], original_url_display
-                        )
-                return
-
-            parsed_lots = self.parser_service.parse_rss_feed(content)
-            if parsed_lots is None: 
-                logger.warning(f"Failed to parse content or feed is empty for link {normalized_url}.")
-                self.data_manager.update_link_check_status(normalized_url, success=True) 
-                return
-
-            known_guids = self.data_manager.get_known_lot_guids_for_link(normalized_url)
-            new_lots_data = [lot for lot in parsed_lots if lot['guid'] not in known_guids]
-
-            if new_lots_data:
-                logger.info(f"Found {len(new_lots_data)} new lot(s) for link {normalized_url}.")
-                self.data_manager.add_lots_to_known(normalized_url, new_lots_data)
-                
-                subscribers = self.data_manager.get_active_subscribers_for_link(normalized_url)
-                for user_sub_info in subscribers:
-                    user_check = self.data_manager.get_user(user_sub_info['user_id'])
-                    if user_check and user_check.get('is_active'):
-                        for lot_data in new_lots_data:
-
-                            self.notification_service.send_new_lot_notification(
-                                self.bot, user_sub_info['chat_id'], user_sub_info['user_id'], lot_data, normalized_url
-                            )
-                    else:
-                        logger.info(f"Skipping notification for inactive user {user_sub_info['user_id']} for link {normalized_url}")
-            else:
-                logger.debug(f"No new lots for link {normalized_url}.")
-
-            self.data_manager.update_link_check_status(normalized_url, success=True)
-
-        except Exception as e:
-            logger.error(f"Unhandled error processing link {normalized_url}: {e}", exc_info=True)
-            self.data_manager.update_link_check_status(normalized_url, error_increment=1)
-
-            link_data_for_deactivation_check = self.data_manager.get_link(normalized_url)
-            if link_data_for_deactivation_check and self.link_service.deactivate_link_due_to_errors(normalized_url, MAX_FETCH_ERRORS):
-                subscribers = self.data_manager.get_active_subscribers_for_link(normalized_url)
-                original_url_display = link_data_for_deactivation_check.get('original_url_example', normalized_url)
-                for sub_user_info in subscribers:
-                    self.notification_service.send_link_deactivated_notification(
-                        self.bot, sub_user_info['chat_id'], sub_user_info['user_id'], original_url_display
-                    )
-
-
-    def check_all_active_links(self):
-        logger.info("Starting periodic link check job...")
-        try:
-            active_links_info_list = self.data_manager.get_all_active_subscribed_links_info()
-            
-            if not active_links_info_list:
-                logger.info("No active links with subscriptions to check.")
-                return
-
-            logger.info(f"Found {len(active_links_info_list)} active links to check.")
-            for link_info_dict in active_links_info_list:
-
-                self._process_single_link(link_info_dict) 
-                time.sleep(0.5)
-        except Exception as e:
-            logger.error(f"Critical error in check_all_active_links job: {e}", exc_info=True)
-        finally:
-            logger.info("Finished periodic link check job.")
-
-    def populate_initial_lots(self, normalized_url: str):
-        try:
-            link_data = self.data_manager.get_link(normalized_url)
-            if not link_data or not link_data.get('is_active', True):
-                logger.warning(f"Cannot populate initial lots for inactive or non-existent link: {normalized_url}")
-                return
-
-            logger.info(f"Populating initial lots for link: {normalized_url}")
-            content = self.fetcher_service.fetch_url_content(normalized_url)
-            if content is None:
-                logger.warning(f"Failed to fetch content for initial population of link: {normalized_url}.")
-                self.data_manager.update_link_check_status(normalized_url, error_increment=1)
-                return
-
-            parsed_lots = self.parser_service.parse_rss_feed(content)
-            if parsed_lots is None: 
-                logger.warning(f"Failed to parse content for initial population of link: {normalized_url}.")
-
-                return
-            
-            added_count = self.data_manager.add_lots_to_known(normalized_url, parsed_lots)
-            logger.info(f"Initially populated {added_count} lots for link: {normalized_url}.")
-            self.data_manager.update_link_check_status(normalized_url, success=True) 
-        except Exception as e:
-            logger.error(f"Error populating initial lots for link {normalized_url}: {e}", exc_info=True)
-
-
 # --- Экземпляр бота Telebot ---
-bot = telebot.TeleBot(BOT_TOKEN, parse_mode="MarkdownV2")
+configure_telegram_api()
+# В режиме вебхука обработчики выполняют потоки WebhookService, читающие ограниченную очередь:
+# собственный пул TeleBot с неограниченной очередью свёл бы на нет 503 при перегрузке.
+bot = telebot.TeleBot(BOT_TOKEN, parse_mode="MarkdownV2", threaded=BOT_MODE != "webhook")
+delivery_service = DeliveryService(bot, notification_service, data_manager)
 monitoring_service = MonitoringService(
-    bot, data_manager, fetcher_service, parser_service, notification_service, link_service
+    data_manager, fetcher_service, parser_service, link_service, delivery_service.queue,
+    backpressure=delivery_service.backpressure
 )
+# Воркеры и вебхук нужны не в каждом режиме — их модули (и APScheduler воркера) импортируются только при необходимости.
+rate_limit_service = RateLimitService()
+stats_service = StatsService(data_manager, delivery_service, fetcher_service, rate_limit_service=rate_limit_service)
+worker_service = None
+if MONITOR_WORKERS > 0:
+    from services.worker_service import WorkerService
+    worker_service = WorkerService(data_manager, delivery_service.queue, MONITOR_WORKERS)
+webhook_service = None
+if BOT_MODE == "webhook":
+    from services.webhook_service import WebhookService
+    webhook_service = WebhookService(bot)
+websub_service = None
+if WEBSUB_CALLBACK_URL:
+    from services.websub_service import WebSubService
+    websub_service = WebSubService(data_manager, monitoring_service)
 
 # --- Вспомогательная функция для отправки сообщений с клавиатурой ---
 def send_message_with_keyboard(chat_id, text, **kwargs):
@@ -263,17 +173,33 @@ def send_instruction_photo_safe(chat_id, user_id, photo_file_name, caption):
         return False
 
 
+# --- Ограничение частоты команд ---
+def is_rate_limited(user_id: int, cost: str = COST_CHEAP):
+    """См. RateLimitService.check; администраторы не ограничиваются."""
+    if user_id in ADMIN_IDS:
+        return False, 0.0, False
+    allowed, retry_after, notify = rate_limit_service.check(user_id, cost)
+    return not allowed, retry_after, notify
+
+def throttled_text(retry_after: float) -> str:
+    return f"Слишком много запросов\\. Повторите через {max(1, round(retry_after))} с\\."
+
+def reject_if_rate_limited(message: telebot.types.Message, cost: str = COST_CHEAP) -> bool:
+    """True — сообщение не обрабатывается; об ограничении пользователь узнаёт один раз, остальное отбрасывается молча."""
+    limited, retry_after, notify = is_rate_limited(message.from_user.id, cost)
+    if limited and notify:
+        reply_to_message_with_keyboard(message, throttled_text(retry_after))
+    return limited
+
+
 # --- Обработчики команд Telebot ---
-@bot.message_handler(commands=['start', 'help'])
 def handle_start(message: telebot.types.Message):
     response_text = app_service.handle_start_command(message.from_user, message.chat.id)
     bot.reply_to(message, response_text, parse_mode="MARKDOWN", reply_markup=main_keyboard)
 
-@bot.message_handler(commands=['donate'])
 def handle_donate(message: telebot.types.Message):
     send_instruction_photo_safe(message.chat.id, message.from_user.id, 'my_QR.png', "`2202206334975815`\nСбер\\)💕")
 
-@bot.message_handler(commands=['add'])
 def handle_add_command(message: telebot.types.Message):
     try:
 
@@ -286,10 +212,10 @@ def handle_add_command(message: telebot.types.Message):
         
         normalized_url = link_service.normalize_url(url_to_add)
         if normalized_url and ("Вы подписались" in response_text or "уже подписаны" in response_text):
-            link_data = data_manager.get_link(normalized_url) 
-            if link_data and not data_manager.get_known_lot_guids_for_link(normalized_url): 
+            link = data_manager.get_link(normalized_url) 
+            if link and not link.known_lot_guids: 
                 logger.info(f"Scheduling initial population for new/renewed subscription (command): {normalized_url}")
-                threading.Thread(target=monitoring_service.populate_initial_lots, args=(normalized_url,)).start()
+                monitoring_service.start_initial_population([normalized_url])
     except IndexError:
         response_text = "Пожалуйста, укажите URL после команды /add\\. Пример: `/add https://example.com`"
     except Exception as e:
@@ -297,7 +223,6 @@ def handle_add_command(message: telebot.types.Message):
         response_text = "Произошла ошибка при добавлении ссылки\\."
     reply_to_message_with_keyboard(message, response_text)
 
-@bot.message_handler(commands=['alias'])
 def handle_alias_cmd(message: telebot.types.Message):
     try:
         args_str = message.text.split(maxsplit=1)[1] if len(message.text.split(maxsplit=1)) > 1 else ""
@@ -312,35 +237,27 @@ def handle_alias_cmd(message: telebot.types.Message):
         response_text = "Произошла ошибка при установке алиаса\\."
     reply_to_message_with_keyboard(message, response_text)
 
-URL_REGEX = r'(?i)\b((?:https?://|www\d{0,3}[.]|[a-z0-9.\-]+[.][a-z]{2,4}/)(?:[^\s()<>]+|\(([^\s()<>]+|(\([^\s()<>]+\)))*\))+(?:\(([^\s()<>]+|(\([^\s()<>]+\)))*\)|[^\s`!()\[\]{};:\'".,<>?«»“”‘’]))'
+URL_PATTERN = re.compile(r'(?i)\b((?:https?://|www\d{0,3}[.]|[a-z0-9.\-]+[.][a-z]{2,4}/)(?:[^\s()<>]+|\(([^\s()<>]+|(\([^\s()<>]+\)))*\))+(?:\(([^\s()<>]+|(\([^\s()<>]+\)))*\)|[^\s`!()\[\]{};:\'".,<>?«»“”‘’]))')
 
-@bot.message_handler(func=lambda message: re.match(URL_REGEX, message.text.strip()) is not None and \
-                                        not message.text.lower().startswith(("/add", "/remove", "/start", "/help", "/mylinks")) and \
-                                        message.text not in [BUTTON_INSTRUCTION, BUTTON_MY_LINKS, BUTTON_SUPPORT, BUTTON_ADD_TRACKING, BUTTON_SUBSCRIPTION])
 def handle_url_message(message: telebot.types.Message):
     url_to_add = message.text.strip()
 
-    if message.text.lower().startswith(("/add", "/remove", "/start", "/help", "/mylinks")):
-        return 
-        
     response_text = app_service.handle_add_link(message.from_user, message.chat.id, url_to_add)
     
     normalized_url = link_service.normalize_url(url_to_add)
     if normalized_url and ("Вы подписались" in response_text or "уже подписаны" in response_text):
-        link_data = data_manager.get_link(normalized_url)
-        if link_data and not link_data.get("known_lot_guids"):
+        link = data_manager.get_link(normalized_url)
+        if link and not link.known_lot_guids:
             logger.info(f"Scheduling initial population for new/renewed subscription (direct URL): {normalized_url}")
-            threading.Thread(target=monitoring_service.populate_initial_lots, args=(normalized_url,)).start()
+            monitoring_service.start_initial_population([normalized_url])
             
     bot.reply_to(message, response_text, reply_markup=main_keyboard)
 
 
-@bot.message_handler(commands=['mylinks'])
 def handle_my_links(message: telebot.types.Message):
     response_text = app_service.handle_my_links(message.from_user, message.chat.id)
     bot.reply_to(message, response_text, disable_web_page_preview=True, reply_markup=main_keyboard)
 
-@bot.message_handler(commands=['remove'])
 def handle_remove_link_command(message: telebot.types.Message):
     try:
         parts = message.text.split(maxsplit=1)
@@ -355,19 +272,89 @@ def handle_remove_link_command(message: telebot.types.Message):
         response_text = "Произошла ошибка при удалении подписки\\."
     reply_to_message_with_keyboard(message, response_text)
 
+def schedule_initial_population(normalized_urls):
+    pending = [url for url in normalized_urls if (link := data_manager.get_link(url)) and not link.known_lot_guids]
+    if pending:
+        logger.info(f"Scheduling initial population for {len(pending)} imported link(s).")
+        monitoring_service.start_initial_population(pending, name="ImportPopulation")
+
+def handle_import_command(message: telebot.types.Message):
+    parts = message.text.split(maxsplit=1)
+    try:
+        response_text, subscribed_urls = app_service.handle_import(message.from_user, message.chat.id, parts[1] if len(parts) > 1 else "")
+        schedule_initial_population(subscribed_urls)
+    except Exception as e:
+        logger.error(f"Error in /import handler: {e}", exc_info=True)
+        response_text = "Произошла ошибка при импорте ссылок\\."
+    reply_to_message_with_keyboard(message, response_text, disable_web_page_preview=True)
+
+MAX_IMPORT_FILE_BYTES = 64 * 1024
+
+@bot.message_handler(content_types=['document'])
+def handle_import_document(message: telebot.types.Message):
+    if reject_if_rate_limited(message, COST_EXPENSIVE):
+        return
+    document = message.document
+    is_import = (message.caption or "").strip().startswith("/import") or \
+                document.mime_type == "text/plain" or (document.file_name or "").lower().endswith(".txt")
+    if not is_import:
+        reply_to_message_with_keyboard(message, "Файлы принимаются только для импорта ссылок: отправьте \\.txt с подписью /import\\.")
+        return
+    if document.file_size and document.file_size > MAX_IMPORT_FILE_BYTES:
+        reply_to_message_with_keyboard(message, "Файл слишком большой для импорта\\.")
+        return
+    try:
+        content = bot.download_file(bot.get_file(document.file_id).file_path).decode("utf-8", errors="replace")
+        response_text, subscribed_urls = app_service.handle_import(message.from_user, message.chat.id, content)
+        schedule_initial_population(subscribed_urls)
+    except Exception as e:
+        logger.error(f"Error importing document from user {message.from_user.id}: {e}", exc_info=True)
+        response_text = "Не удалось прочитать файл для импорта\\."
+    reply_to_message_with_keyboard(message, response_text, disable_web_page_preview=True)
+
+def handle_export_command(message: telebot.types.Message):
+    try:
+        response_text, content = app_service.handle_export(message.from_user, message.chat.id)
+        if content is None:
+            reply_to_message_with_keyboard(message, response_text)
+            return
+        document = telebot.types.InputFile(io.BytesIO(content.encode("utf-8")), file_name="subscriptions.txt")
+        bot.send_document(message.chat.id, document, caption=response_text, reply_markup=main_keyboard)
+    except Exception as e:
+        logger.error(f"Error in /export handler: {e}", exc_info=True)
+        reply_to_message_with_keyboard(message, "Произошла ошибка при экспорте подписок\\.")
+
+def handle_stats_command(message: telebot.types.Message):
+    # Для остальных команда не существует — отвечаем как на неизвестную.
+    if message.from_user.id not in ADMIN_IDS:
+        handle_unknown_text(message)
+        return
+    try:
+        response_text = stats_service.render_stats()
+    except Exception as e:
+        logger.error(f"Error in /stats handler: {e}", exc_info=True)
+        response_text = "Не удалось собрать статистику\\."
+    reply_to_message_with_keyboard(message, response_text)
+
+def handle_search_command(message: telebot.types.Message):
+    parts = message.text.split(maxsplit=1)
+    try:
+        response_text = app_service.handle_search(message.from_user, message.chat.id, parts[1] if len(parts) > 1 else "")
+    except Exception as e:
+        logger.error(f"Error in /search handler: {e}", exc_info=True)
+        response_text = "Произошла ошибка при поиске\\."
+    reply_to_message_with_keyboard(message, response_text, disable_web_page_preview=True)
+
 # --- Обработчики кнопок ---
-@bot.message_handler(func=lambda message: message.text == BUTTON_INSTRUCTION)
 def handle_instruction_button(message: telebot.types.Message):
     keyboard = create_device_selection_keyboard()
     bot.reply_to(message, "Выберите ваше устройство:", reply_markup=keyboard)
 
 
-@bot.message_handler(func=lambda message: message.text == BUTTON_MY_LINKS)
 def handle_my_links_button(message: telebot.types.Message):
     handle_my_links(message)
 
 
-@bot.message_handler(func=lambda message: message.text == BUTTON_SUPPORT)
 def handle_support_button(message: telebot.types.Message):
     support_text = (
         "По техническим вопросам обращайтесь в службу [поддержки](https://t.me/TorgiBotSupport)\\, она поможет решить проблемы\\."  # Замените на реальный Telegram аккаунт
@@ -375,12 +362,10 @@ def handle_support_button(message: telebot.types.Message):
     reply_to_message_with_keyboard(message, support_text, parse_mode="MarkdownV2")
 
 
-@bot.message_handler(func=lambda message: message.text == BUTTON_ADD_TRACKING)
 def handle_add_tracking_button(message: telebot.types.Message):
     reply_to_message_with_keyboard(message, "Пожалуйста\\, отправьте ссылку\\, которую вы хотите отслеживать\\.")
 
 
-@bot.message_handler(func=lambda message: message.text == BUTTON_SUBSCRIPTION)
 def handle_subscription_button(message: telebot.types.Message):
     send_instruction_photo_safe(message.chat.id, message.from_user.id, 'my_QR.png', "`2202206334975815`\nСбер\\)💕")
 
@@ -393,6 +378,14 @@ def handle_instruction_choice(call: telebot.types.CallbackQuery):
     user_id = call.from_user.id
     message_id = call.message.message_id
 
+    limited, retry_after, _ = is_rate_limited(user_id)
+    if limited:
+        try:
+            bot.answer_callback_query(call.id, throttled_text(retry_after).replace("\\", ""))
+        except Exception as e:
+            logger.warning(f"Failed to answer throttled callback: {e}")
+        return
+
     try:
         bot.edit_message_reply_markup(chat_id=chat_id, message_id=message_id, reply_markup=None)
     except Exception as e:
@@ -426,71 +419,203 @@ def handle_instruction_choice(call: telebot.types.CallbackQuery):
 
 
 # Обработчик для всех остальных текстовых сообщений
-@bot.message_handler(content_types=['text'])
 def handle_unknown_text(message: telebot.types.Message):
-    if re.match(URL_REGEX, message.text.strip()):
-        if not message.text.lower().startswith(("/add", "/remove", "/start", "/help", "/mylinks")):
-            handle_url_message(message) 
-            return
-        
-
-
-
     logger.debug(f"Received unhandled text from {message.from_user.id}: {message.text[:50]}")
     bot.reply_to(message, "Неизвестная команда или неверный формат ссылки\\. Используйте /help для списка команд\\.", reply_markup=main_keyboard)
 
 
-# --- Настройка APScheduler ---
+# --- Маршрутизация текстовых сообщений ---
+# Один обработчик вместо цепочки предикатов: точное совпадение для кнопок и команд,
+# затем единственная проверка URL_PATTERN, иначе — ответ о неизвестной команде.
+COMMAND_ROUTES = {
+    "start": handle_start,
+    "help": handle_start,
+    "donate": handle_donate,
+    "add": handle_add_command,
+    "alias": handle_alias_cmd,
+    "mylinks": handle_my_links,
+    "remove": handle_remove_link_command,
+    "import": handle_import_command,
+    "export": handle_export_command,
+    "stats": handle_stats_command,
+    "search": handle_search_command,
+}
+
+BUTTON_ROUTES = {
+    BUTTON_INSTRUCTION: handle_instruction_button,
+    BUTTON_MY_LINKS: handle_my_links_button,
+    BUTTON_SUPPORT: handle_support_button,
+    BUTTON_ADD_TRACKING: handle_add_tracking_button,
+    BUTTON_SUBSCRIPTION: handle_subscription_button,
+}
+
+# Создают ссылки и запускают первичное заполнение — тратят и токен дорогих команд.
+EXPENSIVE_HANDLERS = {handle_add_command, handle_url_message, handle_import_command}
+
+def resolve_text_route(text: str):
+    handler = BUTTON_ROUTES.get(text)
+    if handler is not None:
+        return handler
+    if text.startswith("/"):
+        # Как telebot.util.extract_command: "/cmd@BotName args" -> "cmd"
+        return COMMAND_ROUTES.get(text.split(maxsplit=1)[0][1:].split("@", 1)[0], handle_unknown_text)
+    if URL_PATTERN.match(text.strip()):
+        return handle_url_message
+    return handle_unknown_text
 
+@bot.message_handler(content_types=['text'])
+def route_text_message(message: telebot.types.Message):
+    handler = resolve_text_route(message.text)
+    if reject_if_rate_limited(message, COST_EXPENSIVE if handler in EXPENSIVE_HANDLERS else COST_CHEAP):
+        return
+    handler(message)
 
-scheduler = BackgroundScheduler(timezone="Europe/Moscow") 
-scheduler.add_job(
-    monitoring_service.check_all_active_links,
-    trigger=IntervalTrigger(seconds=CHECK_INTERVAL_SECONDS),
-    id="link_checker_job",
-    name="Periodic Link Checker",
-    replace_existing=True,
-    jitter=60 
-)
+
+# --- Настройка APScheduler ---
+# Первая проверка всё равно наступит не раньше CHECK_INTERVAL_SECONDS, поэтому
+# планировщик создаётся в фоне после старта опроса (см. run_deferred_startup).
+scheduler = None
+
+def start_scheduler():
+    global scheduler
+    from apscheduler.schedulers.background import BackgroundScheduler
+    from apscheduler.triggers.interval import IntervalTrigger
+
+    new_scheduler = BackgroundScheduler(timezone="Europe/Moscow")
+    if worker_service is None:
+        new_scheduler.add_job(
+            monitoring_service.check_all_active_links,
+            trigger=IntervalTrigger(seconds=CHECK_INTERVAL_SECONDS),
+            id="link_checker_job",
+            name="Periodic Link Checker",
+            replace_existing=True,
+            jitter=60 
+        )
+    if websub_service is not None:
+        new_scheduler.add_job(
+            websub_service.renew_subscriptions,
+            trigger=IntervalTrigger(minutes=10),
+            id="websub_renew_job",
+            name="WebSub Subscription Renewal",
+            replace_existing=True
+        )
+    new_scheduler.add_job(
+        stats_service.log_notify_latency,
+        trigger=IntervalTrigger(hours=1),
+        id="notify_latency_report_job",
+        name="Notify Latency Report",
+        replace_existing=True
+    )
+    if GC_INTERVAL_HOURS > 0:
+        new_scheduler.add_job(
+            data_manager.collect_garbage,
+            trigger=IntervalTrigger(hours=GC_INTERVAL_HOURS),
+            id="garbage_collection_job",
+            name="Orphaned Links and Inactive Users Cleanup",
+            replace_existing=True
+        )
+    new_scheduler.start()
+    scheduler = new_scheduler
+    logger.info(f"Scheduler started. Link check interval: {CHECK_INTERVAL_SECONDS} seconds.")
 
 # --- Основное выполнение ---
 if __name__ == '__main__':
     logger.info("Bot starting with JSON data storage...")
     
 
-    def initial_population_task_json():
-        logger.info("Performing initial population of lots for existing links on startup (JSON version)...")
+    def run_deferred_startup():
+        """Всё, что не нужно для ответа на первое обновление: загрузка feedparser,
+        планировщик, первичное заполнение ссылок без известных лотов и история для /search."""
         try:
+            parser_service.warm_up()
+            if shutdown_event.is_set():
+                return
+            start_scheduler()
+            pending = [link.url for link in data_manager.get_all_active_subscribed_links_info() if not link.known_lot_guids]
+            if pending:
+                logger.info(f"{len(pending)} link(s) have no known lots, populating in background.")
+                monitoring_service.start_initial_population(pending, name="StartupPopulation")
+            if lot_history is not None:
+                lot_history.load()
+            if websub_service is not None:
+                websub_service.renew_subscriptions()
+        except Exception as e:
+            logger.error(f"Error during deferred startup: {e}", exc_info=True)
 
-            active_links_infos = data_manager.get_all_active_subscribed_links_info() 
-            for link_info_dict in active_links_infos:
-                normalized_url = link_info_dict['normalized_url']
-                link_data = link_info_dict['data'] # Данные на момент загрузки DataManager
-                
 
-                current_link_data = data_manager.get_link(normalized_url)
-                if current_link_data and not current_link_data.get("known_lot_guids"): 
-                    logger.info(f"Link {normalized_url} has no known lots. Populating initially.")
+    def log_ready_after_first_poll():
+        """Время готовности в режиме опроса — по первому успешному getUpdates, а не по запуску цикла:
+        до него Telegram обновления боту ещё не отдал. Обёртка снимает себя после первого вызова."""
+        get_updates = bot.get_updates
 
-                    monitoring_service.populate_initial_lots(normalized_url) 
-                    time.sleep(1) 
-            logger.info("Initial population task (JSON version) finished.")
-        except Exception as e:
-            logger.error(f"Error during initial population task (JSON version): {e}", exc_info=True)
+        def get_updates_first_call(*args, **kwargs):
+            updates = get_updates(*args, **kwargs)
+            bot.get_updates = get_updates
+            logger.info(f"Ready to receive updates {time.monotonic() - STARTED_AT:.2f}s after start "
+                        f"(first getUpdates returned {len(updates)} update(s)).")
+            return updates
 
+        bot.get_updates = get_updates_first_call
 
-    initial_population_task_json()
+    shutdown_event = threading.Event()
 
-    scheduler.start()
-    logger.info(f"Scheduler started. Link check interval: {CHECK_INTERVAL_SECONDS} seconds.")
+    def request_shutdown(signum, frame):
+        logger.info(f"Received signal {signum}, shutting down...")
+        shutdown_event.set()
+        bot.stop_polling()
+
+    signal.signal(signal.SIGTERM, request_shutdown)
+
+    delivery_service.start()
+    if worker_service is not None:
+        worker_service.start()
+        logger.info(f"Link checks delegated to {MONITOR_WORKERS} monitor worker process(es).")
+    if websub_service is not None:
+        websub_service.start()
+    startup_thread = threading.Thread(target=run_deferred_startup, name="DeferredStartup", daemon=True)
+    startup_thread.start()
     
     try:
-        logger.info("Starting Telebot infinity_polling...")
-        bot.infinity_polling(logger_level=logging.INFO if LOG_LEVEL == "DEBUG" else None, long_polling_timeout=20)
+        if webhook_service is not None:
+            webhook_service.start()
+            if WEBHOOK_URL:
+                webhook_service.set_webhook(WEBHOOK_URL)
+            else:
+                logger.warning("WEBHOOK_URL is not set, webhook is not registered with Telegram (local mode).")
+            logger.info(f"Ready to receive updates {time.monotonic() - STARTED_AT:.2f}s after start.")
+            shutdown_event.wait()
+        else:
+            bot.remove_webhook() # иначе getUpdates вернёт 409, если бот раньше работал через вебхук
+            log_ready_after_first_poll()
+            logger.info("Starting Telebot infinity_polling...")
+            bot.infinity_polling(logger_level=logging.INFO if LOG_LEVEL == "DEBUG" else None, long_polling_timeout=20)
+    except KeyboardInterrupt:
+        pass
     except Exception as e:
         logger.critical(f"Bot polling failed critically: {e}", exc_info=True)
     finally:
-        logger.info("Bot shutting down...")
-        if scheduler.running:
-            scheduler.shutdown()
-            logger.info("Scheduler shut down.")
\ No newline at end of file
+        # Порядок: перестать принимать обновления и брать новые ссылки, дождаться
+        # текущих проверок, затем дослать очередь. Всё, что не успело уйти до
+        # срока, остаётся в outbox и будет отправлено после перезапуска.
+        logger.info(f"Bot shutting down (deadline {SHUTDOWN_TIMEOUT_SECONDS:.0f}s)...")
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT_SECONDS
+        remaining = lambda: max(0.0, deadline - time.monotonic())
+        if webhook_service is not None:
+            webhook_service.stop(timeout=remaining())
+        if websub_service is not None:
+            websub_service.stop(timeout=remaining())
+        startup_thread.join(timeout=remaining())
+        monitoring_service.stop(timeout=remaining())
+        if scheduler is not None and scheduler.running:
+            scheduler.shutdown(wait=True)
+            logger.info("Scheduler shut down.")
+        if worker_service is not None:
+            worker_service.stop(timeout=remaining())
+        delivery_service.stop(timeout=remaining())
+        parser_service.close()
+        data_manager.close()
+        if lot_history is not None:
+            lot_history.close()
+        logger.info("Bot stopped.")
+        if log_listener is not None:
+            log_listener.stop() # дописывает оставшиеся в очереди записи
\ No newline at end of file
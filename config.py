@@ -6,11 +6,85 @@ load_dotenv()
 
 BOT_TOKEN = os.getenv("BOT_TOKEN", "YOUR_FALLBACK_TOKEN_HERE")
 
+ADMIN_IDS = frozenset(int(user_id) for user_id in os.getenv("ADMIN_IDS", "").replace(" ", "").split(",") if user_id) # Telegram user_id через запятую, доступ к /stats
+
 CHECK_INTERVAL_SECONDS = int(os.getenv("CHECK_INTERVAL_SECONDS", 300)) 
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower() # text | json
+LOG_ASYNC = os.getenv("LOG_ASYNC", "1") == "1" # запись логов в отдельном потоке через очередь
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000)) # при переполнении записи отбрасываются, а не тормозят работу
+LOG_RATE_LIMIT_PER_MINUTE = int(os.getenv("LOG_RATE_LIMIT_PER_MINUTE", 60)) # INFO/DEBUG одного шаблона в минуту; 0 — без ограничения
 MAX_FETCH_ERRORS = int(os.getenv("MAX_FETCH_ERRORS", 5)) 
 USER_AGENT = "LotNotificationBot/1.0 (+https://your-bot-info-link.com)" # Замените на актуальную информацию
 
+JOURNAL_FSYNC = os.getenv("JOURNAL_FSYNC", "interval").lower() # always | interval | never
+JOURNAL_FSYNC_INTERVAL_SECONDS = float(os.getenv("JOURNAL_FSYNC_INTERVAL_SECONDS", 1.0))
+JOURNAL_COMPACT_BYTES = int(os.getenv("JOURNAL_COMPACT_BYTES", 4 * 1024 * 1024))
+
+MONITOR_WORKERS = int(os.getenv("MONITOR_WORKERS", 0)) # 0 — проверка ссылок в процессе бота
+MONITOR_MANAGER_ADDRESS = os.getenv("MONITOR_MANAGER_ADDRESS", "127.0.0.1:50555") # host:port или путь к unix-сокету
+MONITOR_AUTHKEY = os.getenv("MONITOR_AUTHKEY", "") # по умолчанию выводится из BOT_TOKEN
+
+PARSER_PROCESSES = int(os.getenv("PARSER_PROCESSES", 0)) # 0 — разбор лент в вызывающем потоке
+PARSER_TIMEOUT_SECONDS = float(os.getenv("PARSER_TIMEOUT_SECONDS", 60)) # дольше — разбор в пуле считается ошибкой
+PARSER_SPARE_POOLS = int(os.getenv("PARSER_SPARE_POOLS", 1)) # запасных пулов, заранее форкнутых на замену зависшему
+
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower() # polling | webhook
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "") # публичный адрес для setWebhook; пусто — не регистрировать (локальная проверка)
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8443))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "") # по умолчанию выводится из BOT_TOKEN
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", 1000))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", 4)) # потоков обработчиков, читающих очередь вебхука
+
+DELIVERY_DEDUP_WINDOW_SECONDS = float(os.getenv("DELIVERY_DEDUP_WINDOW_SECONDS", 3 * 24 * 3600)) # один лот из разных лент — одно уведомление
+DELIVERY_DEDUP_MAX_ENTRIES = int(os.getenv("DELIVERY_DEDUP_MAX_ENTRIES", 100000))
+DELIVERY_HIGH_WATERMARK = int(os.getenv("DELIVERY_HIGH_WATERMARK", 5000)) # неотправленных сообщений в outbox, с которых проверки откладываются; 0 — без ограничения
+DELIVERY_LOW_WATERMARK = int(os.getenv("DELIVERY_LOW_WATERMARK", 1000)) # ниже — проверки снова идут полностью
+BACKPRESSURE_MAX_DEFER_SECONDS = float(os.getenv("BACKPRESSURE_MAX_DEFER_SECONDS", 3600)) # дольше не проверенные ссылки проверяются и при перегрузке
+DELIVERY_RETRY_SECONDS = float(os.getenv("DELIVERY_RETRY_SECONDS", 60)) # пауза перед повтором отправок, не прошедших из-за сети или 5xx
+
+SHUTDOWN_TIMEOUT_SECONDS = float(os.getenv("SHUTDOWN_TIMEOUT_SECONDS", 30)) # сколько ждать проверок и доставки при остановке
+
+MAX_FEED_BYTES = int(os.getenv("MAX_FEED_BYTES", 10 * 1024 * 1024)) # предел размера ленты после распаковки
+FETCH_WORKERS = int(os.getenv("FETCH_WORKERS", 4)) # параллельные проверки ссылок в одном цикле
+HOST_MAX_CONCURRENCY = int(os.getenv("HOST_MAX_CONCURRENCY", 4)) # потолок AIMD-лимита запросов к одному хосту
+HOST_MIN_INTERVAL_SECONDS = float(os.getenv("HOST_MIN_INTERVAL_SECONDS", 0.5))
+HOST_LATENCY_TARGET_SECONDS = float(os.getenv("HOST_LATENCY_TARGET_SECONDS", 5.0)) # медленнее — лимит хоста уменьшается
+HOST_CIRCUIT_FAILURES = int(os.getenv("HOST_CIRCUIT_FAILURES", 5)) # ошибок подряд до открытия предохранителя
+HOST_CIRCUIT_COOLDOWN_SECONDS = float(os.getenv("HOST_CIRCUIT_COOLDOWN_SECONDS", 300))
+
+WEBSUB_CALLBACK_URL = os.getenv("WEBSUB_CALLBACK_URL", "") # публичный адрес приёмника WebSub; пусто — push-подписки выключены
+WEBSUB_LISTEN = os.getenv("WEBSUB_LISTEN", "0.0.0.0")
+WEBSUB_PORT = int(os.getenv("WEBSUB_PORT", 8444))
+WEBSUB_PATH = os.getenv("WEBSUB_PATH", "/websub")
+WEBSUB_SECRET = os.getenv("WEBSUB_SECRET", "") # по умолчанию выводится из BOT_TOKEN
+WEBSUB_LEASE_SECONDS = int(os.getenv("WEBSUB_LEASE_SECONDS", 5 * 24 * 3600))
+WEBSUB_POLL_INTERVAL_SECONDS = float(os.getenv("WEBSUB_POLL_INTERVAL_SECONDS", 6 * 3600)) # страховочный опрос лент с push-подпиской
+
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "") # свой Bot API сервер, формат telebot: http://host:port/bot{0}/{1}
+TELEGRAM_POOL_SIZE = int(os.getenv("TELEGRAM_POOL_SIZE", 8)) # соединений к Bot API: доставка + потоки обработчиков + опрос
+TELEGRAM_CONNECT_TIMEOUT = float(os.getenv("TELEGRAM_CONNECT_TIMEOUT", 5))
+TELEGRAM_READ_TIMEOUT = float(os.getenv("TELEGRAM_READ_TIMEOUT", 15))
+TELEGRAM_CONNECT_RETRIES = int(os.getenv("TELEGRAM_CONNECT_RETRIES", 2)) # только ошибки соединения: запрос не дошёл, дубля не будет
+
+NOTIFY_SLO_SECONDS = float(os.getenv("NOTIFY_SLO_SECONDS", 900)) # цель: от даты лота в ленте до отправки пользователю
+NOTIFY_SLO_QUANTILE = float(os.getenv("NOTIFY_SLO_QUANTILE", 0.9)) # доля уведомлений, которая должна укладываться в цель
+
+HISTORY_RETENTION_DAYS = float(os.getenv("HISTORY_RETENTION_DAYS", 14)) # сколько дней лоты доступны в /search; 0 — история отключена
+HISTORY_MAX_LOTS = int(os.getenv("HISTORY_MAX_LOTS", 300000)) # сверх этого старые часовые секции удаляются раньше срока (~850 байт памяти на лот)
+
+GC_INTERVAL_HOURS = float(os.getenv("GC_INTERVAL_HOURS", 24)) # как часто удалять ссылки без подписчиков и давно неактивных пользователей
+ORPHAN_LINK_GRACE_DAYS = float(os.getenv("ORPHAN_LINK_GRACE_DAYS", 7)) # ссылка без подписчиков удаляется через столько дней; 0 — не удалять
+INACTIVE_USER_RETENTION_DAYS = float(os.getenv("INACTIVE_USER_RETENTION_DAYS", 90)) # неактивный пользователь удаляется через столько дней; 0 — не удалять
+
+RATE_LIMIT_COMMANDS_PER_MINUTE = float(os.getenv("RATE_LIMIT_COMMANDS_PER_MINUTE", 20)) # любые сообщения одного пользователя; 0 — без ограничения
+RATE_LIMIT_COMMANDS_BURST = int(os.getenv("RATE_LIMIT_COMMANDS_BURST", 10))
+RATE_LIMIT_EXPENSIVE_PER_MINUTE = float(os.getenv("RATE_LIMIT_EXPENSIVE_PER_MINUTE", 4)) # /add, ссылка текстом, /import: создают ссылки и первичное заполнение
+RATE_LIMIT_EXPENSIVE_BURST = int(os.getenv("RATE_LIMIT_EXPENSIVE_BURST", 5))
+RATE_LIMIT_IDLE_SECONDS = float(os.getenv("RATE_LIMIT_IDLE_SECONDS", 600)) # ведро простаивающего пользователя удаляется из памяти
+RATE_LIMIT_MAX_USERS = int(os.getenv("RATE_LIMIT_MAX_USERS", 100000))
 
 if BOT_TOKEN == "YOUR_FALLBACK_TOKEN_HERE" or not BOT_TOKEN:
     raise ValueError("BOT_TOKEN не установлен")
\ No newline at end of file
@@ -1,34 +1,45 @@
 
 import json
 import os
+import sys
 import logging
 import threading
-from datetime import datetime, timezone
-from typing import Dict, List, Any, Optional
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Iterable, Iterator, Set, Tuple, Callable
+
+from config import JOURNAL_FSYNC, JOURNAL_FSYNC_INTERVAL_SECONDS, JOURNAL_COMPACT_BYTES, ORPHAN_LINK_GRACE_DAYS, INACTIVE_USER_RETENTION_DAYS
+from lot_history import LotHistory, HistoryLot
+from models import User, Subscription, Link, LinkHealth, NotifyLatency, Lot, LinkCheckResult, OutboxEntry, DEFAULT_LOT_SOURCE, epoch_to_iso
 
 logger = logging.getLogger(__name__)
 
 USER_DATA_FILE = "user_data.json"
 LINK_DATA_FILE = "link_data.json"
+JOURNAL_FILE = "data_journal.jsonl"
+OUTBOX_DATA_FILE = "outbox_data.json"
 
 
 user_data_lock = threading.Lock()
 link_data_lock = threading.Lock()
+outbox_lock = threading.Lock() # порядок захвата: user -> link -> outbox
+snapshot_lock = threading.Lock()
 
-def load_json_data(filename: str, lock: threading.Lock) -> Dict:
+def load_json_data(filename: str, lock: threading.Lock, object_hook: Optional[Callable[[Dict], Any]] = None) -> Dict:
     with lock:
         if not os.path.exists(filename):
             logger.info(f"File {filename} not found, will create on first save.")
             return {}
         try:
             with open(filename, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+                data = json.load(f, object_hook=object_hook)
                 return data
         except json.JSONDecodeError:
             logger.error(f"Error decoding JSON from {filename}. Returning empty data.")
             backup_filename = filename + ".corrupted_" + datetime.now().strftime("%Y%m%d%H%M%S")
             try:
-                if os.path.exists(filename): 
+                if os.path.exists(filename):
                      os.rename(filename, backup_filename)
                      logger.info(f"Corrupted file backed up to {backup_filename}")
             except Exception as e_bkp:
@@ -38,14 +49,17 @@ def load_json_data(filename: str, lock: threading.Lock) -> Dict:
             logger.error(f"Error loading {filename}: {e}")
             return {}
 
-def save_json_data(filename: str, data: Dict, lock: threading.Lock):
+def save_json_data(filename: str, data: Dict, lock: threading.Lock) -> bool:
     with lock:
+        temp_filename = filename + ".tmp"
         try:
-            temp_filename = filename + ".tmp"
             with open(temp_filename, 'w', encoding='utf-8') as f:
                 json.dump(data, f, indent=4, ensure_ascii=False)
-            os.replace(temp_filename, filename) 
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_filename, filename)
             logger.debug(f"Data saved to {filename}")
+            return True
         except Exception as e:
             logger.error(f"Error saving data to {filename}: {e}")
             if os.path.exists(temp_filename):
@@ -53,339 +67,806 @@ def save_json_data(filename: str, data: Dict, lock: threading.Lock):
                     os.remove(temp_filename)
                 except Exception as e_rem:
                     logger.error(f"Could not remove temp file {temp_filename}: {e_rem}")
+            return False
 
 
-class DataManager:
-    def __init__(self):
+class Journal:
+    """Append-only журнал изменений DataManager.
+
+    Каждая строка — одна JSON-запись со списком операций, которые применяются
+    атомарно. Операции задают абсолютные значения, поэтому повторное применение
+    журнала поверх более нового снимка безопасно.
+    """
+
+    FSYNC_POLICIES = ("always", "interval", "never")
+
+    def __init__(self, filename: str, fsync_policy: str = "interval", fsync_interval: float = 1.0):
+        if fsync_policy not in self.FSYNC_POLICIES:
+            logger.warning(f"Unknown journal fsync policy '{fsync_policy}', falling back to 'interval'.")
+            fsync_policy = "interval"
+        self.filename = filename
+        self.rotated_filename = filename + ".1"
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self._file = None
+        self._size = 0
+        self._last_fsync = 0.0
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def replay(self) -> Iterator[List[Dict[str, Any]]]:
+        for filename in (self.rotated_filename, self.filename):
+            if not os.path.exists(filename):
+                continue
+            good_end = 0 # конец последней целой записи
+            torn_at = None
+            missing_newline = False
+            with open(filename, 'rb') as f:
+                for line_no, line in enumerate(f, 1):
+                    if line.strip():
+                        try:
+                            ops = json.loads(line)["ops"]
+                        except (ValueError, KeyError, TypeError):
+                            torn_at = line_no
+                            break
+                        missing_newline = not line.endswith(b"\n")
+                        yield ops
+                    good_end += len(line)
+            # Оборванную запись после падения процесса нужно отрезать, а не только пропустить:
+            # иначе следующая запись допишется к обрывку, и при следующем запуске пропадёт уже она.
+            if torn_at is not None:
+                logger.warning(f"Journal {filename}: truncating torn record at line {torn_at} and everything after it.")
+                os.truncate(filename, good_end)
+            elif missing_newline:
+                with open(filename, 'ab') as f:
+                    f.write(b"\n")
+
+    def open(self):
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.filename, 'a', encoding='utf-8')
+                self._size = self._file.tell()
+
+    def append(self, ops: List[Dict[str, Any]]):
+        if not ops:
+            return
+        record = json.dumps({"ts": int(time.time()), "ops": ops}, ensure_ascii=False, separators=(',', ':')) + "\n"
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.filename, 'a', encoding='utf-8')
+                self._size = self._file.tell()
+            self._file.write(record)
+            self._file.flush()
+            self._size += len(record.encode('utf-8'))
+            if self.fsync_policy == "always":
+                os.fsync(self._file.fileno())
+            elif self.fsync_policy == "interval":
+                now = time.monotonic()
+                if now - self._last_fsync >= self.fsync_interval:
+                    os.fsync(self._file.fileno())
+                    self._last_fsync = now
+
+    def rotate(self):
+        """Переносит текущий журнал в .1 и начинает новый. Если .1 остался от
+        неудачной компакции, текущие записи дописываются в его конец."""
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._file.close()
+                self._file = None
+            if os.path.exists(self.filename):
+                if os.path.exists(self.rotated_filename):
+                    with open(self.filename, 'r', encoding='utf-8') as src, \
+                         open(self.rotated_filename, 'a', encoding='utf-8') as dst:
+                        dst.write(src.read())
+                        dst.flush()
+                        os.fsync(dst.fileno())
+                    os.remove(self.filename)
+                else:
+                    os.replace(self.filename, self.rotated_filename)
+            self._file = open(self.filename, 'a', encoding='utf-8')
+            self._size = 0
+
+    def discard_rotated(self):
+        if os.path.exists(self.rotated_filename):
+            os.remove(self.rotated_filename)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._file.close()
+                self._file = None
+
+
+def _snapshot_size(record: Dict[str, Any]) -> int:
+    # Примерный размер записи в снимке (save_json_data пишет с indent=4).
+    return len(json.dumps(record, indent=4, ensure_ascii=False).encode('utf-8'))
+
+
+def _file_size(filename: str) -> int:
+    try:
+        return os.path.getsize(filename)
+    except OSError:
+        return 0
+
+
+def _record_object_hook(record_type, marker_field: str) -> Callable[[Dict], Any]:
+    def hook(obj: Dict) -> Any:
+        if marker_field in obj:
+            return record_type.from_dict(None, obj)
+        return obj
+    return hook
+
 
-        self.user_data = load_json_data(USER_DATA_FILE, user_data_lock)
-        self.link_data = load_json_data(LINK_DATA_FILE, link_data_lock)
+class DataManager:
+    def __init__(self, fsync_policy: str = JOURNAL_FSYNC, fsync_interval: float = JOURNAL_FSYNC_INTERVAL_SECONDS,
+                 compact_threshold_bytes: int = JOURNAL_COMPACT_BYTES, lot_history: Optional[LotHistory] = None):
+        self.compact_threshold_bytes = compact_threshold_bytes
+        self.lot_history = lot_history # для /search; получает каждый новый лот из diff_and_record
+        self.journal = Journal(JOURNAL_FILE, fsync_policy, fsync_interval)
+        self._compaction_lock = threading.Lock()
+
+        self.users: Dict[int, User] = {}
+        self.links: Dict[str, Link] = {}
+        self.outbox: Dict[str, OutboxEntry] = {}
+        self.outbox_pending_sends = 0 # неподтверждённых пар (лот, получатель) в outbox — глубина доставки для backpressure
+        self.check_cycles: Dict[str, Dict[str, Any]] = {} # последний цикл проверок по каждому процессу/шарду, только в памяти
+        self.notify_latency = NotifyLatency() # по всем ссылкам; по каждой — Link.latency, тоже только в памяти
+        self._load()
+
+    def _load(self):
+        # Записи создаются прямо во время разбора JSON (object_hook), поэтому словари
+        # из файла не висят в памяти целиком одновременно с записями.
+        user_data = load_json_data(USER_DATA_FILE, user_data_lock, _record_object_hook(User, "chat_id"))
+        for user_id_str, user in user_data.items():
+            if not isinstance(user, User):
+                user = User.from_dict(user_id_str, user)
+            user.user_id = int(user_id_str)
+            self.users[user.user_id] = user
+        del user_data
+
+        link_data = load_json_data(LINK_DATA_FILE, link_data_lock, _record_object_hook(Link, "original_url_example"))
+        for url, link in link_data.items():
+            if not isinstance(link, Link):
+                link = Link.from_dict(url, link)
+            link.url = sys.intern(url)
+            self.links[link.url] = link
+        del link_data
+
+        outbox_data = load_json_data(OUTBOX_DATA_FILE, outbox_lock)
+        for outbox_id, entry in outbox_data.items():
+            self.outbox[outbox_id] = OutboxEntry.from_dict(outbox_id, entry)
+        del outbox_data
+
+        replayed = 0
+        for ops in self.journal.replay():
+            for op in ops:
+                self._apply_journal_op(op)
+            replayed += 1
+        if replayed:
+            logger.info(f"Replayed {replayed} journal record(s) over the last snapshot.")
+        self.outbox_pending_sends = sum(len(entry.recipients) for entry in self.outbox.values())
+
+        self.journal.open()
+        if os.path.exists(self.journal.rotated_filename):
+            # Недописанное сжатие прошлого запуска доделывается в фоне: данные уже в памяти,
+            # а повторный разбор ротированного журнала при сбое безопасен.
+            threading.Thread(target=self.compact, name="JournalCompaction", daemon=True).start()
+
+    def _apply_journal_op(self, op: Dict[str, Any]):
+        collection_name, kind, key = op.get("c"), op.get("op"), op.get("k")
+        if collection_name == "outbox":
+            self._apply_outbox_op(kind, key, op.get("v"))
+            return
+        if collection_name == "users":
+            collection, record_type, key = self.users, User, int(key)
+        elif collection_name == "links":
+            collection, record_type = self.links, Link
+        else:
+            logger.warning(f"Journal op for unknown collection skipped: {op}")
+            return
+
+        if kind == "put":
+            collection[key] = record_type.from_dict(op["k"], op["v"])
+        elif kind == "set":
+            if key in collection:
+                collection[key].update_from_dict(op["v"])
+        elif kind == "del":
+            collection.pop(key, None)
+        elif kind == "add_guids":
+            if key in collection:
+                collection[key].known_lot_guids.update(dict.fromkeys(op["v"]))
+        else:
+            logger.warning(f"Unknown journal op skipped: {op}")
+
+    def _apply_outbox_op(self, kind: str, outbox_id: str, value: Any):
+        if kind == "put":
+            self.outbox[outbox_id] = OutboxEntry.from_dict(outbox_id, value)
+        elif kind == "ack":
+            entry = self.outbox.get(outbox_id)
+            if entry is not None:
+                for user_id in value:
+                    entry.recipients.pop(user_id, None)
+                if not entry.recipients:
+                    del self.outbox[outbox_id]
+        else:
+            logger.warning(f"Unknown outbox journal op skipped: {kind} {outbox_id}")
 
-    def _get_current_utc_iso(self) -> str:
-        return datetime.now(timezone.utc).isoformat()
-    
-    def _ensure_subscription_format_for_user(self, user_id_str: str, current_user_data: Dict) -> bool:
+    def _commit(self, ops: List[Dict[str, Any]]):
+        # Вызывается под блокировкой изменяемой коллекции, чтобы порядок записей
+        # в журнале совпадал с порядком изменений в памяти.
+        self.journal.append(ops)
+        if self.journal.size >= self.compact_threshold_bytes and not self._compaction_lock.locked():
+            threading.Thread(target=self.compact, name="JournalCompaction", daemon=True).start()
 
-        user = current_user_data.get(user_id_str)
-        if not user:
+    def compact(self) -> bool:
+        if not self._compaction_lock.acquire(blocking=False):
             return False
-        
-        subscriptions = user.get("subscriptions")
-        if not subscriptions: 
-            user["subscriptions"] = []
-            return False 
-
-        if isinstance(subscriptions, list) and len(subscriptions) > 0 and isinstance(subscriptions[0], str):
-            logger.info(f"Converting subscriptions format for user {user_id_str} from List[str] to List[Dict]")
-            user["subscriptions"] = [{"url": u, "alias": None} for u in subscriptions]
-            return True
-        elif isinstance(subscriptions, list) and \
-             all(isinstance(s, dict) and "url" in s for s in subscriptions):
-            return False 
-        elif isinstance(subscriptions, list) and not subscriptions:
-             return False
-        else:
-         
-            logger.warning(f"User {user_id_str} has subscriptions in an unexpected format: {type(subscriptions)}. Resetting to empty list.")
-            user["subscriptions"] = []
-            return True 
+        try:
+            with user_data_lock, link_data_lock, outbox_lock:
+                users_snapshot = {str(user_id): user.to_dict() for user_id, user in self.users.items()}
+                links_snapshot = {url: link.to_dict() for url, link in self.links.items()}
+                outbox_snapshot = {outbox_id: entry.to_dict() for outbox_id, entry in self.outbox.items()}
+                self.journal.rotate()
+
+            if save_json_data(USER_DATA_FILE, users_snapshot, snapshot_lock) and \
+               save_json_data(LINK_DATA_FILE, links_snapshot, snapshot_lock) and \
+               save_json_data(OUTBOX_DATA_FILE, outbox_snapshot, snapshot_lock):
+                self.journal.discard_rotated()
+                logger.info("Journal compacted into new snapshot.")
+                return True
+            logger.error("Journal compaction failed, rotated journal kept for replay.")
+            return False
+        finally:
+            self._compaction_lock.release()
+
+    def close(self):
+        self.journal.close()
+
+    def _now_epoch(self) -> int:
+        return int(time.time())
+
+    def _set_user_subscriptions(self, user: User, subscriptions: Tuple[Subscription, ...]):
+        user.subscriptions = subscriptions
+        self._commit([{"c": "users", "op": "set", "k": str(user.user_id),
+                       "v": {"subscriptions": [s.to_dict() for s in subscriptions]}}])
 
     # --- Методы для пользователей ---
-    def get_or_create_user(self, user_id: int, chat_id: int, first_name: Optional[str], username: Optional[str]) -> Dict:
-        user_id_str = str(user_id)
-       
-        current_user_data = load_json_data(USER_DATA_FILE, user_data_lock)
-        
-        needs_save = False
-        if user_id_str not in current_user_data:
-            current_user_data[user_id_str] = {
-                "chat_id": chat_id,
-                "first_name": first_name,
-                "username": username,
-                "is_active": True,
-                "subscriptions": [],
-                "joined_at": self._get_current_utc_iso()
-            }
-            needs_save = True
-            logger.info(f"New user created: {user_id_str}")
-        else: 
-            user = current_user_data[user_id_str]
-            if user.get("first_name") != first_name or \
-               user.get("username") != username or \
-               not user.get("is_active", True) or \
-               user.get("chat_id") != chat_id : 
-                user["first_name"] = first_name
-                user["username"] = username
-                user["is_active"] = True
-                user["chat_id"] = chat_id 
-                needs_save = True
-                logger.info(f"User {user_id_str} data updated and activated.")
-
-            if self._ensure_subscription_format_for_user(user_id_str, current_user_data):
-                needs_save = True
-        
-        if needs_save:
-            save_json_data(USER_DATA_FILE, current_user_data, user_data_lock)
-        self.user_data = current_user_data 
-        return current_user_data[user_id_str]
-
-    def get_user(self, user_id: int) -> Optional[Dict]:
-       
-        current_user_data = load_json_data(USER_DATA_FILE, user_data_lock)
-        self.user_data = current_user_data
-        return current_user_data.get(str(user_id))
-    
+    def get_or_create_user(self, user_id: int, chat_id: int, first_name: Optional[str], username: Optional[str]) -> User:
+        with user_data_lock:
+            user = self.users.get(user_id)
+            if user is None:
+                user = User(user_id, chat_id, first_name, username, joined_at=self._now_epoch())
+                self.users[user_id] = user
+                self._commit([{"c": "users", "op": "put", "k": str(user_id), "v": user.to_dict()}])
+                logger.info(f"New user created: {user_id}")
+            elif user.first_name != first_name or \
+                 user.username != username or \
+                 not user.is_active or \
+                 user.chat_id != chat_id:
+                user.first_name = first_name
+                user.username = username
+                user.is_active = True
+                user.chat_id = chat_id
+                user.deactivated_at = None
+                self._commit([{"c": "users", "op": "set", "k": str(user_id),
+                               "v": {"first_name": first_name, "username": username, "is_active": True, "chat_id": chat_id,
+                                     "deactivated_at": None}}])
+                logger.info(f"User {user_id} data updated and activated.")
+            return user
+
+    def get_user(self, user_id: int) -> Optional[User]:
+        return self.users.get(user_id)
+
     def set_user_active_status(self, user_id: int, is_active: bool):
-        user_id_str = str(user_id)
-        current_user_data = load_json_data(USER_DATA_FILE, user_data_lock)
-        if user_id_str in current_user_data:
-            if current_user_data[user_id_str]["is_active"] != is_active:
-                current_user_data[user_id_str]["is_active"] = is_active
-                save_json_data(USER_DATA_FILE, current_user_data, user_data_lock)
-                self.user_data = current_user_data
-                logger.info(f"User {user_id_str} active status set to {is_active}")
+        with user_data_lock:
+            user = self.users.get(user_id)
+            if user is not None and user.is_active != is_active:
+                user.is_active = is_active
+                user.deactivated_at = None if is_active else self._now_epoch()
+                self._commit([{"c": "users", "op": "set", "k": str(user_id),
+                               "v": {"is_active": is_active, "deactivated_at": epoch_to_iso(user.deactivated_at)}}])
+                logger.info(f"User {user_id} active status set to {is_active}")
 
      # --- Методы для ссылок ---
-    def get_or_create_link(self, normalized_url: str, original_url_example: str) -> Dict:
-        current_link_data = load_json_data(LINK_DATA_FILE, link_data_lock)
-        needs_save = False
-        if normalized_url not in current_link_data:
-            current_link_data[normalized_url] = {
-                "original_url_example": original_url_example,
-                "last_checked": None,
-                "error_count": 0,
-                "is_active": True,
-                "known_lot_guids": [],
-                "added_at": self._get_current_utc_iso()
-            }
-            needs_save = True
+    def _upsert_link(self, normalized_url: str, original_url_example: str, ops: List[Dict[str, Any]]) -> Link:
+        # Вызывается под link_data_lock; операции журнала добавляются в ops, запись — на вызывающем.
+        link = self.links.get(normalized_url)
+        if link is None:
+            link = Link(normalized_url, original_url_example, added_at=self._now_epoch())
+            self.links[link.url] = link
+            ops.append({"c": "links", "op": "put", "k": link.url, "v": link.to_dict()})
             logger.info(f"New link created: {normalized_url}")
-        elif not current_link_data[normalized_url].get("is_active", True): 
-            current_link_data[normalized_url]["is_active"] = True
-            current_link_data[normalized_url]["error_count"] = 0
-            
-            current_link_data[normalized_url]["original_url_example"] = original_url_example 
-            needs_save = True
+        elif not link.is_active:
+            link.is_active = True
+            link.error_count = 0
+            link.original_url_example = original_url_example
+            ops.append({"c": "links", "op": "set", "k": link.url,
+                        "v": {"is_active": True, "error_count": 0, "original_url_example": original_url_example}})
             logger.info(f"Link {normalized_url} reactivated.")
-        
-        if needs_save:
-            save_json_data(LINK_DATA_FILE, current_link_data, link_data_lock)
-        self.link_data = current_link_data
-        return current_link_data[normalized_url]
-
-    def get_link(self, normalized_url: str) -> Optional[Dict]:
-        current_link_data = load_json_data(LINK_DATA_FILE, link_data_lock)
-        self.link_data = current_link_data
-        return current_link_data.get(normalized_url)
-
-    def get_all_active_subscribed_links_info(self) -> List[Dict[str, Any]]:
-        current_user_data = load_json_data(USER_DATA_FILE, user_data_lock)
-        current_link_data = load_json_data(LINK_DATA_FILE, link_data_lock)
-        self.user_data = current_user_data 
-        self.link_data = current_link_data 
-
-        active_links_to_check = []
+        if link.orphaned_at is not None:
+            # Ссылку сейчас подпишут: collect_garbage отсчитает срок заново, если подписка так и не появится.
+            link.orphaned_at = None
+            ops.append({"c": "links", "op": "set", "k": link.url, "v": {"orphaned_at": None}})
+        return link
+
+    def get_or_create_link(self, normalized_url: str, original_url_example: str) -> Link:
+        with link_data_lock:
+            ops: List[Dict[str, Any]] = []
+            link = self._upsert_link(normalized_url, original_url_example, ops)
+            if ops:
+                self._commit(ops)
+            return link
+
+    def get_link(self, normalized_url: str) -> Optional[Link]:
+        return self.links.get(normalized_url)
+
+    def get_all_active_subscribed_links_info(self) -> List[Link]:
         subscribed_urls = set()
+        with user_data_lock:
+            for user in self.users.values():
+                if user.is_active:
+                    for sub in user.subscriptions:
+                        subscribed_urls.add(sub.url)
+
+        with link_data_lock:
+            return [link for link in (self.links.get(url) for url in subscribed_urls) if link and link.is_active]
+
+    def get_overdue_link_urls(self, max_age_seconds: float) -> Set[str]:
+        """Активные ссылки, не проверявшиеся дольше max_age_seconds (или ни разу)."""
+        threshold = self._now_epoch() - max_age_seconds
+        with link_data_lock:
+            return {link.url for link in self.links.values()
+                    if link.is_active and (link.last_checked is None or link.last_checked < threshold)}
+
+    def get_active_link_urls(self) -> List[str]:
+        return [link.url for link in self.get_all_active_subscribed_links_info()]
 
-        users_to_save = False
-
-        for user_id_str, user_info_copy in list(current_user_data.items()): 
-            user_info = current_user_data[user_id_str]
-            if self._ensure_subscription_format_for_user(user_id_str, current_user_data):
-                users_to_save = True
-
-            if user_info.get("is_active", False):
-                for sub_dict in user_info.get("subscriptions", []):
-                    subscribed_urls.add(sub_dict["url"])
-        
-        if users_to_save:
-            save_json_data(USER_DATA_FILE, current_user_data, user_data_lock)
-            self.user_data = current_user_data 
-
-        for url in subscribed_urls:
-            link_info = current_link_data.get(url)
-            if link_info and link_info.get("is_active", False):
-                active_links_to_check.append({"normalized_url": url, "data": link_info})
-        return active_links_to_check
-        
     def update_link_check_status(self, normalized_url: str, error_increment: int = 0, success: bool = False):
-        current_link_data = load_json_data(LINK_DATA_FILE, link_data_lock)
-        if normalized_url in current_link_data:
-            link = current_link_data[normalized_url]
-            link["last_checked"] = self._get_current_utc_iso()
-            if success:
-                link["error_count"] = 0
-            else:
-                link["error_count"] = link.get("error_count", 0) + error_increment
-            save_json_data(LINK_DATA_FILE, current_link_data, link_data_lock)
-            self.link_data = current_link_data
+        with link_data_lock:
+            link = self.links.get(normalized_url)
+            if link is not None:
+                link.last_checked = self._now_epoch()
+                link.error_count = 0 if success else link.error_count + error_increment
+                self._commit([{"c": "links", "op": "set", "k": link.url,
+                               "v": {"last_checked": epoch_to_iso(link.last_checked), "error_count": link.error_count}}])
+
+    def record_link_check_results(self, results: List[LinkCheckResult], max_errors: int) -> List[Tuple[str, str]]:
+        """Применяет итоги проверок за цикл (или его часть) одной записью журнала.
+
+        Решение о деактивации принимается здесь же, по тем же данным в памяти:
+        ссылка с max_errors ошибками подряд выключается. Возвращает пары
+        (url, original_url_example) выключенных ссылок для уведомления подписчиков.
+        """
+        ops = []
+        deactivated = []
+        with link_data_lock:
+            for result in results:
+                link = self.links.get(result.url)
+                if link is None:
+                    continue
+                link.last_checked = result.checked_at
+                link.error_count = 0 if result.success else link.error_count + 1
+                if link.health is None:
+                    link.health = LinkHealth()
+                link.health.record(result.latency_ms, result.size, result.status)
+                changes = {"last_checked": epoch_to_iso(link.last_checked), "error_count": link.error_count}
+                if link.is_active and link.error_count >= max_errors:
+                    link.is_active = False
+                    changes["is_active"] = False
+                    deactivated.append((link.url, link.original_url_example))
+                    logger.warning(f"Link {link.url} deactivated after {link.error_count} errors.")
+                ops.append({"c": "links", "op": "set", "k": link.url, "v": changes})
+            if ops:
+                self._commit(ops)
+        return deactivated
 
     def deactivate_link(self, normalized_url: str):
-        current_link_data = load_json_data(LINK_DATA_FILE, link_data_lock)
-        if normalized_url in current_link_data:
-            if current_link_data[normalized_url].get("is_active", True): 
-                current_link_data[normalized_url]["is_active"] = False
-                save_json_data(LINK_DATA_FILE, current_link_data, link_data_lock)
-                self.link_data = current_link_data
+        with link_data_lock:
+            link = self.links.get(normalized_url)
+            if link is not None and link.is_active:
+                link.is_active = False
+                self._commit([{"c": "links", "op": "set", "k": link.url, "v": {"is_active": False}}])
                 logger.warning(f"Link {normalized_url} deactivated.")
 
-    # --- Методы для подписок ---
-    def add_subscription(self, user_id: int, normalized_url: str) -> bool:
-        user_id_str = str(user_id)
-        current_user_data = load_json_data(USER_DATA_FILE, user_data_lock)
-
-        if user_id_str not in current_user_data:
-            logger.error(f"Attempted to add subscription for non-existent user {user_id_str}")
-            return False 
-        
-        user = current_user_data[user_id_str]
-        needs_save = self._ensure_subscription_format_for_user(user_id_str, current_user_data)
-
-        if not any(sub_dict["url"] == normalized_url for sub_dict in user.get("subscriptions", [])):
-            user.setdefault("subscriptions", []).append({"url": normalized_url, "alias": None})
-            needs_save = True
-            logger.info(f"User {user_id_str} subscribed to {normalized_url}")
+    # --- Сборка мусора ---
+    def collect_garbage(self, orphan_grace_seconds: float = ORPHAN_LINK_GRACE_DAYS * 86400,
+                        inactive_user_seconds: float = INACTIVE_USER_RETENTION_DAYS * 86400) -> Dict[str, int]:
+        """Удаляет ссылки без подписчиков и неактивных пользователей старше срока, затем сжимает журнал в снимок.
+
+        Срок отсчитывается от Link.orphaned_at и User.deactivated_at: отметку ставит
+        первый проход, который застал запись без подписчиков (или неактивной), а снимают
+        подписка, _upsert_link и реактивация пользователя. Решение принимается под
+        user_data_lock и link_data_lock сразу, поэтому ссылка, только что возвращённая
+        get_or_create_link, получает полный срок заново и не удаляется до подписки на неё.
+        Срок 0 отключает соответствующую чистку. Возвращает счётчики и освобождённые байты.
+        """
+        now = self._now_epoch()
+        ops: List[Dict[str, Any]] = []
+        stats = {"users_removed": 0, "links_removed": 0, "guids_removed": 0, "estimated_bytes": 0}
+        with user_data_lock, link_data_lock:
+            if inactive_user_seconds > 0:
+                for user in list(self.users.values()):
+                    if user.is_active:
+                        continue
+                    if user.deactivated_at is None:
+                        user.deactivated_at = now # выключен до появления отметки — срок идёт с этого прохода
+                        ops.append({"c": "users", "op": "set", "k": str(user.user_id), "v": {"deactivated_at": epoch_to_iso(now)}})
+                    elif now - user.deactivated_at >= inactive_user_seconds:
+                        stats["estimated_bytes"] += _snapshot_size(user.to_dict())
+                        stats["users_removed"] += 1
+                        del self.users[user.user_id]
+                        ops.append({"c": "users", "op": "del", "k": str(user.user_id)})
+
+            if orphan_grace_seconds > 0:
+                subscribed = {sub.url for user in self.users.values() for sub in user.subscriptions}
+                for link in list(self.links.values()):
+                    if link.url in subscribed:
+                        if link.orphaned_at is not None:
+                            link.orphaned_at = None
+                            ops.append({"c": "links", "op": "set", "k": link.url, "v": {"orphaned_at": None}})
+                    elif link.orphaned_at is None:
+                        link.orphaned_at = now
+                        ops.append({"c": "links", "op": "set", "k": link.url, "v": {"orphaned_at": epoch_to_iso(now)}})
+                    elif now - link.orphaned_at >= orphan_grace_seconds:
+                        stats["estimated_bytes"] += _snapshot_size(link.to_dict())
+                        stats["links_removed"] += 1
+                        stats["guids_removed"] += len(link.known_lot_guids)
+                        del self.links[link.url]
+                        ops.append({"c": "links", "op": "del", "k": link.url})
+            if ops:
+                self._commit(ops)
+
+        if not (stats["users_removed"] or stats["links_removed"]):
+            logger.info("Garbage collection: nothing to remove.")
+            return stats
+        snapshot_before = _file_size(USER_DATA_FILE) + _file_size(LINK_DATA_FILE)
+        if self.compact():
+            stats["snapshot_bytes_before"] = snapshot_before
+            stats["snapshot_bytes_after"] = _file_size(USER_DATA_FILE) + _file_size(LINK_DATA_FILE)
+            reclaimed = f"snapshot {snapshot_before} -> {stats['snapshot_bytes_after']} bytes"
         else:
-            logger.info(f"User {user_id_str} already subscribed to {normalized_url}")
-            if needs_save:
-                 save_json_data(USER_DATA_FILE, current_user_data, user_data_lock)
-                 self.user_data = current_user_data
-            return False 
+            reclaimed = f"~{stats['estimated_bytes']} bytes once the journal is compacted"
+        logger.info(f"Garbage collection removed {stats['users_removed']} inactive user(s) and {stats['links_removed']} "
+                    f"orphaned link(s) with {stats['guids_removed']} known GUID(s); {reclaimed}.", extra={"gc": stats})
+        return stats
+
+    # --- Статистика (только из памяти, для /stats) ---
+    def record_check_cycle(self, label: str, stats: Dict[str, Any]):
+        with link_data_lock:
+            self.check_cycles[label] = dict(stats, finished_at=time.time())
+
+    def get_check_cycles(self) -> Dict[str, Dict[str, Any]]:
+        with link_data_lock:
+            return {label: dict(stats) for label, stats in self.check_cycles.items()}
+
+    def get_store_stats(self) -> Dict[str, int]:
+        with user_data_lock:
+            users = len(self.users)
+            active_users = sum(1 for user in self.users.values() if user.is_active)
+        with link_data_lock:
+            links = len(self.links)
+            active_links = sum(1 for link in self.links.values() if link.is_active)
+            known_guids = sum(len(link.known_lot_guids) for link in self.links.values())
+        with outbox_lock:
+            outbox = len(self.outbox)
+        return {"users": users, "active_users": active_users, "links": links, "active_links": active_links,
+                "known_guids": known_guids, "outbox": outbox, "outbox_sends": self.outbox_pending_sends,
+                "journal_bytes": self.journal.size}
+
+    def get_link_health(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """(url, сводка LinkHealth) активных ссылок, которые уже проверялись."""
+        with link_data_lock:
+            return [(link.url, link.health.summary()) for link in self.links.values() if link.is_active and link.health]
+
+    def _record_detection_latency(self, link: Link, lots: Iterable[Lot], seen_at: int):
+        # Вызывается под link_data_lock.
+        for lot in lots:
+            if lot.published is None:
+                continue
+            if link.latency is None:
+                link.latency = NotifyLatency()
+            link.latency.detection.record(seen_at - lot.published)
+            self.notify_latency.detection.record(seen_at - lot.published)
+
+    def record_delivery_latencies(self, normalized_url: str, lot: Lot, detected_at: Optional[int], sent_at: List[float]):
+        """Задержки доставки лота: по одной на попытку отправки получателю (sent_at — её время)."""
+        if detected_at is None or not sent_at:
+            return
+        with link_data_lock:
+            link = self.links.get(normalized_url)
+            histograms = [self.notify_latency]
+            if link is not None:
+                if link.latency is None:
+                    link.latency = NotifyLatency()
+                histograms.append(link.latency)
+            for latency in histograms:
+                for moment in sent_at:
+                    latency.delivery.record(moment - detected_at)
+                    if lot.published is not None:
+                        latency.total.record(moment - lot.published)
+
+    def get_notify_latency(self) -> Tuple[Dict[str, Any], List[Tuple[str, Dict[str, Any]]]]:
+        """Снимок гистограмм: общие и (url, гистограммы) активных ссылок, по которым есть данные."""
+        with link_data_lock:
+            return self.notify_latency.to_dict(), [(link.url, link.latency.to_dict()) for link in self.links.values()
+                                                   if link.is_active and link.latency]
+
+    # --- WebSub ---
+    def set_link_hub(self, normalized_url: str, hub_url: Optional[str], hub_topic: Optional[str]) -> bool:
+        """Запоминает хаб, объявленный лентой; при смене хаба подтверждённая подписка сбрасывается."""
+        with link_data_lock:
+            link = self.links.get(normalized_url)
+            if link is None or (link.hub_url, link.hub_topic) == (hub_url, hub_topic):
+                return False
+            link.hub_url, link.hub_topic, link.websub_lease_until = hub_url, hub_topic, None
+            self._commit([{"c": "links", "op": "set", "k": link.url,
+                           "v": {"hub_url": hub_url, "hub_topic": hub_topic, "websub_lease_until": None}}])
+            logger.info(f"Link {normalized_url} advertises WebSub hub {hub_url}.")
+            return True
 
-        if needs_save:
-            save_json_data(USER_DATA_FILE, current_user_data, user_data_lock)
-            self.user_data = current_user_data
-        return True
+    def set_link_websub_lease(self, normalized_url: str, lease_until: Optional[int]):
+        with link_data_lock:
+            link = self.links.get(normalized_url)
+            if link is not None and link.websub_lease_until != lease_until:
+                link.websub_lease_until = lease_until
+                self._commit([{"c": "links", "op": "set", "k": link.url, "v": {"websub_lease_until": epoch_to_iso(lease_until)}}])
+
+    def get_websub_links(self) -> List[Tuple[str, str, str, Optional[int]]]:
+        """Активные ссылки с хабом: (url, hub_url, hub_topic, websub_lease_until)."""
+        with link_data_lock:
+            return [(link.url, link.hub_url, link.hub_topic or link.url, link.websub_lease_until)
+                    for link in self.links.values() if link.is_active and link.hub_url]
+
+    def get_push_covered_urls(self, safety_poll_interval: float) -> Set[str]:
+        """Ссылки, которые сейчас доставляет WebSub и которые проверялись опросом не дольше safety_poll_interval назад."""
+        now = self._now_epoch()
+        with link_data_lock:
+            return {link.url for link in self.links.values()
+                    if link.websub_lease_until and link.websub_lease_until > now
+                    and link.last_checked and now - link.last_checked < safety_poll_interval}
+
+    # --- Методы для подписок ---
+    def add_subscription(self, user_id: int, normalized_url: str) -> bool:
+        with user_data_lock:
+            user = self.users.get(user_id)
+            if user is None:
+                logger.error(f"Attempted to add subscription for non-existent user {user_id}")
+                return False
+
+            if user.find_subscription(normalized_url) is not None:
+                logger.info(f"User {user_id} already subscribed to {normalized_url}")
+                return False
+
+            self._set_user_subscriptions(user, user.subscriptions + (Subscription(normalized_url),))
+            logger.info(f"User {user_id} subscribed to {normalized_url}")
+            return True
 
     def remove_subscription(self, user_id: int, normalized_url: str) -> bool:
-        user_id_str = str(user_id)
-        current_user_data = load_json_data(USER_DATA_FILE, user_data_lock)
-        
-        if user_id_str not in current_user_data:
-            return False
-            
-        user = current_user_data[user_id_str]
-        needs_save = self._ensure_subscription_format_for_user(user_id_str, current_user_data)
-        
-        initial_len = len(user.get("subscriptions", []))
-        user["subscriptions"] = [sub_dict for sub_dict in user.get("subscriptions", []) if sub_dict["url"] != normalized_url]
-        
-        if len(user["subscriptions"]) < initial_len:
-            needs_save = True
-            logger.info(f"User {user_id_str} unsubscribed from {normalized_url}")
-        
-        if needs_save:
-            save_json_data(USER_DATA_FILE, current_user_data, user_data_lock)
-            self.user_data = current_user_data
-        
-        return len(user["subscriptions"]) < initial_len
-
-    def get_subscriptions_for_user(self, user_id: int) -> List[str]:
-        user_id_str = str(user_id)
-        current_user_data = load_json_data(USER_DATA_FILE, user_data_lock)
-        user = current_user_data.get(user_id_str)
-        
-        if user and user.get("is_active", False):
-            if self._ensure_subscription_format_for_user(user_id_str, current_user_data):
-                save_json_data(USER_DATA_FILE, current_user_data, user_data_lock)
-                self.user_data = current_user_data 
-            return user.get("subscriptions", [])
-        return []
-    
-    def set_subscription_alias(self, user_id: int, normalized_url: str, alias: Optional[str]) -> bool:
-        user_id_str = str(user_id)
-        current_user_data = load_json_data(USER_DATA_FILE, user_data_lock)
+        with user_data_lock:
+            user = self.users.get(user_id)
+            if user is None:
+                return False
 
-        if user_id_str not in current_user_data:
-            logger.warning(f"Cannot set alias for non-existent user {user_id_str}")
-            return False
+            remaining = tuple(sub for sub in user.subscriptions if sub.url != normalized_url)
+            if len(remaining) == len(user.subscriptions):
+                return False
 
-        user = current_user_data[user_id_str]
-        needs_save = self._ensure_subscription_format_for_user(user_id_str, current_user_data)
-        
-        subscription_found = False
-        for sub_dict in user.get("subscriptions", []):
-            if sub_dict["url"] == normalized_url:
-                if sub_dict.get("alias") != alias:
-                    sub_dict["alias"] = alias
-                    needs_save = True
-                subscription_found = True
-                break
-        
-        if not subscription_found:
-            logger.warning(f"Subscription {normalized_url} not found for user {user_id_str} to set alias.")
-
-            if needs_save:
-                save_json_data(USER_DATA_FILE, current_user_data, user_data_lock)
-                self.user_data = current_user_data
-            return False
+            self._set_user_subscriptions(user, remaining)
+            logger.info(f"User {user_id} unsubscribed from {normalized_url}")
+            return True
+
+    def add_subscriptions_bulk(self, user_id: int, entries: List[Tuple[str, str, Optional[str]]]) -> Tuple[List[str], List[str]]:
+        """Подписывает пользователя на пачку ссылок (normalized_url, original_url, alias) одной записью журнала.
+
+        Возвращает (новые подписки, уже существовавшие). Ссылки создаются или
+        реактивируются так же, как в get_or_create_link; у существующей подписки
+        обновляется только алиас, если он передан.
+        """
+        added: List[str] = []
+        existing: List[str] = []
+        with user_data_lock, link_data_lock:
+            user = self.users.get(user_id)
+            if user is None:
+                logger.error(f"Attempted bulk subscription for non-existent user {user_id}")
+                return added, existing
+
+            ops: List[Dict[str, Any]] = []
+            changed = False
+            subscriptions = list(user.subscriptions)
+            positions = {sub.url: i for i, sub in enumerate(subscriptions)}
+            for normalized_url, original_url, alias in entries:
+                self._upsert_link(normalized_url, original_url, ops)
+                index = positions.get(normalized_url)
+                if index is None:
+                    positions[normalized_url] = len(subscriptions)
+                    subscriptions.append(Subscription(normalized_url, alias))
+                    added.append(normalized_url)
+                    changed = True
+                else:
+                    if alias and subscriptions[index].alias != alias:
+                        subscriptions[index] = Subscription(normalized_url, alias)
+                        changed = True
+                    existing.append(normalized_url)
+
+            if changed:
+                subscriptions = tuple(subscriptions)
+                user.subscriptions = subscriptions
+                ops.append({"c": "users", "op": "set", "k": str(user_id),
+                            "v": {"subscriptions": [s.to_dict() for s in subscriptions]}})
+            if ops:
+                self._commit(ops)
+            logger.info(f"User {user_id} bulk-subscribed: {len(added)} new, {len(existing)} already present.")
+        return added, existing
+
+    def get_subscriptions_for_user(self, user_id: int) -> Tuple[Subscription, ...]:
+        user = self.users.get(user_id)
+        if user and user.is_active:
+            return user.subscriptions
+        return ()
 
-        if needs_save:
-            save_json_data(USER_DATA_FILE, current_user_data, user_data_lock)
-            self.user_data = current_user_data
-            logger.info(f"Alias for {normalized_url} for user {user_id_str} set to '{alias}'.")
-        return True
+    def set_subscription_alias(self, user_id: int, normalized_url: str, alias: Optional[str]) -> bool:
+        with user_data_lock:
+            user = self.users.get(user_id)
+            if user is None:
+                logger.warning(f"Cannot set alias for non-existent user {user_id}")
+                return False
+
+            sub = user.find_subscription(normalized_url)
+            if sub is None:
+                logger.warning(f"Subscription {normalized_url} not found for user {user_id} to set alias.")
+                return False
+
+            if sub.alias != alias:
+                self._set_user_subscriptions(user, tuple(
+                    Subscription(s.url, alias) if s is sub else s for s in user.subscriptions
+                ))
+                logger.info(f"Alias for {normalized_url} for user {user_id} set to '{alias}'.")
+            return True
 
     def get_subscription_alias(self, user_id: int, normalized_url: str) -> Optional[str]:
-        user_subscriptions = self.get_subscriptions_for_user(user_id)
-        for sub_dict in user_subscriptions:
-            if sub_dict["url"] == normalized_url:
-                return sub_dict.get("alias")
+        for sub in self.get_subscriptions_for_user(user_id):
+            if sub.url == normalized_url:
+                return sub.alias
         return None
 
-    def get_active_subscribers_for_link(self, normalized_url: str) -> List[Dict[str, Any]]:
-
-        subscribers = []
-        current_user_data = load_json_data(USER_DATA_FILE, user_data_lock) 
-        
-        users_to_save_after_conversion = False
-        for user_id_str, user_info_copy in list(current_user_data.items()):
-            user_info = current_user_data[user_id_str] 
-            if self._ensure_subscription_format_for_user(user_id_str, current_user_data):
-                users_to_save_after_conversion = True
-
-            if user_info.get("is_active", False):
-                for sub_dict in user_info.get("subscriptions", []): 
-                    if sub_dict["url"] == normalized_url:
-                        subscribers.append({
-                            "user_id": int(user_id_str),
-                            "chat_id": user_info.get("chat_id")
-                        })
-                        break 
-        
-        if users_to_save_after_conversion:
-            save_json_data(USER_DATA_FILE, current_user_data, user_data_lock)
-            self.user_data = current_user_data 
-
-        return subscribers
+    def get_active_subscribers_for_link(self, normalized_url: str) -> List[User]:
+        with user_data_lock:
+            return [user for user in self.users.values()
+                    if user.is_active and user.find_subscription(normalized_url) is not None]
+
+    def get_active_recipients_for_link(self, normalized_url: str) -> List[Tuple[int, int]]:
+        """Снимок получателей (chat_id, user_id) одним проходом — дёшево передаётся воркерам и в очередь доставки."""
+        with user_data_lock:
+            return [(user.chat_id, user.user_id) for user in self.users.values()
+                    if user.is_active and user.find_subscription(normalized_url) is not None]
+
+    def search_recent_lots(self, user_id: int, query: str, limit: int) -> List[HistoryLot]:
+        """Недавние лоты из подписок пользователя со всеми словами запроса, от новых к старым."""
+        if self.lot_history is None:
+            return []
+        with user_data_lock:
+            user = self.users.get(user_id)
+            normalized_urls = [s.url for s in user.subscriptions] if user else []
+        return self.lot_history.search(normalized_urls, query, limit)
 
      # --- Методы для известных лотов (KnownLot) ---
-    def add_lots_to_known(self, normalized_url: str, lots_data: List[Dict[str, str]]) -> int:
-        added_count = 0
-        current_link_data = load_json_data(LINK_DATA_FILE, link_data_lock)
-        if normalized_url in current_link_data:
-            link_entry = current_link_data[normalized_url]
-            if "known_lot_guids" not in link_entry: 
-                link_entry["known_lot_guids"] = []
-            
-            newly_added_guids_this_run = set() 
-            for lot in lots_data:
-                guid = lot.get('guid')
-                if guid and guid not in link_entry["known_lot_guids"] and guid not in newly_added_guids_this_run:
-                    link_entry["known_lot_guids"].append(guid)
-                    newly_added_guids_this_run.add(guid)
-                    added_count += 1
-            
-            if added_count > 0:
-                save_json_data(LINK_DATA_FILE, current_link_data, link_data_lock)
-                self.link_data = current_link_data
-                logger.info(f"Added {added_count} new lot GUIDs to link {normalized_url}")
-        return added_count
-
-    def get_known_lot_guids_for_link(self, normalized_url: str) -> set:
-        current_link_data = load_json_data(LINK_DATA_FILE, link_data_lock) 
-        self.link_data = current_link_data
-        link_entry = current_link_data.get(normalized_url)
-        if link_entry and "known_lot_guids" in link_entry:
-            return set(link_entry["known_lot_guids"])
-        return set()
\ No newline at end of file
+    @staticmethod
+    def _unseen_lots(link: Link, lots_data: List[Lot]) -> Dict[str, Lot]:
+        # Проверка по dict известных GUID без копирования его в set; повторы внутри пачки схлопываются.
+        known = link.known_lot_guids
+        unseen: Dict[str, Lot] = {}
+        for lot in lots_data:
+            guid = lot.guid
+            if guid and guid not in known and guid not in unseen:
+                unseen[guid] = lot
+        return unseen
+
+    @staticmethod
+    def _source_changed(link: Link, source: Optional[str]) -> bool:
+        return source is not None and source != (link.lot_source or DEFAULT_LOT_SOURCE)
+
+    def diff_and_record(self, normalized_url: str, lots_data: List[Lot], notify: bool = True,
+                        source: Optional[str] = None) -> List[Tuple[Lot, Optional[str]]]:
+        """Возвращает ещё не виденные лоты ссылки и в том же шаге отмечает их известными.
+
+        Поиск и запись идут под одной блокировкой ссылки, поэтому параллельные
+        проверка и первичное заполнение не могут оба счесть лот новым. При notify
+        каждый новый лот одной же записью журнала кладётся в outbox для активных
+        подписчиков; вторым элементом пары возвращается его outbox_id (или None).
+
+        source — адаптер, которым получены лоты (SourceAdapter.name). Если он не тот,
+        что записан у ссылки, GUID могут быть в другой схеме: лоты этой пачки только
+        запоминаются, как при первичном заполнении, а ссылка переходит на новый источник.
+        """
+        # Быстрый путь: чаще всего новых лотов нет, и список подписчиков не нужен.
+        with link_data_lock:
+            link = self.links.get(normalized_url)
+            if link is None or not (self._unseen_lots(link, lots_data) or self._source_changed(link, source)):
+                return []
+
+        recipients: Dict[int, int] = {}
+        if notify:
+            with user_data_lock:
+                recipients = {user.user_id: user.chat_id for user in self.users.values()
+                              if user.is_active and user.find_subscription(normalized_url) is not None}
+
+        with link_data_lock, outbox_lock:
+            link = self.links.get(normalized_url)
+            if link is None:
+                return []
+            # Пересчёт: между блокировками часть лотов мог записать другой поток.
+            unseen = self._unseen_lots(link, lots_data)
+            baseline = self._source_changed(link, source)
+            if baseline:
+                logger.info(f"Link {normalized_url} switched lot source {link.lot_source or DEFAULT_LOT_SOURCE} -> {source}, "
+                            f"recording {len(unseen)} lot(s) as a baseline without notifications.")
+                link.known_lot_guids.update(dict.fromkeys(unseen))
+                link.lot_source = None if source == DEFAULT_LOT_SOURCE else source
+                self._commit([{"c": "links", "op": "add_guids", "k": link.url, "v": list(unseen)},
+                              {"c": "links", "op": "set", "k": link.url, "v": {"lot_source": link.lot_source}}])
+                return []
+            if not unseen:
+                return []
+
+            link.known_lot_guids.update(dict.fromkeys(unseen))
+            ops: List[Dict[str, Any]] = [{"c": "links", "op": "add_guids", "k": link.url, "v": list(unseen)}]
+            recorded: List[Tuple[Lot, Optional[str]]] = []
+            now = self._now_epoch()
+            if notify:
+                # Первичное заполнение (notify=False) находит старые лоты — в задержку обнаружения не идёт.
+                self._record_detection_latency(link, unseen.values(), now)
+            for lot in unseen.values():
+                outbox_id = None
+                if recipients:
+                    entry = OutboxEntry(uuid.uuid4().hex, link.url, lot, dict(recipients), now)
+                    self.outbox[entry.outbox_id] = entry
+                    self.outbox_pending_sends += len(recipients)
+                    ops.append({"c": "outbox", "op": "put", "k": entry.outbox_id, "v": entry.to_dict()})
+                    outbox_id = entry.outbox_id
+                recorded.append((lot, outbox_id))
+            self._commit(ops)
+            logger.info("Recorded %d new lot GUID(s) for link %s, queued for %d recipient(s).",
+                        len(unseen), normalized_url, len(recipients), extra={"url": normalized_url})
+
+        if self.lot_history is not None:
+            self.lot_history.add(link.url, list(unseen.values()))
+        return recorded
+
+    # --- Методы для очереди неотправленных уведомлений (outbox) ---
+    def ack_outbox(self, outbox_id: str, user_ids: List[int]):
+        with outbox_lock:
+            entry = self.outbox.get(outbox_id)
+            if entry is None:
+                return
+            user_ids = [user_id for user_id in user_ids if user_id in entry.recipients]
+            if not user_ids:
+                return
+            for user_id in user_ids:
+                del entry.recipients[user_id]
+            self.outbox_pending_sends -= len(user_ids)
+            if not entry.recipients:
+                del self.outbox[outbox_id]
+            self._commit([{"c": "outbox", "op": "ack", "k": outbox_id, "v": user_ids}])
+
+    def get_outbox_backlog(self) -> int:
+        """Сколько отправок ждёт в outbox; счётчик ведётся при записи и подтверждении, вызов ничего не обходит."""
+        return self.outbox_pending_sends
+
+    def get_outbox_entry(self, outbox_id: str) -> Optional[OutboxEntry]:
+        with outbox_lock:
+            entry = self.outbox.get(outbox_id)
+            if entry is None:
+                return None
+            # Копия: получатели исходной записи меняются при подтверждениях.
+            return OutboxEntry(entry.outbox_id, entry.url, entry.lot, dict(entry.recipients), entry.created_at)
+
+    def get_pending_outbox_ids(self) -> List[str]:
+        with outbox_lock:
+            return [entry.outbox_id for entry in sorted(self.outbox.values(), key=lambda entry: entry.created_at or 0)]
@@ -0,0 +1,122 @@
+import json
+import logging
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional, Tuple
+from config import LOG_LEVEL, LOG_FORMAT, LOG_ASYNC, LOG_QUEUE_SIZE, LOG_RATE_LIMIT_PER_MINUTE
+
+MAX_TRACKED_TEMPLATES = 4096
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(threadName)s - %(message)s'
+
+# Стандартные поля LogRecord; всё остальное в record.__dict__ пришло через extra= и попадает в JSON.
+_RECORD_ATTRS = frozenset(logging.LogRecord("", 0, "", 0, "", (), None).__dict__) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись: время, уровень, логгер, поток, текст и поля из extra=."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """Пропускает не больше limit записей одного шаблона (логгер + msg) в минуту.
+
+    WARNING и выше не ограничиваются. Число подавленных записей дописывается
+    к первой записи этого шаблона в следующем окне.
+    """
+
+    def __init__(self, limit: int, window: float = 60.0):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self._lock = threading.Lock()
+        self._windows: Dict[Tuple[str, str], list] = {} # шаблон -> [начало окна, пропущено, подавлено]
+
+    def _prune(self, now: float):
+        # Шаблоны из f-строк уникальны для каждого вызова — не даём словарю расти без предела.
+        self._windows = {key: state for key, state in self._windows.items() if now - state[0] < self.window}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        key = (record.name, record.msg if isinstance(record.msg, str) else repr(type(record.msg)))
+        now = time.monotonic()
+        with self._lock:
+            state = self._windows.get(key)
+            if state is None or now - state[0] >= self.window:
+                if state is None and len(self._windows) >= MAX_TRACKED_TEMPLATES:
+                    self._prune(now)
+                suppressed = state[2] if state is not None else 0
+                self._windows[key] = [now, 1, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+                    record.msg = f"{record.msg} (suppressed {suppressed} similar in the last {self.window:.0f}s)"
+                return True
+            if state[1] < self.limit:
+                state[1] += 1
+                return True
+            state[2] += 1
+            return False
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler для очереди внутри процесса: запись кладётся как есть, без форматирования
+    в вызывающем потоке, а при переполнении очереди отбрасывается вместо блокировки."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Слушатель в том же процессе — подстановка %-аргументов и трассировки выполняется в его потоке.
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(text_format: str = TEXT_FORMAT) -> Optional[QueueListener]:
+    """Настраивает корневой логгер по LOG_LEVEL/LOG_FORMAT/LOG_ASYNC/LOG_RATE_LIMIT_PER_MINUTE.
+
+    При LOG_ASYNC запись в поток вывода идёт в отдельном потоке QueueListener;
+    возвращённый слушатель нужно остановить (stop()) при завершении процесса,
+    чтобы дописать очередь.
+    """
+    output = logging.StreamHandler()
+    output.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(text_format))
+
+    listener = None
+    handler: logging.Handler = output
+    if LOG_ASYNC:
+        handler = DroppingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+        listener = QueueListener(handler.queue, output, respect_handler_level=True)
+    if LOG_RATE_LIMIT_PER_MINUTE > 0:
+        handler.addFilter(RateLimitFilter(LOG_RATE_LIMIT_PER_MINUTE))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+
+    if listener is not None:
+        listener.start()
+    return listener
@@ -0,0 +1,269 @@
+import bisect
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from config import HISTORY_RETENTION_DAYS, HISTORY_MAX_LOTS
+from models import Lot
+
+logger = logging.getLogger(__name__)
+
+HISTORY_DIR = "lot_history"
+PARTITION_SECONDS = 3600 # один файл и один индекс на час: устаревшее удаляется целыми часами
+MIN_TOKEN_LENGTH = 2
+TOKEN_REGEX = re.compile(r"\d{2}:\d{2}:\d{6,8}:\d{1,5}|\w+") # кадастровый номер — одним токеном
+
+# (url ссылки-источника, время появления, заголовок, url лота, кадастровый номер)
+HistoryLot = Tuple[str, int, str, str, Optional[str]]
+
+
+def tokenize(text: str) -> Set[str]:
+    return {token for token in TOKEN_REGEX.findall(text.lower().replace("ё", "е")) if len(token) >= MIN_TOKEN_LENGTH}
+
+
+class _Partition:
+    """Лоты одного часа и их индексы: токен -> номера лотов, id источника -> номера лотов.
+
+    Номера в списках возрастают (лоты только дописываются), поэтому проверка
+    вхождения — бинарный поиск, а новые лоты — в конце списков.
+    """
+
+    __slots__ = ("start", "lots", "tokens", "sources")
+
+    def __init__(self, start: int):
+        self.start = start
+        self.lots: List[Tuple[int, int, str, str, Optional[str]]] = [] # (id источника, время, заголовок, url, кадастровый номер)
+        self.tokens: Dict[str, array] = {}
+        self.sources: Dict[int, array] = {}
+
+    def add(self, source_id: int, seen_at: int, title: str, url: str, cadastral_number: Optional[str]):
+        position = len(self.lots)
+        self.lots.append((source_id, seen_at, title, url, cadastral_number))
+        postings = self.sources.get(source_id)
+        if postings is None:
+            postings = self.sources[source_id] = array("I")
+        postings.append(position)
+        terms = tokenize(title)
+        if cadastral_number:
+            terms.add(cadastral_number)
+        for term in terms:
+            postings = self.tokens.get(term)
+            if postings is None:
+                postings = self.tokens[sys.intern(term)] = array("I")
+            postings.append(position)
+
+    def search(self, terms: List[str], source_ids: Set[int]) -> List[int]:
+        """Номера лотов с каждым из terms из источников source_ids, по возрастанию."""
+        term_postings = []
+        for term in terms:
+            postings = self.tokens.get(term)
+            if postings is None:
+                return []
+            term_postings.append(postings)
+        term_postings.sort(key=len)
+        source_postings = [self.sources[source_id] for source_id in source_ids if source_id in self.sources]
+        if not source_postings:
+            return []
+
+        # Перебираем самый короткий из вариантов: лоты источников пользователя или самый редкий токен.
+        if sum(len(postings) for postings in source_postings) <= len(term_postings[0]):
+            candidates = sorted(position for postings in source_postings for position in postings)
+            checks = term_postings
+        else:
+            lots = self.lots
+            candidates = [position for position in term_postings[0] if lots[position][0] in source_ids]
+            checks = term_postings[1:]
+        for postings in checks:
+            candidates = [position for position in candidates if _contains(postings, position)]
+            if not candidates:
+                break
+        return candidates
+
+
+def _contains(postings: array, position: int) -> bool:
+    index = bisect.bisect_left(postings, position)
+    return index < len(postings) and postings[index] == position
+
+
+def _ends_with_newline(path: str) -> bool:
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+class LotHistory:
+    """Недавние лоты (заголовок, ссылка, кадастровый номер, источник) с обратным индексом для /search.
+
+    Хранилище разбито на часовые секции: в памяти — лоты и индекс по токенам,
+    на диске — по одному JSONL-файлу на секцию в HISTORY_DIR. Секции старше
+    retention_days или сверх max_lots удаляются целиком вместе с файлом.
+    История вспомогательная: файлы не синхронизируются на диск, а при потере
+    теряются только результаты поиска.
+    """
+
+    def __init__(self, directory: str = HISTORY_DIR, retention_days: float = HISTORY_RETENTION_DAYS,
+                 max_lots: int = HISTORY_MAX_LOTS):
+        self.directory = directory
+        self.retention_seconds = int(retention_days * 86400)
+        self.max_lots = max_lots
+        self._lock = threading.Lock()
+        self._partitions: "OrderedDict[int, _Partition]" = OrderedDict() # от старых к новым
+        self._source_ids: Dict[str, int] = {}
+        self._source_urls: List[str] = []
+        self._size = 0
+        self._file = None
+        self._file_start: Optional[int] = None
+        self._loaded = False
+
+    def _path(self, start: int) -> str:
+        return os.path.join(self.directory, f"{start}.jsonl")
+
+    def _source_id(self, normalized_url: str) -> int:
+        source_id = self._source_ids.get(normalized_url)
+        if source_id is None:
+            source_id = self._source_ids[normalized_url] = len(self._source_urls)
+            self._source_urls.append(normalized_url)
+        return source_id
+
+    def _insert(self, start: int, rows: Iterable[HistoryLot]):
+        partition = self._partitions.get(start)
+        if partition is None:
+            partition = self._partitions[start] = _Partition(start)
+            if len(self._partitions) > 1 and start < next(reversed(self._partitions)):
+                self._partitions = OrderedDict(sorted(self._partitions.items()))
+        before = len(partition.lots)
+        for source_url, seen_at, title, url, cadastral_number in rows:
+            partition.add(self._source_id(source_url), seen_at, title, url, cadastral_number)
+        self._size += len(partition.lots) - before
+
+    def _evict(self, now: float):
+        # Вызывается под self._lock. Текущая секция не удаляется даже сверх лимита.
+        cutoff = now - self.retention_seconds
+        while len(self._partitions) > 1:
+            start, partition = next(iter(self._partitions.items()))
+            if start + PARTITION_SECONDS > cutoff and self._size <= self.max_lots:
+                break
+            del self._partitions[start]
+            self._size -= len(partition.lots)
+            self._remove_file(start)
+            logger.info(f"Lot history partition {start} evicted ({len(partition.lots)} lot(s)).")
+
+    def _remove_file(self, start: int):
+        try:
+            os.remove(self._path(start))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Could not remove lot history file {self._path(start)}: {e}")
+
+    def _append_file(self, start: int, rows: List[HistoryLot]):
+        try:
+            if self._file_start != start:
+                if self._file is not None:
+                    self._file.close()
+                os.makedirs(self.directory, exist_ok=True)
+                self._file = open(self._path(start), "a", encoding="utf-8")
+                self._file_start = start
+                if self._file.tell() and not _ends_with_newline(self._path(start)):
+                    self._file.write("\n") # недописанная при сбое строка не должна склеиться со следующей
+            self._file.write("".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows))
+            self._file.flush()
+        except OSError as e:
+            logger.warning(f"Could not write lot history file {self._path(start)}: {e}")
+
+    def add(self, normalized_url: str, lots: List[Lot], seen_at: Optional[int] = None):
+        """Запоминает новые лоты ссылки (вызывается DataManager после записи их GUID)."""
+        if not lots:
+            return
+        seen_at = int(time.time()) if seen_at is None else seen_at
+        start = seen_at - seen_at % PARTITION_SECONDS
+        rows = [(normalized_url, seen_at, lot.title or "", lot.url or "", lot.cadastral_number) for lot in lots]
+        with self._lock:
+            self._append_file(start, rows)
+            if not self._loaded:
+                return # попадут в память при чтении файла в load()
+            is_new_partition = start not in self._partitions
+            self._insert(start, rows)
+            if is_new_partition or self._size > self.max_lots:
+                self._evict(time.time())
+
+    def _read_file(self, start: int) -> List[HistoryLot]:
+        rows = []
+        try:
+            with open(self._path(start), encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rows.append(tuple(json.loads(line)))
+                    except ValueError:
+                        continue # недописанная строка после сбоя
+        except OSError as e:
+            logger.warning(f"Could not read lot history file {self._path(start)}: {e}")
+        return rows
+
+    def _list_files(self) -> List[int]:
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(int(name[:-6]) for name in names if name.endswith(".jsonl") and name[:-6].isdigit())
+
+    def load(self):
+        """Читает секции с диска. Вызывается в фоне после старта; поиск до этого видит не всю историю.
+
+        Лоты, пришедшие во время чтения, только дописываются в файл; последняя
+        секция дочитывается под блокировкой, так что ничего не теряется и не
+        попадает в память дважды.
+        """
+        started = time.monotonic()
+        cutoff = time.time() - self.retention_seconds
+        starts = self._list_files()
+        for start in starts[:-1]:
+            if start + PARTITION_SECONDS <= cutoff:
+                self._remove_file(start)
+                continue
+            rows = self._read_file(start)
+            with self._lock:
+                self._insert(start, rows)
+        with self._lock:
+            loaded = set(self._partitions)
+            for start in self._list_files():
+                if start not in loaded and start + PARTITION_SECONDS > cutoff:
+                    self._insert(start, self._read_file(start))
+            self._loaded = True
+            self._evict(time.time())
+            logger.info(f"Lot history loaded: {self._size} lot(s) in {len(self._partitions)} partition(s) "
+                        f"in {time.monotonic() - started:.2f}s.")
+
+    def search(self, normalized_urls: Iterable[str], query: str, limit: int) -> List[HistoryLot]:
+        """Лоты из ссылок normalized_urls, содержащие все слова запроса, от новых к старым."""
+        terms = sorted(tokenize(query))
+        if not terms:
+            return []
+        results: List[HistoryLot] = []
+        cutoff = time.time() - self.retention_seconds
+        with self._lock:
+            source_ids = {self._source_ids[url] for url in normalized_urls if url in self._source_ids}
+            if not source_ids:
+                return []
+            for partition in reversed(self._partitions.values()):
+                if partition.start + PARTITION_SECONDS <= cutoff:
+                    break
+                for position in reversed(partition.search(terms, source_ids)):
+                    source_id, seen_at, title, url, cadastral_number = partition.lots[position]
+                    results.append((self._source_urls[source_id], seen_at, title, url, cadastral_number))
+                    if len(results) >= limit:
+                        return results
+        return results
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+                self._file_start = None
@@ -0,0 +1,317 @@
+import sys
+import logging
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional, Tuple, NamedTuple
+
+logger = logging.getLogger(__name__)
+
+
+def iso_to_epoch(value: Optional[str]) -> Optional[int]:
+    if not value:
+        return None
+    try:
+        return int(datetime.fromisoformat(value).timestamp())
+    except (TypeError, ValueError):
+        return None
+
+def epoch_to_iso(value: Optional[int]) -> Optional[str]:
+    if value is None:
+        return None
+    return datetime.fromtimestamp(value, timezone.utc).isoformat()
+
+
+class Lot(NamedTuple):
+    """Лот из ленты — только то, что нужно мониторингу и уведомлению."""
+    guid: str
+    title: str
+    url: str
+    cadastral_number: Optional[str]
+    published: Optional[int] = None # published/updated записи ленты (epoch) — начало отсчёта времени до уведомления
+    price: Optional[float] = None # начальная цена, если источник отдаёт её отдельным полем (JSON torgi.gov.ru)
+
+
+DEFAULT_LOT_SOURCE = "rss" # схема GUID ссылок без lot_source: записи самой ленты
+
+
+class LinkCheckResult(NamedTuple):
+    """Итог проверки одной ссылки; копится за цикл и записывается пачкой (DataManager.record_link_check_results).
+
+    latency_ms, size и status (HTTP-код, 0 — сетевая ошибка) идут только в LinkHealth.
+    """
+    url: str
+    checked_at: int
+    success: bool
+    latency_ms: int = 0
+    size: int = 0
+    status: int = 0
+
+
+HEALTH_HISTORY_SIZE = 32
+
+
+class LinkHealth:
+    """Кольцевые буферы последних проверок ссылки: задержка, размер тела и HTTP-статус.
+
+    Живёт только в памяти (около 650 байт на ссылку при 32 проверках) и на диск не пишется.
+    """
+    __slots__ = ("latencies_ms", "sizes", "statuses", "position", "count")
+
+    def __init__(self, capacity: int = HEALTH_HISTORY_SIZE):
+        self.latencies_ms = array('I', [0]) * capacity
+        self.sizes = array('I', [0]) * capacity
+        self.statuses = array('H', [0]) * capacity
+        self.position = 0
+        self.count = 0
+
+    def record(self, latency_ms: int, size: int, status: int):
+        i = self.position
+        self.latencies_ms[i] = min(latency_ms, 0xFFFFFFFF)
+        self.sizes[i] = min(size, 0xFFFFFFFF)
+        self.statuses[i] = status
+        self.position = (i + 1) % len(self.statuses)
+        self.count = min(self.count + 1, len(self.statuses))
+
+    def summary(self) -> Dict[str, Any]:
+        n = self.count
+        if not n:
+            return {"checks": 0, "avg_latency_ms": 0, "max_latency_ms": 0, "avg_size": 0, "errors": 0, "last_status": None}
+        # Порядок внутри окна для агрегатов не важен: берём первые count ячеек (до заполнения буфера) или все.
+        latencies, sizes, statuses = self.latencies_ms[:n], self.sizes[:n], self.statuses[:n]
+        return {
+            "checks": n,
+            "avg_latency_ms": sum(latencies) // n,
+            "max_latency_ms": max(latencies),
+            "avg_size": sum(sizes) // n,
+            "errors": sum(1 for status in statuses if status == 0 or status >= 400),
+            "last_status": self.statuses[self.position - 1],
+        }
+
+
+# Верхние границы корзин гистограмм задержек, секунды; последняя — всё, что дольше суток.
+LATENCY_BUCKETS = (30, 60, 120, 300, 600, 900, 1800, 3600, 7200, 14400, 43200, 86400, float("inf"))
+LATENCY_BUCKET_LABELS = tuple("inf" if bound == float("inf") else str(bound) for bound in LATENCY_BUCKETS) # для JSON
+
+
+def histogram_quantile(counts, q: float) -> Optional[float]:
+    """Верхняя граница корзины LATENCY_BUCKETS, в которую попадает квантиль q; None — данных нет."""
+    total = sum(counts)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for bound, bucket_count in zip(LATENCY_BUCKETS, counts):
+        seen += bucket_count
+        if seen >= rank:
+            return bound
+    return LATENCY_BUCKETS[-1]
+
+
+class LatencyHistogram:
+    """Гистограмма задержек с фиксированными корзинами LATENCY_BUCKETS: счётчики, без самих значений."""
+    __slots__ = ("counts", "total_seconds")
+
+    def __init__(self):
+        self.counts = array('I', [0]) * len(LATENCY_BUCKETS)
+        self.total_seconds = 0.0
+
+    def record(self, seconds: float, count: int = 1):
+        seconds = max(0.0, seconds) # часы источника могут спешить
+        self.counts[bisect_left(LATENCY_BUCKETS, seconds)] += count
+        self.total_seconds += seconds * count
+
+    def to_dict(self) -> Dict[str, Any]:
+        count = sum(self.counts)
+        return {
+            "count": count,
+            "mean": round(self.total_seconds / count, 1) if count else None,
+            "p50": histogram_quantile(self.counts, 0.5),
+            "p90": histogram_quantile(self.counts, 0.9),
+            "p99": histogram_quantile(self.counts, 0.99),
+            "counts": self.counts.tolist(), # по корзинам LATENCY_BUCKETS
+        }
+
+
+class NotifyLatency:
+    """Время до уведомления по этапам: detection — от даты в ленте до первого обнаружения,
+    delivery — от обнаружения до попытки отправки получателю, total — от даты в ленте до отправки."""
+    __slots__ = ("detection", "delivery", "total")
+
+    def __init__(self):
+        self.detection = LatencyHistogram()
+        self.delivery = LatencyHistogram()
+        self.total = LatencyHistogram()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"detection": self.detection.to_dict(), "delivery": self.delivery.to_dict(), "total": self.total.to_dict()}
+
+
+class Subscription:
+    __slots__ = ("url", "alias")
+
+    def __init__(self, url: str, alias: Optional[str] = None):
+        self.url = sys.intern(url)
+        self.alias = alias
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Subscription":
+        return cls(data["url"], data.get("alias"))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"url": self.url, "alias": self.alias}
+
+
+def parse_subscriptions(raw: Any) -> Tuple[Subscription, ...]:
+    if not raw:
+        return ()
+    if not isinstance(raw, list):
+        logger.warning(f"Subscriptions in an unexpected format: {type(raw)}. Resetting to empty list.")
+        return ()
+    # Старый формат хранил подписки списком строк (List[str]).
+    return tuple(Subscription(s) if isinstance(s, str) else Subscription.from_dict(s)
+                 for s in raw if isinstance(s, str) or (isinstance(s, dict) and "url" in s))
+
+
+class User:
+    __slots__ = ("user_id", "chat_id", "first_name", "username", "is_active", "subscriptions", "joined_at", "deactivated_at")
+
+    def __init__(self, user_id: int, chat_id: int, first_name: Optional[str], username: Optional[str],
+                 is_active: bool = True, subscriptions: Tuple[Subscription, ...] = (), joined_at: Optional[int] = None,
+                 deactivated_at: Optional[int] = None):
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.first_name = first_name
+        self.username = username
+        self.is_active = is_active
+        # Кортеж заменяется целиком при изменении, поэтому его можно отдавать наружу без копирования.
+        self.subscriptions = subscriptions
+        self.joined_at = joined_at
+        self.deactivated_at = deactivated_at # с какого момента неактивен — отсчёт срока до удаления (DataManager.collect_garbage)
+
+    def find_subscription(self, normalized_url: str) -> Optional[Subscription]:
+        for sub in self.subscriptions:
+            if sub.url == normalized_url:
+                return sub
+        return None
+
+    @classmethod
+    def from_dict(cls, user_id_str: Optional[str], data: Dict[str, Any]) -> "User":
+        user = cls(int(user_id_str) if user_id_str is not None else 0, None, None, None)
+        user.update_from_dict(data)
+        return user
+
+    def update_from_dict(self, data: Dict[str, Any]):
+        for field, value in data.items():
+            if field == "subscriptions":
+                value = parse_subscriptions(value)
+            elif field in ("joined_at", "deactivated_at"):
+                value = iso_to_epoch(value)
+            elif field not in self.__slots__ or field == "user_id":
+                continue
+            setattr(self, field, value)
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {
+            "chat_id": self.chat_id,
+            "first_name": self.first_name,
+            "username": self.username,
+            "is_active": self.is_active,
+            "subscriptions": [s.to_dict() for s in self.subscriptions],
+            "joined_at": epoch_to_iso(self.joined_at),
+        }
+        if self.deactivated_at is not None:
+            data["deactivated_at"] = epoch_to_iso(self.deactivated_at)
+        return data
+
+
+class Link:
+    __slots__ = ("url", "original_url_example", "last_checked", "error_count", "is_active", "known_lot_guids", "added_at",
+                 "hub_url", "hub_topic", "websub_lease_until", "lot_source", "orphaned_at", "health", "latency")
+
+    def __init__(self, url: str, original_url_example: str, last_checked: Optional[int] = None, error_count: int = 0,
+                 is_active: bool = True, known_lot_guids: Optional[Dict[str, None]] = None, added_at: Optional[int] = None,
+                 hub_url: Optional[str] = None, hub_topic: Optional[str] = None, websub_lease_until: Optional[int] = None,
+                 lot_source: Optional[str] = None, orphaned_at: Optional[int] = None):
+        self.url = sys.intern(url)
+        self.original_url_example = original_url_example
+        self.last_checked = last_checked
+        self.error_count = error_count
+        self.is_active = is_active
+        # dict вместо set: O(1) проверка и сохранение порядка добавления для записи на диск.
+        self.known_lot_guids = known_lot_guids if known_lot_guids is not None else {}
+        self.added_at = added_at
+        # WebSub: хаб из <link rel="hub"> ленты, topic (rel="self") и срок подтверждённой подписки.
+        self.hub_url = hub_url
+        self.hub_topic = hub_topic
+        self.websub_lease_until = websub_lease_until
+        self.lot_source = lot_source # адаптер источника, чьи GUID лежат в known_lot_guids; None — DEFAULT_LOT_SOURCE
+        self.orphaned_at = orphaned_at # с какого момента без подписчиков — отсчёт срока до удаления (DataManager.collect_garbage)
+        self.health: Optional[LinkHealth] = None # история проверок для /stats, создаётся при первой проверке
+        self.latency: Optional[NotifyLatency] = None # время до уведомления, создаётся с первым новым лотом
+
+    @classmethod
+    def from_dict(cls, url: Optional[str], data: Dict[str, Any]) -> "Link":
+        link = cls(url or "", url or "")
+        link.update_from_dict(data)
+        return link
+
+    def update_from_dict(self, data: Dict[str, Any]):
+        for field, value in data.items():
+            if field in ("last_checked", "added_at", "websub_lease_until", "orphaned_at"):
+                value = iso_to_epoch(value)
+            elif field == "known_lot_guids":
+                value = dict.fromkeys(value or ())
+            elif field not in self.__slots__ or field in ("url", "health", "latency"):
+                continue
+            setattr(self, field, value)
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {
+            "original_url_example": self.original_url_example,
+            "last_checked": epoch_to_iso(self.last_checked),
+            "error_count": self.error_count,
+            "is_active": self.is_active,
+            "known_lot_guids": list(self.known_lot_guids),
+            "added_at": epoch_to_iso(self.added_at),
+        }
+        if self.hub_url:
+            data.update(hub_url=self.hub_url, hub_topic=self.hub_topic, websub_lease_until=epoch_to_iso(self.websub_lease_until))
+        if self.lot_source:
+            data["lot_source"] = self.lot_source
+        if self.orphaned_at is not None:
+            data["orphaned_at"] = epoch_to_iso(self.orphaned_at)
+        return data
+
+
+class OutboxEntry:
+    """Лот, уже записанный в известные, но доставленный ещё не всем получателям.
+
+    recipients — {user_id: chat_id}; получатель удаляется после попытки отправки,
+    запись — когда получателей не осталось.
+    """
+    __slots__ = ("outbox_id", "url", "lot", "recipients", "created_at")
+
+    def __init__(self, outbox_id: str, url: str, lot: Lot, recipients: Dict[int, int], created_at: Optional[int] = None):
+        self.outbox_id = outbox_id
+        self.url = sys.intern(url)
+        self.lot = lot
+        self.recipients = recipients
+        self.created_at = created_at
+
+    def recipient_pairs(self) -> List[Tuple[int, int]]:
+        return [(chat_id, user_id) for user_id, chat_id in self.recipients.items()]
+
+    @classmethod
+    def from_dict(cls, outbox_id: str, data: Dict[str, Any]) -> "OutboxEntry":
+        return cls(outbox_id, data["url"], Lot(*data["lot"]),
+                   {int(user_id): chat_id for chat_id, user_id in data.get("recipients", ())},
+                   iso_to_epoch(data.get("created_at")))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "lot": list(self.lot),
+            "recipients": [list(pair) for pair in self.recipient_pairs()],
+            "created_at": epoch_to_iso(self.created_at),
+        }
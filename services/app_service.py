@@ -1,14 +1,22 @@
 
 import logging
+import time
 from typing import Optional, Dict, List, Tuple
 from data_manager import DataManager
 from services.link_service import LinkService
 from services.subscription_service import SubscriptionService
+from services.notification_service import escape_markdown_v2
 from telebot.types import User as TeleUser 
 import telebot 
 
 logger = logging.getLogger(__name__)
 
+MAX_IMPORT_URLS = 200
+MAX_ALIAS_LENGTH = 50
+SEARCH_RESULTS_LIMIT = 10
+MAX_SEARCH_QUERY_LENGTH = 200
+MAX_SEARCH_TITLE_LENGTH = 150
+
 class AppService:
     def __init__(self, data_manager: DataManager, link_service: LinkService, sub_service: SubscriptionService):
         self.data_manager = data_manager
@@ -29,6 +37,9 @@ class AppService:
                 "/add *<ссылка>* - Добавить ссылку (или просто отправьте ссылку)\n"
                 "/mylinks - Показать ваши текущие подписки\n"
                 "/remove *<номер ссылки>* - Удалить подписку\n"
+                "/import *<ссылки>* - Добавить сразу несколько ссылок (по одной на строку или файлом .txt)\n"
+                "/export - Выгрузить ваши подписки файлом\n"
+                "/search *<слова>* - Найти недавние лоты в ваших подписках\n"
                 "/help - Показать это сообщение\n"
                 "/alias *<номер ссылки> <название алиаса>* - Установить кароткое название для ссылки\n"
                 "/donate - Пожертвовать денег💕\n\n"
@@ -57,6 +68,88 @@ class AppService:
                  return f"Вы уже подписаны на эту ссылку:\n`{telebot.util.escape(normalized_url)}`"
             return f"Произошла ошибка при добавлении подписки на ссылку:\n`{telebot.util.escape(normalized_url)}`"
     
+    def _parse_import_text(self, text: str) -> List[Tuple[str, Optional[str]]]:
+        # Строка "<ссылка> <алиас>" — формат /export; несколько ссылок в строке импортируются без алиасов.
+        entries = []
+        for line in text.splitlines():
+            tokens = line.split()
+            urls = [t for t in tokens if t.lower().startswith(("http://", "https://"))]
+            if len(urls) == 1 and tokens[0] == urls[0] and len(tokens) > 1:
+                entries.append((urls[0], " ".join(tokens[1:])[:MAX_ALIAS_LENGTH]))
+            else:
+                entries.extend((url, None) for url in urls)
+        return entries
+
+    def handle_import(self, tele_user: TeleUser, chat_id: int, text: str) -> Tuple[str, List[str]]:
+        """Массовая подписка. Возвращает текст ответа и нормализованные URL, на которые подписка оформлена."""
+        self.data_manager.get_or_create_user(tele_user.id, chat_id, tele_user.first_name, tele_user.username)
+
+        entries = self._parse_import_text(text)
+        if not entries:
+            return ("Не нашёл ссылок для импорта\\. Отправьте `/import` и ссылки по одной на строку "
+                    "\\(можно с алиасом через пробел\\) или файл \\.txt с подписью /import\\."), []
+
+        skipped_over_limit = max(0, len(entries) - MAX_IMPORT_URLS)
+        batch: Dict[str, Tuple[str, str, Optional[str]]] = {}
+        invalid: List[str] = []
+        for url, alias in entries[:MAX_IMPORT_URLS]:
+            normalized_url = self.link_service.normalize_url(url)
+            if not normalized_url:
+                invalid.append(url)
+            elif normalized_url not in batch or alias:
+                batch[normalized_url] = (normalized_url, url, alias)
+
+        added, existing = self.data_manager.add_subscriptions_bulk(tele_user.id, list(batch.values()))
+
+        response_lines = [
+            "*Импорт завершён\\.*",
+            f"Добавлено подписок: {len(added)}",
+            f"Уже были: {len(existing)}",
+        ]
+        if invalid:
+            response_lines.append(f"Не распознано: {len(invalid)}")
+            response_lines.extend(f"`{telebot.util.escape(url[:70])}`" for url in invalid[:5])
+        if skipped_over_limit:
+            response_lines.append(f"Пропущено сверх лимита в {MAX_IMPORT_URLS} ссылок: {skipped_over_limit}")
+        return "\n".join(response_lines), added + existing
+
+    def handle_export(self, tele_user: TeleUser, chat_id: int) -> Tuple[str, Optional[str]]:
+        """Возвращает текст ответа и содержимое файла для /import (None, если подписок нет)."""
+        self.data_manager.get_or_create_user(tele_user.id, chat_id, tele_user.first_name, tele_user.username)
+        subscriptions_display = self.sub_service.get_user_subscriptions_display(tele_user.id)
+        if not subscriptions_display:
+            return "У вас пока нет активных подписок\\.", None
+
+        lines = [f"{s['display_url']} {s['alias']}" if s.get('alias') else s['display_url'] for s in subscriptions_display]
+        return f"Ваши подписки: {len(lines)}\\. Чтобы восстановить их, отправьте этот файл с подписью /import\\.", "\n".join(lines) + "\n"
+
+    def handle_search(self, tele_user: TeleUser, chat_id: int, query: str) -> str:
+        self.data_manager.get_or_create_user(tele_user.id, chat_id, tele_user.first_name, tele_user.username)
+        query = query.strip()[:MAX_SEARCH_QUERY_LENGTH]
+        if not query:
+            return "Укажите слова для поиска\\. Пример: `/search участок ИЖС` или кадастровый номер\\."
+
+        subscriptions_display = self.sub_service.get_user_subscriptions_display(tele_user.id)
+        if not subscriptions_display:
+            return "У вас пока нет активных подписок\\."
+
+        results = self.data_manager.search_recent_lots(tele_user.id, query, SEARCH_RESULTS_LIMIT)
+        if not results:
+            return "Среди недавних лотов ваших подписок ничего не найдено\\."
+
+        sources = {s['normalized_url']: s.get('alias') or f"#{s['index']}" for s in subscriptions_display}
+        header = f"Последние {len(results)} найденных лотов:" if len(results) >= SEARCH_RESULTS_LIMIT else f"Найдено лотов: {len(results)}"
+        response_lines = [f"*{header}*"]
+        for source_url, seen_at, title, lot_url, cadastral_number in results:
+            if len(title) > MAX_SEARCH_TITLE_LENGTH:
+                title = title[:MAX_SEARCH_TITLE_LENGTH] + "..."
+            href = (lot_url or source_url).replace('amp%3B', '&').replace('\\', '\\\\').replace(')', '\\)')
+            meta = escape_markdown_v2(f"{time.strftime('%d.%m %H:%M', time.localtime(seen_at))} · {sources.get(source_url, '')}")
+            if cadastral_number:
+                meta += f" · `{cadastral_number}`"
+            response_lines.append(f"\n[{escape_markdown_v2(title or 'N/A')}]({href})\n{meta}")
+        return "\n".join(response_lines)
+
     def handle_my_links(self, tele_user: TeleUser, chat_id: int) -> str:
         self.data_manager.get_or_create_user(tele_user.id, chat_id, tele_user.first_name, tele_user.username)
         subscriptions_display = self.sub_service.get_user_subscriptions_display(tele_user.id)
@@ -0,0 +1,263 @@
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+import telebot
+from config import (DELIVERY_DEDUP_WINDOW_SECONDS, DELIVERY_DEDUP_MAX_ENTRIES, DELIVERY_HIGH_WATERMARK, DELIVERY_LOW_WATERMARK,
+                    DELIVERY_RETRY_SECONDS)
+from data_manager import DataManager
+from services.notification_service import NotificationService, SEND_OK, SEND_FAILED_TRANSIENTLY
+
+logger = logging.getLogger(__name__)
+
+JOB_NEW_LOT = "new_lot"
+JOB_LINK_DEACTIVATED = "link_deactivated"
+ACK_BATCH_SIZE = 100 # подтверждений одной записью журнала; столько отправок может повториться после сбоя
+
+
+class RecentDeliveries:
+    """Недавно доставленные пары (пользователь, GUID лота) — чтобы лот из пересекающихся
+    лент доходил до пользователя один раз.
+
+    Ключ — хеш пары, значение — время доставки; порядок вставки совпадает с порядком
+    по времени, поэтому устаревшие и лишние записи снимаются с головы. Память
+    ограничена max_entries независимо от числа пользователей.
+    """
+
+    def __init__(self, window_seconds: float = DELIVERY_DEDUP_WINDOW_SECONDS, max_entries: int = DELIVERY_DEDUP_MAX_ENTRIES):
+        self.window_seconds = window_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[int, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+
+    def _evict(self, now: float):
+        entries = self._entries
+        while entries:
+            key, delivered_at = next(iter(entries.items()))
+            if len(entries) <= self.max_entries and now - delivered_at < self.window_seconds:
+                break
+            entries.popitem(last=False)
+
+    def was_delivered(self, user_id: int, lot_guid: str) -> bool:
+        """True, если лот уже доставлен пользователю в пределах окна. Ничего не отмечает."""
+        key = hash((user_id, lot_guid))
+        now = time.monotonic()
+        with self._lock:
+            self.lookups += 1
+            delivered_at = self._entries.get(key)
+            if delivered_at is not None and now - delivered_at < self.window_seconds:
+                self.hits += 1
+                return True
+            return False
+
+    def add(self, user_id: int, lot_guid: str):
+        """Отмечает лот доставленным — только после успешной отправки, иначе копия из другой ленты потеряется."""
+        key = hash((user_id, lot_guid))
+        now = time.monotonic()
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = now
+            self._evict(now)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": round(self.hits / self.lookups, 3) if self.lookups else 0.0,
+            }
+
+
+class Backpressure:
+    """Сигнал перегрузки доставки с гистерезисом: включается, когда в outbox
+    high_watermark неотправленных сообщений, и выключается только ниже low_watermark,
+    чтобы проверки не дёргались на границе.
+
+    `depth` — функция глубины очереди доставки (DataManager.get_outbox_backlog или
+    её прокси у воркера); опрашивается не чаще раза в poll_interval секунд.
+    """
+
+    def __init__(self, depth: Callable[[], int], high_watermark: int = DELIVERY_HIGH_WATERMARK,
+                 low_watermark: int = DELIVERY_LOW_WATERMARK, poll_interval: float = 1.0):
+        self.depth = depth
+        self.high_watermark = high_watermark
+        self.low_watermark = min(low_watermark, high_watermark)
+        self.poll_interval = poll_interval
+        self.engaged = False
+        self.last_depth = 0
+        self._checked_at = float("-inf")
+        self._lock = threading.Lock()
+
+    def is_engaged(self) -> bool:
+        if self.high_watermark <= 0:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            if now - self._checked_at < self.poll_interval:
+                return self.engaged
+            self._checked_at = now
+            try:
+                self.last_depth = self.depth()
+            except Exception as e:
+                logger.warning(f"Could not read delivery backlog, keeping backpressure {'on' if self.engaged else 'off'}: {e}")
+                return self.engaged
+            if not self.engaged and self.last_depth >= self.high_watermark:
+                self.engaged = True
+                logger.warning(f"Delivery backlog at {self.last_depth} send(s) (high watermark {self.high_watermark}), deferring link checks.")
+            elif self.engaged and self.last_depth < self.low_watermark:
+                self.engaged = False
+                logger.info(f"Delivery backlog down to {self.last_depth} send(s), resuming link checks.")
+            return self.engaged
+
+
+class DeliveryService:
+    """Отправляет уведомления из очереди в отдельном потоке.
+
+    Задания — кортежи, которые кладут MonitoringService в этом процессе или
+    воркеры мониторинга через менеджер (см. worker_service):
+      (JOB_NEW_LOT, outbox_id)
+      (JOB_LINK_DEACTIVATED, recipients, link_url)
+    Лот и его получатели берутся из outbox DataManager (см. diff_and_record),
+    recipients — список пар (chat_id, user_id), снятый один раз на ссылку.
+
+    Получатель лота подтверждается в outbox после успешной отправки или
+    окончательной ошибки (бот заблокирован, чат не найден) — пачкой по лоту,
+    так что после сбоя посреди рассылки часть отправок может повториться.
+    При сетевой ошибке, 5xx или 429 получатель остаётся в outbox: такие записи
+    возвращаются в очередь, когда она опустеет, не чаще раза в retry_seconds,
+    а при старте — всё неподтверждённое, поэтому ни сбой отправки, ни перезапуск
+    не теряют уведомления.
+    """
+
+    def __init__(self, bot_instance: telebot.TeleBot, ns: NotificationService, dm: DataManager,
+                 delivery_queue: Optional[queue.Queue] = None, retry_seconds: float = DELIVERY_RETRY_SECONDS):
+        self.bot = bot_instance
+        self.notification_service = ns
+        self.data_manager = dm
+        self.queue = delivery_queue if delivery_queue is not None else queue.Queue()
+        self.recent_deliveries = RecentDeliveries()
+        self.backpressure = Backpressure(dm.get_outbox_backlog) # общий сигнал для проверок и WebSub в этом процессе
+        self.retry_seconds = retry_seconds
+        self._retry_ids: Dict[str, None] = {} # outbox_id с получателями, отправка которым не прошла временно
+        self._retry_at = 0.0
+        self._stop_event = threading.Event() # доработать очередь и выйти
+        self._abort_event = threading.Event() # срок вышел — прервать даже текущую рассылку
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None:
+            requeued = self._requeue_outbox()
+            if requeued:
+                logger.info(f"Requeued {requeued} undelivered lot(s) from the outbox.")
+            self._thread = threading.Thread(target=self._run, name="DeliveryWorker", daemon=True)
+            self._thread.start()
+
+    def _requeue_outbox(self) -> int:
+        pending = self.data_manager.get_pending_outbox_ids()
+        for outbox_id in pending:
+            self.queue.put((JOB_NEW_LOT, outbox_id))
+        return len(pending)
+
+    def stop(self, timeout: Optional[float] = None):
+        """Досылает очередь в пределах timeout; остаток остаётся в outbox до следующего запуска."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                self._abort_event.set()
+                self._thread.join(5)
+                logger.warning(f"Delivery stopped with ~{self.queue.qsize()} job(s) left; they stay in the outbox for the next start.")
+        logger.info(f"Delivery dedup stats: {self.recent_deliveries.stats()}")
+
+    def _run(self):
+        while not self._abort_event.is_set():
+            try:
+                job = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                if self._stop_event.is_set():
+                    break
+                self._requeue_retries()
+                continue
+            try:
+                self._deliver(job)
+            except Exception as e:
+                logger.error(f"Unexpected error delivering job {job[0]}: {e}", exc_info=True)
+            finally:
+                self.queue.task_done()
+
+    def _schedule_retry(self, outbox_id: str):
+        # Вызывается только из потока доставки, поэтому без блокировки.
+        if not self._retry_ids:
+            self._retry_at = time.monotonic() + self.retry_seconds
+        self._retry_ids[outbox_id] = None
+
+    def _requeue_retries(self):
+        if not self._retry_ids or time.monotonic() < self._retry_at:
+            return
+        logger.info(f"Retrying {len(self._retry_ids)} lot(s) with failed sends from the outbox.")
+        for outbox_id in self._retry_ids:
+            self.queue.put((JOB_NEW_LOT, outbox_id))
+        self._retry_ids = {}
+
+    def _deliver(self, job: tuple):
+        kind = job[0]
+        if kind == JOB_NEW_LOT:
+            _, outbox_id = job
+            entry = self.data_manager.get_outbox_entry(outbox_id)
+            if entry is None:
+                logger.debug("Outbox entry %s already delivered, skipping.", outbox_id)
+                return
+            lot_data, normalized_url, recipients = entry.lot, entry.url, entry.recipient_pairs()
+            # Подтверждения копятся и пишутся в журнал пачкой: одна запись на лот (или на ACK_BATCH_SIZE
+            # получателей), а не на каждую отправку.
+            acked: List[int] = []
+            if lot_data.guid:
+                # Отправки идут в одном потоке, поэтому между проверкой и add() ту же пару никто не отправит.
+                fresh = [r for r in recipients if not self.recent_deliveries.was_delivered(r[1], lot_data.guid)]
+                if len(fresh) < len(recipients):
+                    logger.debug("Lot %s from %s already delivered to %d recipient(s) via another link, skipping them.",
+                                 lot_data.guid, normalized_url, len(recipients) - len(fresh))
+                    fresh_ids = {user_id for _, user_id in fresh}
+                    acked.extend(user_id for _, user_id in recipients if user_id not in fresh_ids)
+                recipients = fresh
+
+            sent_at: List[float] = []
+            failed_transiently: List[int] = []
+
+            def recipient_done(user_id: int, outcome: str) -> bool:
+                if outcome == SEND_FAILED_TRANSIENTLY:
+                    failed_transiently.append(user_id) # остаётся в outbox до повтора
+                else:
+                    acked.append(user_id)
+                    if len(acked) >= ACK_BATCH_SIZE:
+                        self.data_manager.ack_outbox(outbox_id, acked)
+                        acked.clear()
+                if outcome == SEND_OK:
+                    sent_at.append(time.time())
+                    if lot_data.guid:
+                        self.recent_deliveries.add(user_id, lot_data.guid)
+                return not self._abort_event.is_set()
+
+            try:
+                self.notification_service.send_new_lot_notifications(self.bot, recipients, lot_data, normalized_url, recipient_done)
+            finally:
+                if acked:
+                    self.data_manager.ack_outbox(outbox_id, acked)
+                self.data_manager.record_delivery_latencies(normalized_url, lot_data, entry.created_at, sent_at)
+                if failed_transiently:
+                    logger.warning(f"Lot {lot_data.guid} from {normalized_url}: {len(failed_transiently)} send(s) failed "
+                                   f"transiently, kept in the outbox for retry.")
+                    self._schedule_retry(outbox_id)
+        elif kind == JOB_LINK_DEACTIVATED:
+            _, recipients, link_url = job
+            self.notification_service.send_link_deactivated_notifications(self.bot, recipients, link_url)
+        else:
+            logger.warning(f"Unknown delivery job skipped: {kind}")
+
+    def get_dedup_stats(self) -> Dict[str, Any]:
+        return self.recent_deliveries.stats()
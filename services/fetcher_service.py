@@ -1,30 +1,223 @@
-
 import requests
 import logging
-from tenacity import retry, stop_after_attempt, wait_exponential, RetryError
-from config import USER_AGENT 
-from typing import Optional
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+from urllib3.util.request import ACCEPT_ENCODING
+from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+from config import (USER_AGENT, MAX_FEED_BYTES, HOST_MAX_CONCURRENCY, HOST_MIN_INTERVAL_SECONDS, HOST_LATENCY_TARGET_SECONDS,
+                    HOST_CIRCUIT_FAILURES, HOST_CIRCUIT_COOLDOWN_SECONDS)
+from typing import Optional, Dict, Any
 
 logger = logging.getLogger(__name__)
 
+MAX_RETRY_AFTER_SECONDS = 3600
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class CircuitOpenError(Exception):
+    """Хост временно исключён из проверок: открыт предохранитель или действует Retry-After."""
+
+    def __init__(self, host: str, retry_in: float):
+        super().__init__(f"Circuit open for {host}, retry in {retry_in:.0f}s")
+        self.host = host
+        self.retry_in = retry_in
+
+
+class FeedTooLargeError(Exception):
+    """Тело ответа превысило MAX_FEED_BYTES — чтение прервано."""
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        seconds = float(value)
+    else:
+        try:
+            seconds = (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0.0), MAX_RETRY_AFTER_SECONDS)
+
+
+class HostState:
+    __slots__ = ("limit", "in_flight", "latency_ewma", "recent_outcomes", "consecutive_failures",
+                 "circuit_open_until", "probing", "next_start_at", "requests", "failures", "skipped")
+
+    def __init__(self):
+        self.limit = 1.0
+        self.in_flight = 0
+        self.latency_ewma: Optional[float] = None
+        self.recent_outcomes = deque(maxlen=20)
+        self.consecutive_failures = 0
+        self.circuit_open_until = 0.0
+        self.probing = False
+        self.next_start_at = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.skipped = 0
+
+
+class HostController:
+    """Вежливость по хостам: AIMD-лимит параллельных запросов, минимальный интервал
+    между запросами, предохранитель после серии ошибок и учёт Retry-After."""
+
+    def __init__(self, max_concurrency: int = HOST_MAX_CONCURRENCY, min_interval: float = HOST_MIN_INTERVAL_SECONDS,
+                 latency_target: float = HOST_LATENCY_TARGET_SECONDS, failure_threshold: int = HOST_CIRCUIT_FAILURES,
+                 cooldown: float = HOST_CIRCUIT_COOLDOWN_SECONDS):
+        self.max_concurrency = max_concurrency
+        self.min_interval = min_interval
+        self.latency_target = latency_target
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._hosts: Dict[str, HostState] = {}
+        self._cond = threading.Condition()
+
+    def acquire(self, host: str):
+        with self._cond:
+            state = self._hosts.get(host)
+            if state is None:
+                state = self._hosts[host] = HostState()
+            while True:
+                now = time.monotonic()
+                if state.circuit_open_until > now:
+                    state.skipped += 1
+                    raise CircuitOpenError(host, state.circuit_open_until - now)
+                half_open = state.circuit_open_until > 0
+                limit = 1 if half_open else int(state.limit)
+                if state.in_flight < limit and not (half_open and state.probing) and now >= state.next_start_at:
+                    break
+                wait = state.next_start_at - now if state.in_flight < limit else 1.0
+                self._cond.wait(timeout=max(wait, 0.05))
+            if half_open:
+                state.probing = True
+            state.in_flight += 1
+            state.next_start_at = max(now, state.next_start_at) + self.min_interval
+
+    def release(self, host: str, latency: float, ok: Optional[bool], retry_after: Optional[float] = None):
+        """ok=None — запрос не удался не по вине хоста (например, лента больше лимита):
+        ни лимит, ни предохранитель, ни задержка хоста по нему не меняются."""
+        with self._cond:
+            state = self._hosts[host]
+            now = time.monotonic()
+            state.in_flight -= 1
+            state.requests += 1
+            if ok is not None:
+                state.recent_outcomes.append(ok)
+                state.latency_ewma = latency if state.latency_ewma is None else 0.8 * state.latency_ewma + 0.2 * latency
+
+            if ok:
+                state.consecutive_failures = 0
+                state.circuit_open_until = 0.0
+                if latency <= self.latency_target:
+                    state.limit = min(self.max_concurrency, state.limit + 1.0 / state.limit)
+                else:
+                    state.limit = max(1.0, state.limit / 2)
+            elif ok is not None:
+                state.failures += 1
+                state.consecutive_failures += 1
+                state.limit = max(1.0, state.limit / 2)
+                if state.probing or state.consecutive_failures >= self.failure_threshold:
+                    if state.circuit_open_until <= now:
+                        logger.warning(f"Circuit opened for host {host} after {state.consecutive_failures} consecutive failures.")
+                    state.circuit_open_until = now + self.cooldown
+            state.probing = False
+
+            if retry_after:
+                state.circuit_open_until = max(state.circuit_open_until, now + retry_after)
+                logger.warning(f"Host {host} asked to retry after {retry_after:.0f}s, pausing its links.")
+            self._cond.notify_all()
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._cond:
+            now = time.monotonic()
+            stats = {}
+            for host, state in self._hosts.items():
+                recent = state.recent_outcomes
+                stats[host] = {
+                    "limit": int(state.limit),
+                    "in_flight": state.in_flight,
+                    "latency_ewma": round(state.latency_ewma, 3) if state.latency_ewma is not None else None,
+                    "error_rate": round(1 - sum(recent) / len(recent), 2) if recent else 0.0,
+                    "circuit": "open" if state.circuit_open_until > now else ("half-open" if state.circuit_open_until else "closed"),
+                    "requests": state.requests,
+                    "failures": state.failures,
+                    "skipped": state.skipped,
+                }
+            return stats
+
+
+def _stop_requested(retry_state) -> bool:
+    return retry_state.args[0].stop_event.is_set()
+
+
 class FetcherService:
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=2, max=10))
-    def fetch_url_content(self, url: str) -> Optional[bytes]:
+    def __init__(self, host_controller: Optional[HostController] = None, max_feed_bytes: int = MAX_FEED_BYTES):
+        self.host_controller = host_controller or HostController()
+        self.max_feed_bytes = max_feed_bytes
+        self.stop_event = threading.Event() # при остановке бота повторные попытки не делаются
+
+    def _read_capped(self, response: requests.Response, url: str) -> bytes:
+        declared = response.headers.get('Content-Length')
+        if declared and declared.isdigit() and int(declared) > self.max_feed_bytes:
+            raise FeedTooLargeError(f"{url} declares {declared} bytes, limit is {self.max_feed_bytes}")
+        # iter_content отдаёт уже распакованные куски, поэтому лимит действует на итоговый размер.
+        chunks = []
+        received = 0
+        for chunk in response.iter_content(chunk_size=READ_CHUNK_SIZE):
+            received += len(chunk)
+            if received > self.max_feed_bytes:
+                raise FeedTooLargeError(f"{url} exceeded {self.max_feed_bytes} bytes, aborted")
+            chunks.append(chunk)
+        return chunks[0] if len(chunks) == 1 else b"".join(chunks)
+
+    # Повторяем только сетевые сбои; ответы 5xx/429 уже учтены контроллером хоста.
+    @retry(stop=stop_after_attempt(3) | _stop_requested, wait=wait_exponential(multiplier=1, min=2, max=10),
+           retry=retry_if_exception_type((requests.exceptions.ConnectionError, requests.exceptions.Timeout)))
+    def fetch_url_content(self, url: str, accept: Optional[str] = None) -> Optional[bytes]:
+        host = urlparse(url).netloc
+        self.host_controller.acquire(host)
+        started = time.monotonic()
+        ok = False
+        retry_after = None
         try:
-            logger.debug(f"Fetching URL: {url}")
-            headers = {'User-Agent': USER_AGENT}
-            response = requests.get(url, timeout=15, headers=headers)
-            response.raise_for_status()
-            logger.info(f"Successfully fetched {url}, status: {response.status_code}")
-            return response.content
+            logger.debug("Fetching URL: %s", url)
+            headers = {'User-Agent': USER_AGENT, 'Accept-Encoding': ACCEPT_ENCODING}
+            if accept:
+                headers['Accept'] = accept
+            with requests.get(url, timeout=15, headers=headers, stream=True) as response:
+                if response.status_code in (429, 503):
+                    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                response.raise_for_status()
+                content = self._read_capped(response, url)
+                ok = True
+            logger.info("Successfully fetched %s, status: %s, %d bytes (%s)", url, response.status_code, len(content),
+                        response.headers.get('Content-Encoding', 'identity'),
+                        extra={"url": url, "status": response.status_code, "bytes": len(content), "latency": round(time.monotonic() - started, 3)})
+            return content
+        except FeedTooLargeError as e:
+            logger.warning(f"Feed too large: {e}")
+            # Хост отвечает, но лента не принята: не успех и не сбой хоста.
+            ok = None
+            raise
         except requests.exceptions.HTTPError as e:
             logger.warning(f"HTTP error fetching {url}: {e.response.status_code} {e.response.reason}")
-            if 400 <= e.response.status_code < 500 and e.response.status_code not in [408, 429]:
-                raise 
-            raise 
+            # Остальные 4xx — проблема конкретной ссылки, а не перегрузка хоста.
+            ok = e.response.status_code < 500 and e.response.status_code not in (408, 429)
+            raise
         except requests.exceptions.RequestException as e:
             logger.error(f"Request exception fetching {url}: {e}")
-            raise 
+            raise
         except Exception as e:
             logger.error(f"Unexpected error fetching {url}: {e}")
-            raise
\ No newline at end of file
+            raise
+        finally:
+            self.host_controller.release(host, time.monotonic() - started, ok, retry_after)
+
+    def get_host_stats(self) -> Dict[str, Dict[str, Any]]:
+        return self.host_controller.get_stats()
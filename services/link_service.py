@@ -1,8 +1,9 @@
 
 import logging
 from urllib.parse import urlparse, urlunparse, parse_qs, urlencode
-from typing import Optional, Dict
+from typing import Optional
 from data_manager import DataManager 
+from models import Link
 
 logger = logging.getLogger(__name__)
 
@@ -27,16 +28,8 @@ class LinkService:
             logger.error(f"Error normalizing URL {url}: {e}")
             return None
 
-    def add_new_link(self, normalized_url: str, original_url: str) -> Dict:
+    def add_new_link(self, normalized_url: str, original_url: str) -> Link:
         return self.data_manager.get_or_create_link(normalized_url, original_url)
 
-    def get_link_data(self, normalized_url: str) -> Optional[Dict]:
+    def get_link_data(self, normalized_url: str) -> Optional[Link]:
         return self.data_manager.get_link(normalized_url)
-    
-    def deactivate_link_due_to_errors(self, normalized_url: str, max_errors: int) -> bool:
-        link_data = self.data_manager.get_link(normalized_url) 
-        if link_data and link_data.get('is_active', True) and link_data.get('error_count', 0) >= max_errors :
-            self.data_manager.deactivate_link(normalized_url)
-            logger.warning(f"Link {normalized_url} deactivated after {link_data.get('error_count', 0)} errors.")
-            return True
-        return False
\ No newline at end of file
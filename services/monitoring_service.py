@@ -0,0 +1,288 @@
+import logging
+import threading
+import time
+import requests
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, List, Optional, Set, Tuple
+from config import MAX_FETCH_ERRORS, FETCH_WORKERS, WEBSUB_POLL_INTERVAL_SECONDS, BACKPRESSURE_MAX_DEFER_SECONDS
+from data_manager import DataManager
+from models import Lot, LinkCheckResult
+from services.fetcher_service import FetcherService, CircuitOpenError
+from services.parser_service import ParserService, RSS_ADAPTER, select_source_adapter
+from services.link_service import LinkService
+from services.delivery_service import JOB_NEW_LOT, JOB_LINK_DEACTIVATED, Backpressure
+
+logger = logging.getLogger(__name__)
+
+CHECK_RESULTS_BATCH_SIZE = 200 # сколько итогов проверок копить до записи в хранилище
+
+class MonitoringService:
+    """Проверяет ссылки и ставит уведомления в очередь доставки.
+
+    `delivery_queue` — любой объект с методом put(): локальная queue.Queue
+    DeliveryService или её прокси в процессе-воркере. `owns_link` ограничивает
+    проверку своим шардом ссылок. Пока `backpressure` включён (доставка не
+    успевает), проверки ссылок, проверенных позже BACKPRESSURE_MAX_DEFER_SECONDS
+    назад, откладываются до следующего цикла.
+    """
+
+    def __init__(self, dm: DataManager, fs: FetcherService, ps: ParserService, ls: LinkService,
+                 delivery_queue, owns_link: Optional[Callable[[str], bool]] = None, fetch_workers: int = FETCH_WORKERS,
+                 cycle_label: str = "bot", backpressure: Optional[Backpressure] = None):
+        self.data_manager = dm
+        self.fetcher_service = fs
+        self.parser_service = ps
+        self.link_service = ls
+        self.delivery_queue = delivery_queue
+        self.owns_link = owns_link
+        self.fetch_workers = max(1, fetch_workers)
+        self.cycle_label = cycle_label # под этим именем итоги цикла видны в /stats
+        self.backpressure = backpressure
+        self.stop_event = threading.Event()
+        self._populate_threads: Set[threading.Thread] = set()
+        self._populate_threads_lock = threading.Lock()
+
+    def _notify_link_deactivated(self, normalized_url: str, original_url_display: str):
+        recipients = self.data_manager.get_active_recipients_for_link(normalized_url)
+        if recipients:
+            self.delivery_queue.put((JOB_LINK_DEACTIVATED, recipients, original_url_display))
+
+    def _flush_check_results(self, results: List[LinkCheckResult]):
+        if not results:
+            return
+        for normalized_url, original_url in self.data_manager.record_link_check_results(results, MAX_FETCH_ERRORS):
+            self._notify_link_deactivated(normalized_url, original_url)
+
+    def _record_new_lots(self, normalized_url: str, parsed_lots: list, source: Optional[str] = None):
+        # Поиск новых лотов, отметка их известными и постановка в outbox — один шаг в DataManager;
+        # в очередь доставки уходит только outbox_id (одно задание на лот, сколько бы ни было подписчиков).
+        new_lots = self.data_manager.diff_and_record(normalized_url, parsed_lots, source=source)
+
+        if new_lots:
+            logger.info("Found %d new lot(s) for link %s.", len(new_lots), normalized_url,
+                        extra={"url": normalized_url, "new_lots": len(new_lots)})
+            queued = [outbox_id for _, outbox_id in new_lots if outbox_id]
+            for outbox_id in queued:
+                self.delivery_queue.put((JOB_NEW_LOT, outbox_id))
+            if not queued:
+                logger.info("No active subscribers to notify for link %s", normalized_url, extra={"url": normalized_url})
+        else:
+            logger.debug("No new lots for link %s.", normalized_url, extra={"url": normalized_url})
+
+    def process_pushed_content(self, normalized_url: str, content: bytes):
+        """Содержимое ленты, присланное WebSub-хабом: тот же путь поиска новых лотов, что и при опросе."""
+        if self.stop_event.is_set():
+            return
+        parsed_lots = self.parser_service.parse_rss_feed(content)
+        if parsed_lots is None:
+            logger.warning(f"Failed to parse pushed content for link {normalized_url}.")
+            return
+        adapter = select_source_adapter(normalized_url)
+        self._record_new_lots(normalized_url, adapter.adopt_fallback_lots(parsed_lots), adapter.name)
+
+    def _fetch_lots(self, normalized_url: str) -> Tuple[Optional[bytes], Optional[List[Lot]], Optional[Tuple[str, Optional[str]]], str]:
+        """Загружает и разбирает ссылку через её адаптер источника (см. parser_service.SOURCE_ADAPTERS).
+
+        Ссылка читается как RSS (GUID лотов приводятся к схеме адаптера), только если
+        ответ адаптера не разобрать или сервер ответил 4xx — источник не поддерживает
+        такой запрос. Сетевые ошибки, таймауты, 5xx и 429 пробрасываются: хост и так
+        не справляется, второй запрос к нему удвоил бы нагрузку. CircuitOpenError тоже
+        пробрасывается, в том числе на запасном пути. Возвращает (содержимое, лоты,
+        хаб, имя адаптера); содержимое None — загрузить не удалось, лоты None — не разобрать.
+        """
+        adapter = select_source_adapter(normalized_url)
+        if adapter is not RSS_ADAPTER:
+            try:
+                content = self.fetcher_service.fetch_url_content(adapter.request_url(normalized_url), adapter.accept)
+            except requests.exceptions.HTTPError as e:
+                status = e.response.status_code
+                if status >= 500 or status in (408, 429):
+                    raise
+                logger.warning(f"Source adapter {adapter.name} got HTTP {status} for {normalized_url}, falling back to RSS.")
+            else:
+                if content is None:
+                    return None, None, None, adapter.name
+                parsed_lots, hub = self.parser_service.parse_feed(content, adapter.parse_entries)
+                if parsed_lots is not None:
+                    return content, parsed_lots, hub, adapter.name
+                logger.warning(f"Source adapter {adapter.name} could not parse the response for {normalized_url}, falling back to RSS.")
+
+        content = self.fetcher_service.fetch_url_content(normalized_url)
+        if content is None:
+            return None, None, None, adapter.name
+        parsed_lots, hub = self.parser_service.parse_feed(content)
+        if parsed_lots is not None:
+            parsed_lots = adapter.adopt_fallback_lots(parsed_lots)
+        return content, parsed_lots, hub, adapter.name
+
+    def _process_single_link(self, normalized_url: str) -> Optional[LinkCheckResult]:
+        """Проверяет ссылку и возвращает итог для пакетной записи; None — ссылка не проверялась."""
+        if self.stop_event.is_set():
+            return None
+        logger.info("Checking link: %s", normalized_url, extra={"url": normalized_url})
+        checked_at = int(time.time())
+        started = time.monotonic()
+
+        try:
+            content, parsed_lots, hub, source = self._fetch_lots(normalized_url)
+            latency_ms = int((time.monotonic() - started) * 1000)
+            if content is None:
+                logger.warning(f"Failed to fetch content for link {normalized_url} after retries.")
+                return LinkCheckResult(normalized_url, checked_at, False, latency_ms)
+
+            if parsed_lots is None:
+                logger.warning(f"Failed to parse content or feed is empty for link {normalized_url}.")
+                return LinkCheckResult(normalized_url, checked_at, True, latency_ms, len(content), 200)
+            if hub is not None:
+                self.data_manager.set_link_hub(normalized_url, *hub)
+
+            self._record_new_lots(normalized_url, parsed_lots, source)
+            return LinkCheckResult(normalized_url, checked_at, True, latency_ms, len(content), 200)
+
+        except CircuitOpenError as e:
+            # Хост на паузе — не считаем это ошибкой ссылки, проверим в следующем цикле.
+            logger.debug("Skipping link %s: %s", normalized_url, e, extra={"url": normalized_url})
+            return None
+        except Exception as e:
+            logger.error(f"Unhandled error processing link {normalized_url}: {e}", exc_info=True)
+            status = getattr(getattr(e, "response", None), "status_code", 0) or 0 # HTTP-код для HTTPError, 0 — сеть/прочее
+            return LinkCheckResult(normalized_url, checked_at, False, int((time.monotonic() - started) * 1000), 0, status)
+
+
+    def check_all_active_links(self):
+        logger.info("Starting periodic link check job...")
+        try:
+            active_urls = self.data_manager.get_active_link_urls()
+            if self.owns_link is not None:
+                active_urls = [url for url in active_urls if self.owns_link(url)]
+
+            # Ссылки с действующей WebSub-подпиской опрашиваются лишь раз в WEBSUB_POLL_INTERVAL_SECONDS — на случай потерянных уведомлений хаба.
+            push_covered = self.data_manager.get_push_covered_urls(WEBSUB_POLL_INTERVAL_SECONDS)
+            if push_covered:
+                active_urls = [url for url in active_urls if url not in push_covered]
+                logger.info(f"Skipping {len(push_covered)} link(s) kept up to date by WebSub.")
+
+            if not active_urls:
+                logger.info("No active links with subscriptions to check.")
+                return
+
+            logger.info(f"Found {len(active_urls)} active links to check.")
+            # Темп запросов к каждому хосту задаёт HostController в FetcherService.
+            # Статусы ссылок копятся и пишутся одной записью журнала на CHECK_RESULTS_BATCH_SIZE проверок.
+            # Ссылки подаются в пул по мере освобождения потоков (не больше двух на поток),
+            # поэтому сигнал перегрузки доставки учитывается и посреди цикла.
+            results: List[LinkCheckResult] = []
+            cycle = {"links": len(active_urls), "checked": 0, "failed": 0, "bytes": 0, "deferred": 0}
+            overdue: Optional[Set[str]] = None
+            started = time.monotonic()
+
+            def collect(futures):
+                nonlocal results
+                for future in futures:
+                    result = future.result()
+                    if result is not None:
+                        results.append(result)
+                        cycle["checked"] += 1
+                        cycle["failed"] += not result.success
+                        cycle["bytes"] += result.size
+                if len(results) >= CHECK_RESULTS_BATCH_SIZE:
+                    self._flush_check_results(results)
+                    results = []
+
+            try:
+                with ThreadPoolExecutor(max_workers=self.fetch_workers, thread_name_prefix="LinkCheck") as pool:
+                    in_flight = set()
+                    for normalized_url in active_urls:
+                        if self.stop_event.is_set():
+                            break
+                        if self.backpressure is not None and self.backpressure.is_engaged():
+                            if overdue is None:
+                                overdue = self.data_manager.get_overdue_link_urls(BACKPRESSURE_MAX_DEFER_SECONDS)
+                            if normalized_url not in overdue:
+                                cycle["deferred"] += 1
+                                continue
+                        if len(in_flight) >= self.fetch_workers * 2:
+                            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                            collect(done)
+                        in_flight.add(pool.submit(self._process_single_link, normalized_url))
+                    collect(wait(in_flight).done)
+            finally:
+                self._flush_check_results(results)
+                cycle["duration"] = round(time.monotonic() - started, 3)
+                self.data_manager.record_check_cycle(self.cycle_label, cycle)
+            if cycle["deferred"]:
+                logger.warning(f"Deferred {cycle['deferred']} of {len(active_urls)} link check(s): delivery backlog "
+                               f"{self.backpressure.last_depth} is above the low watermark.")
+            self._log_host_stats()
+        except Exception as e:
+            logger.error(f"Critical error in check_all_active_links job: {e}", exc_info=True)
+        finally:
+            logger.info("Finished periodic link check job.")
+
+    def _log_host_stats(self):
+        for host, stats in self.fetcher_service.get_host_stats().items():
+            logger.info(
+                f"Host {host}: circuit={stats['circuit']}, limit={stats['limit']}, latency_ewma={stats['latency_ewma']}s, "
+                f"error_rate={stats['error_rate']}, requests={stats['requests']}, failures={stats['failures']}, skipped={stats['skipped']}"
+            )
+
+    def populate_initial_lots(self, normalized_url: str):
+        try:
+            link = self.data_manager.get_link(normalized_url)
+            if not link or not link.is_active:
+                logger.warning(f"Cannot populate initial lots for inactive or non-existent link: {normalized_url}")
+                return
+
+            logger.info(f"Populating initial lots for link: {normalized_url}")
+            content, parsed_lots, _, source = self._fetch_lots(normalized_url)
+            if content is None:
+                logger.warning(f"Failed to fetch content for initial population of link: {normalized_url}.")
+                self.data_manager.update_link_check_status(normalized_url, error_increment=1)
+                return
+
+            if parsed_lots is None:
+                logger.warning(f"Failed to parse content for initial population of link: {normalized_url}.")
+
+                return
+
+            added_count = len(self.data_manager.diff_and_record(normalized_url, parsed_lots, notify=False, source=source))
+            logger.info(f"Initially populated {added_count} lots for link: {normalized_url}.")
+            self.data_manager.update_link_check_status(normalized_url, success=True)
+        except Exception as e:
+            logger.error(f"Error populating initial lots for link {normalized_url}: {e}", exc_info=True)
+
+    def populate_initial_lots_batch(self, normalized_urls: List[str]):
+        """Первичное заполнение пачки ссылок в одном потоке; темп запросов к хостам задаёт FetcherService."""
+        logger.info(f"Populating initial lots for {len(normalized_urls)} link(s) in one batch.")
+        for normalized_url in normalized_urls:
+            if self.stop_event.is_set():
+                # Незаполненные ссылки подхватит initial_population при следующем запуске.
+                logger.info("Initial population interrupted by shutdown.")
+                return
+            self.populate_initial_lots(normalized_url)
+
+    def start_initial_population(self, normalized_urls: List[str], name: str = "InitialPopulation"):
+        """Запускает заполнение в отслеживаемом потоке, чтобы stop() мог его дождаться."""
+        def run():
+            try:
+                self.populate_initial_lots_batch(normalized_urls)
+            finally:
+                with self._populate_threads_lock:
+                    self._populate_threads.discard(threading.current_thread())
+
+        thread = threading.Thread(target=run, name=name, daemon=True)
+        with self._populate_threads_lock:
+            if self.stop_event.is_set():
+                return
+            self._populate_threads.add(thread)
+        thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        """Прекращает брать новые ссылки и ждёт текущие потоки заполнения не дольше timeout."""
+        self.stop_event.set()
+        self.fetcher_service.stop_event.set()
+        with self._populate_threads_lock:
+            threads = list(self._populate_threads)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in threads:
+            thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
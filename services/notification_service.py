@@ -1,23 +1,25 @@
 
 import logging
+import time
+import requests
 import telebot 
 from data_manager import DataManager 
-from typing import Dict, Optional
+from models import Lot
+from typing import Callable, Optional, Sequence, Tuple
 import re 
 
 logger = logging.getLogger(__name__)
 
+MAX_FLOOD_WAIT_SECONDS = 30 # дольше ждать 429 не имеет смысла — рассылка встанет целиком
+
+# Итог отправки лота получателю: по нему DeliveryService решает, подтверждать ли его в outbox.
+SEND_OK = "ok"
+SEND_FAILED_PERMANENTLY = "permanent" # повтор не поможет: бот заблокирован, чат не найден, сообщение отклонено
+SEND_FAILED_TRANSIENTLY = "transient" # сеть, таймаут, 5xx, 429 — лот остаётся в outbox и отправляется повторно
+
 MARKDOWN_V2_SPECIAL_CHARS = r"_*[]()~`>#+-=|{}.!" 
 MARKDOWN_V2_ESCAPE_REGEX = re.compile(f'([{re.escape(MARKDOWN_V2_SPECIAL_CHARS)}])')
 
-def extrac_cadastral_number(text: str) -> str:
-    pattern = r"\b\d{2}:\d{2}:\d{6,8}:\d{1,5}\b"
-    cadastral_number = re.search(pattern, text)
-    if cadastral_number:
-        return f"{cadastral_number.group(0)}"
-    else:
-        return None
-
 def escape_markdown_v2(text: str) -> str:
     if not text:
         return ''
@@ -28,65 +30,91 @@ class NotificationService:
     def __init__(self, data_manager: DataManager):
         self.data_manager = data_manager
 
-    def send_new_lot_notification(self, bot_instance: telebot.TeleBot, chat_id: int, user_id: int, lot_data: Dict[str, str], source_url_normalized: str): 
+    def _render_new_lot_message(self, lot_data: Lot, source_url_normalized: str) -> Tuple[str, str, str]:
+        """Общие для всех получателей части сообщения: (строка-идентификатор ссылки по умолчанию, тело, заголовок для логов)."""
+        title_original = lot_data.title or 'N/A'
+        lot_url_original = lot_data.url or '#' 
+        cadastral_number = lot_data.cadastral_number
+
+        if len(title_original) > 300: 
+            title_original = title_original[:300] + "..."
+        
+        escaped_title = escape_markdown_v2(title_original)
+
+        default_identifier_line = ""
+        link_info = self.data_manager.get_link(source_url_normalized)
+        if link_info and link_info.original_url_example:
+            url_display_part = link_info.original_url_example
+            if len(url_display_part) > 70: 
+                url_display_part = url_display_part[:67] + "..."
+            default_identifier_line = f"🏷️ `{escape_markdown_v2(url_display_part)}`\n" 
+
+        href_source_url = source_url_normalized.replace('amp%3B', '&') 
+        href_lot_url = lot_url_original.replace('amp%3B', '&')
+
+        cadastral_number_link_display_text_MAPRU = ""
+        cadastral_number_link_display_text_KadastrRu = ""
+        if cadastral_number:
+            safe_cadastral_number = cadastral_number.replace(':', '%3A')
+            cadastral_number_url_MAPRU = f"https://map.ru/pkk?kad={safe_cadastral_number}&z=17"
+            cadastral_number_url_KADASSTRU = f"https://links.kadastrru.info/objects/find?cadnum={safe_cadastral_number}&type=parcel"
+            cadastral_number_link_display_text_MAPRU = f"🏠 [{escape_markdown_v2('MapRu')}]({cadastral_number_url_MAPRU})"
+            cadastral_number_link_display_text_KadastrRu = f"[{escape_markdown_v2(' KadastrRU')}]({cadastral_number_url_KADASSTRU})"
+
+        source_link_display_text = escape_markdown_v2("Источник RSS")
+        lot_link_display_text = escape_markdown_v2("Подробнее о лоте")
+
+        price_line = ""
+        if lot_data.price is not None:
+            price_line = f"💰 *{escape_markdown_v2('Цена:')}* {escape_markdown_v2(f'{lot_data.price:,.2f} ₽'.replace(',', ' '))}\n"
+
+        body = (
+            f"🏷️ *{escape_markdown_v2('Название:')}* {escaped_title}\n"
+            f"{price_line}"
+            f"🔗 [{source_link_display_text}]({href_source_url})\n" 
+            f"👉 [{lot_link_display_text}]({href_lot_url})\n"
+            f"{cadastral_number_link_display_text_MAPRU}"
+            f"{cadastral_number_link_display_text_KadastrRu}"
+        )
+        return default_identifier_line, body, title_original
+
+    def send_new_lot_notifications(self, bot_instance: telebot.TeleBot, recipients: Sequence[Tuple[int, int]],
+                                   lot_data: Lot, source_url_normalized: str,
+                                   on_recipient_done: Optional[Callable[[int, str], bool]] = None):
+        """Рассылает один лот списку получателей (chat_id, user_id); общая часть сообщения собирается один раз.
+
+        on_recipient_done(user_id, итог SEND_*) вызывается после попытки отправки каждому
+        получателю; если он вернёт False, рассылка прерывается (остановка бота).
+        """
         try:
-            title_original = lot_data.get('title', 'N/A')
-            lot_url_original = lot_data.get('url', '#') 
-            description = lot_data.get('description', None)
-            if description:
-                cadastral_number = extrac_cadastral_number(description)
-            else:
-                cadastral_number = None
-
-            if len(title_original) > 300: 
-                title_original = title_original[:300] + "..."
-            
-            escaped_title = escape_markdown_v2(title_original)
-            
-            user_alias = self.data_manager.get_subscription_alias(user_id, source_url_normalized)
-            link_identifier_line = ""
-            if user_alias:
-                link_identifier_line = f"🏷️ *{escape_markdown_v2(user_alias)}*\n" 
-            else:
-                link_info = self.data_manager.get_link(source_url_normalized)
-                if link_info and link_info.get('original_url_example'):
-                    url_display_part = link_info['original_url_example']
-                    if len(url_display_part) > 70: 
-                        url_display_part = url_display_part[:67] + "..."
-                    link_identifier_line = f"🏷️ `{escape_markdown_v2(url_display_part)}`\n" 
-
-            href_source_url = source_url_normalized.replace('amp%3B', '&') 
-            href_lot_url = lot_url_original.replace('amp%3B', '&')
-
-            cadastral_number_link_display_text_MAPRU = ""
-            cadastral_number_link_display_text_KadastrRu = ""
-            if cadastral_number:
-                safe_cadastral_number = cadastral_number.replace(':', '%3A')
-                cadastral_number_url_MAPRU = f"https://map.ru/pkk?kad={safe_cadastral_number}&z=17"
-                cadastral_number_url_KADASSTRU = f"https://links.kadastrru.info/objects/find?cadnum={safe_cadastral_number}&type=parcel"
-                cadastral_number_link_display_text_MAPRU = f"🏠 [{escape_markdown_v2('MapRu')}]({cadastral_number_url_MAPRU})"
-                cadastral_number_link_display_text_KadastrRu = f"[{escape_markdown_v2(' KadastrRU')}]({cadastral_number_url_KADASSTRU})"
-
-            source_link_display_text = escape_markdown_v2("Источник RSS")
-            lot_link_display_text = escape_markdown_v2("Подробнее о лоте")
+            default_identifier_line, body, title_original = self._render_new_lot_message(lot_data, source_url_normalized)
+        except Exception as e:
+            logger.error(f"Unexpected error rendering notification for {source_url_normalized}: {e}", exc_info=True)
+            return
 
+        for chat_id, user_id in recipients:
+            user_alias = self.data_manager.get_subscription_alias(user_id, source_url_normalized)
+            link_identifier_line = f"🏷️ *{escape_markdown_v2(user_alias)}*\n" if user_alias else default_identifier_line
             message_text = (
                 f"🔔 *{escape_markdown_v2('Новый лот!')}*\n"
                 f"{link_identifier_line}\n" 
-                f"🏷️ *{escape_markdown_v2('Название:')}* {escaped_title}\n"
-                f"🔗 [{source_link_display_text}]({href_source_url})\n" 
-                f"👉 [{lot_link_display_text}]({href_lot_url})\n"
-                f"{cadastral_number_link_display_text_MAPRU}"
-                f"{cadastral_number_link_display_text_KadastrRu}"
+                f"{body}"
             )
-            
-            logger.debug(f"USER_ID {user_id} - Original Title: '{title_original}'")
-            logger.debug(f"USER_ID {user_id} - Source URL Normalized: '{source_url_normalized}'")
-            logger.debug(f"USER_ID {user_id} - Alias: '{user_alias}'")
-            logger.info(f"USER_ID {user_id} - ПОПЫТКА ОТПРАВКИ СООБЩЕНИЯ С ССЫЛКАМИ (MarkdownV2):\n{message_text}")
+            outcome = self._send_new_lot_message(bot_instance, chat_id, user_id, message_text, title_original, user_alias, source_url_normalized)
+            if on_recipient_done is not None and not on_recipient_done(user_id, outcome):
+                break
 
-            bot_instance.send_message(chat_id, message_text, parse_mode="MarkdownV2", disable_web_page_preview=True)
-            logger.info(f"Sent notification with links for lot: {title_original[:50]}...")
+    def _send_new_lot_message(self, bot_instance: telebot.TeleBot, chat_id: int, user_id: int, message_text: str,
+                              title_original: str, user_alias: Optional[str], source_url_normalized: str) -> str:
+        """Отправляет уведомление одному получателю и возвращает итог (SEND_*)."""
+        try:
+            # Текст сообщения целиком не логируем: на пачке рассылок это заметная доля времени и диска.
+            logger.debug("Sending lot notification to user %s (alias %r, source %s)", user_id, user_alias, source_url_normalized)
+
+            self._send_with_flood_retry(bot_instance, chat_id, message_text)
+            logger.info("Sent notification to user %s for lot: %.50s", user_id, title_original,
+                        extra={"user_id": user_id, "chat_id": chat_id, "url": source_url_normalized})
+            return SEND_OK
 
         except telebot.apihelper.ApiTelegramException as e:
             error_description = e.description if hasattr(e, 'description') else str(e)
@@ -100,24 +128,47 @@ class NotificationService:
             elif e.error_code == 400 and (error_json and error_json.get("description", "").lower().count("chat not found")):
                  logger.warning(f"Chat {chat_id} (user {user_id}) not found. Deactivating user.")
                  self.data_manager.set_user_active_status(user_id, False)
+            # 429 сверх MAX_FLOOD_WAIT_SECONDS и ошибки сервера Telegram проходят при повторе, остальные 4xx — нет.
+            return SEND_FAILED_TRANSIENTLY if e.error_code == 429 or e.error_code >= 500 else SEND_FAILED_PERMANENTLY
+        except requests.exceptions.RequestException as e:
+            # Сетевая ошибка уже после повторов соединения в транспорте (см. telegram_api_service).
+            # Текст исключения не логируем: в нём URL запроса с токеном бота и текстом сообщения.
+            logger.warning(f"Network error sending notification to chat {chat_id} (user {user_id}): {type(e).__name__}")
+            return SEND_FAILED_TRANSIENTLY
         except Exception as e:
+            # Ошибка в нашем коде повторится и при следующей попытке — лот не держим в outbox бесконечно.
             logger.error(f"Unexpected error sending notification (WITH LINKS) to chat {chat_id} (user {user_id}): {e}", exc_info=True)
+            return SEND_FAILED_PERMANENTLY
     
-    def send_link_deactivated_notification(self, bot_instance: telebot.TeleBot, chat_id: int, user_id: int, link_url: str):
+    def _send_with_flood_retry(self, bot_instance: telebot.TeleBot, chat_id: int, message_text: str):
+        """Отправка с одним повтором после 429 Too Many Requests; остальные ошибки API не повторяются."""
         try:
-            link_url_for_code_block = link_url.replace('`', '\'') 
-            
-            text_header = escape_markdown_v2("Ссылка деактивирована!")
-            text_part1 = escape_markdown_v2("Ссылка ")
-            text_part2 = escape_markdown_v2(" была деактивирована из-за слишком большого количества ошибок при проверке или стала недоступна.")
-            text_part3 = escape_markdown_v2("Вы больше не будете получать уведомления по ней, пока ошибка не будет устранена и ссылка не будет добавлена заново.")
+            bot_instance.send_message(chat_id, message_text, parse_mode="MarkdownV2", disable_web_page_preview=True)
+        except telebot.apihelper.ApiTelegramException as e:
+            retry_after = (e.result_json or {}).get("parameters", {}).get("retry_after") if e.error_code == 429 else None
+            if not retry_after or retry_after > MAX_FLOOD_WAIT_SECONDS:
+                raise
+            logger.warning(f"Flood control for chat {chat_id}, retrying in {retry_after}s.")
+            time.sleep(retry_after)
+            bot_instance.send_message(chat_id, message_text, parse_mode="MarkdownV2", disable_web_page_preview=True)
 
-            message_text = (
-                f"⚠️ *{text_header}*\n\n"
-                f"{text_part1}`{link_url_for_code_block}`{text_part2}\n"
-                f"{text_part3}"
-            )
-            bot_instance.send_message(chat_id, message_text, parse_mode="MarkdownV2")
-            logger.info(f"Sent link deactivation notice to chat {chat_id} (user {user_id}) for link: {link_url}")
-        except Exception as e:
-             logger.error(f"Error sending link deactivation notice to chat {chat_id} (user {user_id}): {e}", exc_info=True)
\ No newline at end of file
+    def send_link_deactivated_notifications(self, bot_instance: telebot.TeleBot, recipients: Sequence[Tuple[int, int]], link_url: str):
+        link_url_for_code_block = link_url.replace('`', '\'') 
+        
+        text_header = escape_markdown_v2("Ссылка деактивирована!")
+        text_part1 = escape_markdown_v2("Ссылка ")
+        text_part2 = escape_markdown_v2(" была деактивирована из-за слишком большого количества ошибок при проверке или стала недоступна.")
+        text_part3 = escape_markdown_v2("Вы больше не будете получать уведомления по ней, пока ошибка не будет устранена и ссылка не будет добавлена заново.")
+
+        message_text = (
+            f"⚠️ *{text_header}*\n\n"
+            f"{text_part1}`{link_url_for_code_block}`{text_part2}\n"
+            f"{text_part3}"
+        )
+        for chat_id, user_id in recipients:
+            try:
+                bot_instance.send_message(chat_id, message_text, parse_mode="MarkdownV2")
+                logger.info("Sent link deactivation notice to chat %s (user %s) for link: %s", chat_id, user_id, link_url,
+                            extra={"user_id": user_id, "chat_id": chat_id, "url": link_url})
+            except Exception as e:
+                 logger.error(f"Error sending link deactivation notice to chat {chat_id} (user {user_id}): {e}", exc_info=True)
@@ -1,40 +1,299 @@
-
-import feedparser
+import calendar
+import importlib
+import json
 import logging
+import multiprocessing
 import re
-from typing import List, Dict, Optional
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlparse, urlunparse, parse_qsl, urlencode
+from config import PARSER_PROCESSES, PARSER_TIMEOUT_SECONDS, PARSER_SPARE_POOLS
+from models import Lot, DEFAULT_LOT_SOURCE, iso_to_epoch
 
 logger = logging.getLogger(__name__)
 
+CADASTRAL_NUMBER_REGEX = re.compile(r"\b\d{2}:\d{2}:\d{6,8}:\d{1,5}\b")
+
+
+def extrac_cadastral_number(text: str) -> Optional[str]:
+    cadastral_number = CADASTRAL_NUMBER_REGEX.search(text)
+    if cadastral_number:
+        return f"{cadastral_number.group(0)}"
+    else:
+        return None
+
+def find_websub_hub(feed_links: List[dict]) -> Optional[Tuple[str, Optional[str]]]:
+    """(hub, self) из ссылок уровня ленты, если лента объявляет WebSub-хаб (<link rel="hub">)."""
+    hub_url = self_url = None
+    for link in feed_links or ():
+        rel, href = link.get('rel'), link.get('href')
+        if rel == 'hub' and href and not hub_url:
+            hub_url = href
+        elif rel == 'self' and href and not self_url:
+            self_url = href
+    return (hub_url, self_url) if hub_url else None
+
+
+def entry_published_epoch(entry) -> Optional[int]:
+    """published записи (или updated, если published нет) в секундах UTC; None — даты в ленте нет."""
+    parsed = entry.get('published_parsed') or entry.get('updated_parsed')
+    return calendar.timegm(parsed) if parsed else None
+
+
+def parse_feed_entries(feed_content: bytes) -> Tuple[List[tuple], Optional[str], int, Optional[Tuple[str, Optional[str]]]]:
+    """Разбирает ленту в компактные кортежи (guid, title, url, cadastral_number, published, price).
+
+    Выполняется и в пуле процессов, поэтому возвращает только то, что дёшево
+    передать обратно: строки лотов, текст bozo-ошибки, число пропущенных записей
+    и WebSub-хаб ленты (hub, self) или None.
+    """
+    import feedparser # тяжёлый модуль: загружается при первом разборе или в warm_up, а не при старте бота
+    feed = feedparser.parse(feed_content)
+    rows = []
+    skipped = 0
+    for entry in feed.entries:
+        guid = entry.get('guid') or entry.get('id') or entry.get('link')
+        if not guid:
+            skipped += 1
+            continue
+        link = entry.get('link')
+        description = entry.get('description', '')
+        rows.append((
+            guid,
+            entry.get('title', 'N/A'),
+            link or guid,
+            extrac_cadastral_number(description) if description else None,
+            entry_published_epoch(entry),
+            None
+        ))
+    bozo_message = str(feed.bozo_exception) if feed.bozo else None
+    return rows, bozo_message, skipped, find_websub_hub(feed.feed.get('links'))
+
+
+# --- torgi.gov.ru: JSON-поиск вместо RSS той же выборки ---
+TORGI_HOST = "torgi.gov.ru"
+TORGI_RSS_PATH_SUFFIX = "/lotcards/rss"
+TORGI_SEARCH_PATH_SUFFIX = "/lotcards/search"
+TORGI_LOT_URL = "https://torgi.gov.ru/new/public/lots/lot/{}"
+TORGI_LOT_ID_REGEX = re.compile(r"/lots/lot/([^/?#\s]+)")
+TORGI_SEARCH_DEFAULTS = {"size": "100", "sort": "firstVersionPublicationDate,desc"} # как минимум столько, сколько отдаёт RSS
+
+
+def _torgi_cadastral_number(lot: Dict[str, Any]) -> Optional[str]:
+    for characteristic in lot.get("characteristics") or ():
+        if "cadastral" in str(characteristic.get("code", "")).lower():
+            value = characteristic.get("characteristicValue")
+            if isinstance(value, list):
+                value = value[0] if value else None
+            if value:
+                return str(value).strip()
+    # В части извещений кадастровый номер есть только в тексте.
+    for field in ("lotName", "lotDescription", "estateAddress"):
+        text = lot.get(field)
+        if text and (cadastral_number := extrac_cadastral_number(text)):
+            return cadastral_number
+    return None
+
+
+def parse_torgi_search(content: bytes) -> Tuple[List[tuple], Optional[str], int, Optional[Tuple[str, Optional[str]]]]:
+    """Ответ JSON-поиска torgi.gov.ru в те же кортежи, что и parse_feed_entries: поля берутся
+    из структуры лота, без HTML-описания и регулярных выражений."""
+    data = json.loads(content)
+    lots = data.get("content") if isinstance(data, dict) else None
+    if not isinstance(lots, list):
+        raise ValueError("torgi.gov.ru search response has no 'content' list")
+    rows = []
+    skipped = 0
+    for lot in lots:
+        lot_id = lot.get("id") if isinstance(lot, dict) else None
+        if not lot_id:
+            skipped += 1
+            continue
+        lot_url = TORGI_LOT_URL.format(lot_id)
+        price = lot.get("priceMin")
+        rows.append((
+            lot_url,
+            lot.get("lotName") or lot.get("lotDescription") or "N/A",
+            lot_url,
+            _torgi_cadastral_number(lot),
+            iso_to_epoch(lot.get("firstVersionPublicationDate") or lot.get("createDate")),
+            float(price) if isinstance(price, (int, float)) else None
+        ))
+    return rows, None, skipped, None
+
+
+class SourceAdapter:
+    """Откуда и как брать лоты ссылки. Базовый адаптер — сама ссылка как RSS/Atom через feedparser.
+
+    `name` — схема GUID лотов: при смене схемы у ссылки (см. DataManager.diff_and_record)
+    текущие лоты записываются известными без уведомлений. `parse_entries` — функция
+    модуля, чтобы её можно было выполнить в пуле процессов.
+    """
+    name = DEFAULT_LOT_SOURCE
+    accept: Optional[str] = None
+    parse_entries: Callable = staticmethod(parse_feed_entries)
+
+    def matches(self, normalized_url: str) -> bool:
+        return True
+
+    def request_url(self, normalized_url: str) -> str:
+        return normalized_url
+
+    def adopt_fallback_lots(self, lots: List[Lot]) -> List[Lot]:
+        """Лоты, полученные запасным путём из RSS, в схеме GUID адаптера."""
+        return lots
+
+
+class TorgiGovAdapter(SourceAdapter):
+    """RSS-поиск torgi.gov.ru (…/lotcards/rss?…) читается через JSON-поиск с теми же параметрами."""
+    name = "torgi"
+    accept = "application/json"
+    parse_entries = staticmethod(parse_torgi_search)
 
+    def matches(self, normalized_url: str) -> bool:
+        parsed = urlparse(normalized_url)
+        return (parsed.netloc == TORGI_HOST or parsed.netloc.endswith("." + TORGI_HOST)) and parsed.path.endswith(TORGI_RSS_PATH_SUFFIX)
+
+    def request_url(self, normalized_url: str) -> str:
+        parsed = urlparse(normalized_url)
+        path = parsed.path[:-len(TORGI_RSS_PATH_SUFFIX)] + TORGI_SEARCH_PATH_SUFFIX
+        params = parse_qsl(parsed.query, keep_blank_values=True)
+        present = {key for key, _ in params}
+        params.extend((key, value) for key, value in TORGI_SEARCH_DEFAULTS.items() if key not in present)
+        return urlunparse((parsed.scheme, parsed.netloc, path, parsed.params, urlencode(params), ""))
+
+    def adopt_fallback_lots(self, lots: List[Lot]) -> List[Lot]:
+        adopted = []
+        for lot in lots:
+            match = TORGI_LOT_ID_REGEX.search(lot.url) or TORGI_LOT_ID_REGEX.search(lot.guid)
+            adopted.append(lot._replace(guid=TORGI_LOT_URL.format(match.group(1))) if match else lot)
+        return adopted
+
+
+RSS_ADAPTER = SourceAdapter()
+SOURCE_ADAPTERS = (TorgiGovAdapter(),) # проверяются по порядку, RSS_ADAPTER — если не подошёл ни один
+
+
+def select_source_adapter(normalized_url: str) -> SourceAdapter:
+    for adapter in SOURCE_ADAPTERS:
+        if adapter.matches(normalized_url):
+            return adapter
+    return RSS_ADAPTER
+
+
+def _start_pool_worker() -> int:
+    return 0
+
+
+def _fork_pool(processes: int) -> Tuple[ProcessPoolExecutor, list]:
+    """Пул на fork и его процессы: с fork первая задача запускает сразу все процессы пула."""
+    before = set(multiprocessing.active_children())
+    executor = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("fork"))
+    executor.submit(_start_pool_worker).result()
+    return executor, [process for process in multiprocessing.active_children() if process not in before]
 
 
 class ParserService:
-    def parse_rss_feed(self, feed_content: bytes) -> Optional[List[Dict[str, str]]]:
-        lots_data = []
+    def __init__(self, processes: int = PARSER_PROCESSES, timeout: float = PARSER_TIMEOUT_SECONDS,
+                 spare_pools: int = PARSER_SPARE_POOLS):
+        """processes > 0 — разбор в пуле процессов. Сервис нужно создавать до первого потока процесса.
+
+        Пул работает на fork: spawn и forkserver заново выполняют главный модуль (bot.py)
+        в каждом процессе пула. Форк безопасен, только пока в процессе один поток (иначе
+        потомок может унаследовать захваченную блокировку логирования или очереди),
+        поэтому bot.py и воркер создают сервис до setup_logging и DataManager, а все
+        процессы пула запускаются здесь же и позже не пересоздаются.
+
+        Зависший разбор не прервать отменой задачи, поэтому рядом с рабочим пулом
+        форкаются spare_pools запасных: по таймауту процессы рабочего пула убиваются,
+        и его место занимает запасной. Запасные форкаются сразу после рабочего, когда
+        кроме главного работают только служебные потоки рабочего пула; их блокировки
+        процессы запасного пула не используют. Когда запасных не осталось, разбор
+        идёт в вызывающем потоке.
+        """
+        self.timeout = timeout
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._workers: list = []
+        self._spares: List[Tuple[ProcessPoolExecutor, list]] = []
+        self._pool_lock = threading.Lock()
+        if processes > 0:
+            if threading.active_count() > 1:
+                logger.warning(f"Feed parser pool is forked with {threading.active_count()} threads running; "
+                               f"create ParserService before starting threads.")
+            self._executor, self._workers = _fork_pool(processes)
+            self._spares = [_fork_pool(processes) for _ in range(max(0, spare_pools))]
+            logger.info(f"Feed parsing offloaded to a pool of {processes} process(es), {len(self._spares)} spare pool(s).")
+
+    def _replace_pool(self, executor: ProcessPoolExecutor, reason: str):
+        """Убивает процессы пула executor и ставит на его место запасной (или разбор в потоке)."""
+        with self._pool_lock:
+            if self._executor is not executor:
+                return # пул уже заменён другим потоком
+            workers = self._workers
+            if self._spares:
+                self._executor, self._workers = self._spares.pop(0)
+                logger.error(f"Feed parser pool replaced by a pre-forked spare ({len(self._spares)} left): {reason}.")
+            else:
+                self._executor, self._workers = None, []
+                logger.error(f"No spare feed parser pool left, parsing in the calling thread from now on: {reason}.")
+        # Разборы других потоков в этом пуле получат BrokenProcessPool, то есть ошибку разбора.
+        for process in workers:
+            process.kill()
+        executor.shutdown(wait=False, cancel_futures=True)
+        for process in workers:
+            process.join(1)
+
+    def _run(self, parse_entries: Callable, feed_content: bytes):
+        executor = self._executor
+        if executor is None:
+            return parse_entries(feed_content)
+        future = executor.submit(parse_entries, feed_content)
         try:
-            feed = feedparser.parse(feed_content)
-            if feed.bozo:
-                logger.warning(f"Feed parsing resulted in bozo: {feed.bozo_exception}")
-            
-            for entry in feed.entries:
-                guid = entry.get('guid') or entry.get('id') or entry.get('link')
-                title = entry.get('title', 'N/A')
-                link = entry.get('link')
-                description = entry.get('description', '')
-
-                if not guid:
-                    logger.warning(f"Skipping entry, no GUID found. Title: {title[:50]}...")
-                    continue
-                
-                lots_data.append({
-                    'guid': guid,
-                    'title': title,
-                    'url': link or guid,
-                    'description': description
-                })
-            logger.info(f"Parsed {len(lots_data)} entries from feed.")
-            return lots_data
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            # Отмена не останавливает уже начатый разбор: процесс занят им, пока его не убить.
+            self._replace_pool(executor, f"parsing took longer than {self.timeout:g}s")
+            raise TimeoutError(f"feed parsing took longer than {self.timeout:g}s") from None
+        except BrokenProcessPool:
+            # Процесс пула погиб (OOM, сигнал) или пул убит после таймаута: пул больше не принимает
+            # задач, а новый форк из многопоточного процесса небезопасен — берём запасной.
+            self._replace_pool(executor, "a parser process died")
+            raise
+
+    def warm_up(self):
+        """Заранее загружает feedparser, чтобы первая проверка не платила за импорт."""
+        importlib.import_module("feedparser")
+
+    def parse_rss_feed(self, feed_content: bytes) -> Optional[List[Lot]]:
+        return self.parse_feed(feed_content)[0]
+
+    def parse_feed(self, feed_content: bytes, parse_entries: Callable = parse_feed_entries) -> Tuple[Optional[List[Lot]], Optional[Tuple[str, Optional[str]]]]:
+        """Лоты ленты (None при ошибке разбора) и её WebSub-хаб (hub, self) или None.
+
+        parse_entries — разбор конкретного источника (SourceAdapter.parse_entries), по умолчанию RSS/Atom.
+        """
+        try:
+            rows, bozo_message, skipped, hub = self._run(parse_entries, feed_content)
+
+            if bozo_message:
+                logger.warning(f"Feed parsing resulted in bozo: {bozo_message}")
+            if skipped:
+                logger.warning(f"Skipped {skipped} entries without GUID.")
+
+            lots_data = [Lot._make(row) for row in rows]
+            logger.info("Parsed %d entries from feed.", len(lots_data))
+            return lots_data, hub
         except Exception as e:
-            logger.error(f"Error parsing RSS feed: {e}", exc_info=True)
-            return None
+            logger.error(f"Error parsing feed: {e}", exc_info=True)
+            return None, None
+
+    def close(self):
+        with self._pool_lock:
+            executors = [executor for executor, _ in self._spares]
+            if self._executor is not None:
+                executors.insert(0, self._executor)
+            self._executor, self._workers, self._spares = None, [], []
+        for executor in executors:
+            executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,108 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+from config import (RATE_LIMIT_COMMANDS_PER_MINUTE, RATE_LIMIT_COMMANDS_BURST, RATE_LIMIT_EXPENSIVE_PER_MINUTE,
+                    RATE_LIMIT_EXPENSIVE_BURST, RATE_LIMIT_IDLE_SECONDS, RATE_LIMIT_MAX_USERS)
+
+logger = logging.getLogger(__name__)
+
+COST_CHEAP = "cheap"
+COST_EXPENSIVE = "expensive"
+
+
+class TokenBuckets:
+    """Token bucket на каждого пользователя: burst токенов, пополнение rate_per_minute в минуту.
+
+    Ведро — список [токены, время пополнения, предупреждён ли]; ключи в порядке
+    последнего обращения, поэтому простаивающие ведра снимаются с головы.
+    Простоявшее idle_seconds ведро уже заново полно, и удалить его — то же, что
+    оставить. Память ограничена max_entries независимо от числа пользователей.
+    """
+
+    def __init__(self, rate_per_minute: float, burst: int, idle_seconds: float = RATE_LIMIT_IDLE_SECONDS,
+                 max_entries: int = RATE_LIMIT_MAX_USERS):
+        self.rate = rate_per_minute / 60.0
+        self.burst = float(max(burst, 1))
+        # Раньше, чем ведро наполнится, удалять нельзя: это подарило бы пользователю лишние токены.
+        self.idle_seconds = max(idle_seconds, self.burst / self.rate) if self.rate > 0 else idle_seconds
+        self.max_entries = max_entries
+        self._buckets: "OrderedDict[int, List]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.throttled = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def _evict(self, now: float):
+        buckets = self._buckets
+        while buckets:
+            bucket = next(iter(buckets.values()))
+            if len(buckets) <= self.max_entries and now - bucket[1] < self.idle_seconds:
+                break
+            buckets.popitem(last=False)
+
+    def acquire(self, user_id: int) -> Tuple[bool, float, bool]:
+        """(разрешено, через сколько секунд появится токен, нужно ли сообщить об ограничении).
+
+        О превышении сообщается один раз, пока у пользователя снова не появится токен,
+        чтобы поток сообщений не превращался в такой же поток ответов.
+        """
+        if not self.enabled:
+            return True, 0.0, False
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(user_id)
+            if bucket is None:
+                bucket = self._buckets[user_id] = [self.burst, now, False]
+                self._evict(now)
+            else:
+                self._buckets.move_to_end(user_id)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] >= 1.0:
+                bucket[0] -= 1.0
+                bucket[2] = False
+                self.allowed += 1
+                return True, 0.0, False
+            self.throttled += 1
+            notify = not bucket[2]
+            bucket[2] = True
+            return False, (1.0 - bucket[0]) / self.rate, notify
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"users": len(self._buckets), "allowed": self.allowed, "throttled": self.throttled}
+
+
+class RateLimitService:
+    """Ограничение частоты команд каждого пользователя до обработчиков bot.py.
+
+    Любое сообщение тратит токен из ведра дешёвых команд; команды, которые создают
+    ссылки и запускают первичное заполнение (/add, ссылка текстом, /import), — ещё
+    и из отдельного, более строгого ведра дорогих.
+    """
+
+    def __init__(self, commands_per_minute: float = RATE_LIMIT_COMMANDS_PER_MINUTE, commands_burst: int = RATE_LIMIT_COMMANDS_BURST,
+                 expensive_per_minute: float = RATE_LIMIT_EXPENSIVE_PER_MINUTE, expensive_burst: int = RATE_LIMIT_EXPENSIVE_BURST):
+        self.buckets = {
+            COST_CHEAP: TokenBuckets(commands_per_minute, commands_burst),
+            COST_EXPENSIVE: TokenBuckets(expensive_per_minute, expensive_burst),
+        }
+
+    def check(self, user_id: int, cost: str = COST_CHEAP) -> Tuple[bool, float, bool]:
+        """См. TokenBuckets.acquire. Дорогая команда, не прошедшая по дешёвому ведру, дорогой токен не тратит."""
+        limited_by = COST_CHEAP
+        allowed, retry_after, notify = self.buckets[COST_CHEAP].acquire(user_id)
+        if allowed and cost == COST_EXPENSIVE:
+            limited_by = COST_EXPENSIVE
+            allowed, retry_after, notify = self.buckets[COST_EXPENSIVE].acquire(user_id)
+        if notify:
+            logger.info(f"User {user_id} throttled on {limited_by} commands, next token in {retry_after:.0f}s.")
+        return allowed, retry_after, notify
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        return {cost: buckets.stats() for cost, buckets in self.buckets.items()}
@@ -0,0 +1,159 @@
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from config import NOTIFY_SLO_SECONDS, NOTIFY_SLO_QUANTILE
+from data_manager import DataManager
+from models import LATENCY_BUCKET_LABELS, histogram_quantile
+from services.delivery_service import DeliveryService
+from services.fetcher_service import FetcherService
+from services.rate_limit_service import RateLimitService
+
+logger = logging.getLogger(__name__)
+
+STATS_TOP_N = 5
+MAX_URL_DISPLAY = 60
+SLO_MIN_SAMPLES = 5 # по меньшему числу уведомлений ссылку не судим
+
+
+def _format_bytes(size: float) -> str:
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+def _format_seconds(seconds) -> str:
+    if seconds is None:
+        return "-"
+    if seconds == float("inf"):
+        return ">1d"
+    if seconds < 60:
+        return f"{seconds:.0f}s"
+    if seconds < 3600:
+        return f"{seconds / 60:.0f}m"
+    return f"{seconds / 3600:.0f}h"
+
+
+def _export_latency(latency: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    # Квантили для лога не нужны (их восстановят из counts), а верхняя корзина — inf, что не JSON.
+    return {stage: {key: histogram[key] for key in ("count", "mean", "counts")} for stage, histogram in latency.items()}
+
+
+def _short_url(url: str) -> str:
+    return url if len(url) <= MAX_URL_DISPLAY else url[:MAX_URL_DISPLAY - 3] + "..."
+
+
+class StatsService:
+    """Сводка состояния для администраторов (/stats).
+
+    Все цифры берутся из памяти: итоги последних циклов проверок, очередь
+    доставки, счётчики хранилища и кольцевые буферы LinkHealth, поэтому ответ
+    собирается за миллисекунды и не трогает диск.
+    """
+
+    def __init__(self, dm: DataManager, delivery_service: DeliveryService, fetcher_service: FetcherService, top_n: int = STATS_TOP_N,
+                 slo_seconds: float = NOTIFY_SLO_SECONDS, slo_quantile: float = NOTIFY_SLO_QUANTILE,
+                 rate_limit_service: Optional[RateLimitService] = None):
+        self.data_manager = dm
+        self.delivery_service = delivery_service
+        self.fetcher_service = fetcher_service
+        self.top_n = top_n
+        self.slo_seconds = slo_seconds
+        self.slo_quantile = slo_quantile
+        self.rate_limit_service = rate_limit_service
+
+    def _slo_value(self, histogram: Dict[str, Any]) -> Optional[float]:
+        return histogram_quantile(histogram["counts"], self.slo_quantile)
+
+    def find_slo_breaches(self, per_link: List[Tuple[str, Dict[str, Any]]]) -> List[Tuple[str, Dict[str, Any]]]:
+        """Ссылки, у которых квантиль времени до уведомления (дата в ленте -> отправка) выше цели, худшие первыми."""
+        breaches = [(url, latency) for url, latency in per_link
+                    if latency["total"]["count"] >= SLO_MIN_SAMPLES and self._slo_value(latency["total"]) > self.slo_seconds]
+        breaches.sort(key=lambda item: self._slo_value(item[1]["total"]), reverse=True)
+        return breaches
+
+    def _latency_lines(self) -> List[str]:
+        overall, per_link = self.data_manager.get_notify_latency()
+        lines = ["Time to notify, bucket upper bounds (p50/p90/p99, n):"]
+        for stage in ("detection", "delivery", "total"):
+            histogram = overall[stage]
+            lines.append(f"  {stage:<9} {_format_seconds(histogram['p50'])}/{_format_seconds(histogram['p90'])}/"
+                         f"{_format_seconds(histogram['p99'])}, n={histogram['count']}")
+        breaches = self.find_slo_breaches(per_link)
+        slo_key = f"p{self.slo_quantile * 100:g}"
+        lines.append(f"SLO {slo_key} <= {_format_seconds(self.slo_seconds)} missed by {len(breaches)} link(s) "
+                     f"(total {slo_key} / detection / delivery):")
+        for url, latency in breaches[:self.top_n]:
+            lines.append(f"  {_format_seconds(self._slo_value(latency['total'])):>4} / {_format_seconds(self._slo_value(latency['detection'])):>4} / "
+                         f"{_format_seconds(self._slo_value(latency['delivery'])):>4}  {_short_url(url)}")
+        return lines
+
+    def log_notify_latency(self):
+        """Периодическая выгрузка гистограмм в лог (поля extra= попадают в JSON при LOG_FORMAT=json)."""
+        overall, per_link = self.data_manager.get_notify_latency()
+        breaches = self.find_slo_breaches(per_link)
+        logger.info(f"Notify latency: total p90 {_format_seconds(overall['total']['p90'])} over {overall['total']['count']} send(s), "
+                    f"{len(breaches)} link(s) miss the SLO.", extra={"latency": _export_latency(overall), "buckets": LATENCY_BUCKET_LABELS, "slo_breaches": len(breaches)})
+        for url, latency in breaches:
+            logger.warning(f"Link {url} misses the notify SLO: total p{self.slo_quantile * 100:g} "
+                           f"{_format_seconds(self._slo_value(latency['total']))}, detection "
+                           f"{_format_seconds(self._slo_value(latency['detection']))}.", extra={"url": url, "latency": _export_latency(latency)})
+
+    def _cycle_lines(self, now: float) -> List[str]:
+        cycles = self.data_manager.get_check_cycles()
+        if not cycles:
+            return ["  no completed cycle yet"]
+        lines = []
+        for label, cycle in sorted(cycles.items()):
+            duration = cycle.get("duration") or 0
+            rate = cycle["checked"] / duration if duration else 0
+            deferred = f", {cycle['deferred']} deferred" if cycle.get("deferred") else ""
+            lines.append(f"  {label}: {cycle['checked']}/{cycle['links']} checked, {cycle['failed']} failed{deferred}, "
+                         f"{duration:.1f}s ({rate:.1f} links/s), {_format_bytes(cycle['bytes'])}, "
+                         f"{(now - cycle['finished_at']) / 60:.0f} min ago")
+        return lines
+
+    def _top_lines(self, health: List[Tuple[str, Dict[str, Any]]], title: str,
+                   key: Callable[[Dict[str, Any]], float], render: Callable[[Dict[str, Any]], str]) -> List[str]:
+        ranked = sorted((item for item in health if key(item[1]) > 0), key=lambda item: key(item[1]), reverse=True)[:self.top_n]
+        lines = [f"{title}:"]
+        lines.extend(f"  {render(summary):>10}  {_short_url(url)}" for url, summary in ranked)
+        if not ranked:
+            lines.append("  -")
+        return lines
+
+    def render_stats(self) -> str:
+        """Текст ответа /stats в MarkdownV2 (моноширинный блок)."""
+        started = time.perf_counter()
+        now = time.time()
+        store = self.data_manager.get_store_stats()
+        dedup = self.delivery_service.get_dedup_stats()
+        open_circuits = [host for host, stats in self.fetcher_service.get_host_stats().items() if stats["circuit"] != "closed"]
+        health = self.data_manager.get_link_health()
+
+        lines = ["Check cycles:"]
+        lines.extend(self._cycle_lines(now))
+        backpressure = self.delivery_service.backpressure
+        lines.append(f"Delivery: queue {self.delivery_service.queue.qsize()}, outbox {store['outbox']} lot(s) / "
+                     f"{store['outbox_sends']} send(s), dedup hit rate {dedup['hit_rate']:.0%}")
+        if backpressure.is_engaged():
+            lines.append(f"Backpressure ON: checks deferred until outbox < {backpressure.low_watermark} sends")
+        lines.append(f"Store: users {store['active_users']}/{store['users']} active, links {store['active_links']}/{store['links']} active, "
+                     f"{store['known_guids']} known lots, journal {_format_bytes(store['journal_bytes'])}")
+        if open_circuits:
+            lines.append(f"Paused hosts: {', '.join(open_circuits)}")
+        if self.rate_limit_service is not None:
+            limits = self.rate_limit_service.get_stats()
+            lines.append("Rate limits: " + ", ".join(f"{cost} {stats['throttled']}/{stats['allowed'] + stats['throttled']} throttled "
+                                                     f"({stats['users']} user(s) tracked)" for cost, stats in limits.items()))
+        lines.extend(self._latency_lines())
+        lines.append("")
+        lines.extend(self._top_lines(health, "Slowest feeds (avg of last checks)", lambda s: s["avg_latency_ms"],
+                                     lambda s: f"{s['avg_latency_ms']} ms"))
+        lines.extend(self._top_lines(health, "Largest feeds", lambda s: s["avg_size"], lambda s: _format_bytes(s["avg_size"])))
+        lines.extend(self._top_lines(health, "Most errors", lambda s: s["errors"], lambda s: f"{s['errors']}/{s['checks']}"))
+        lines.append(f"(built in {(time.perf_counter() - started) * 1000:.1f} ms)")
+
+        text = "\n".join(lines).replace("\\", "\\\\").replace("`", "\\`")
+        return f"```\n{text}\n```"
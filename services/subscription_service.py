@@ -1,6 +1,7 @@
 import logging
 from typing import List, Dict, Any, Tuple, Optional
 from data_manager import DataManager
+from models import User
 
 logger = logging.getLogger(__name__)
 
@@ -18,14 +19,14 @@ class SubscriptionService:
     def get_user_subscriptions_display(self, user_id: int) -> List[Dict[str,str]]:
         user_subs_data = self.data_manager.get_subscriptions_for_user(user_id)
         display_subs = []
-        for i, sub_info_dict in enumerate(user_subs_data):
-            norm_url = sub_info_dict["url"]
-            alias = sub_info_dict.get("alias") 
+        for i, sub in enumerate(user_subs_data):
+            norm_url = sub.url
+            alias = sub.alias
 
-            link_data = self.data_manager.get_link(norm_url) 
-            display_url = link_data.get('original_url_example', norm_url) if link_data else norm_url
+            link = self.data_manager.get_link(norm_url) 
+            display_url = link.original_url_example if link else norm_url
             
-            if link_data and link_data.get('is_active', True):
+            if link and link.is_active:
                  display_subs.append({
                      'index': i + 1, 
                      'normalized_url': norm_url, 
@@ -34,7 +35,7 @@ class SubscriptionService:
                     })
         return display_subs
     
-    def get_subscribers_for_link(self, normalized_url: str) -> List[Dict[str, Any]]:
+    def get_subscribers_for_link(self, normalized_url: str) -> List[User]:
         return self.data_manager.get_active_subscribers_for_link(normalized_url)
 
     def set_alias_for_subscription(
@@ -0,0 +1,38 @@
+import logging
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from telebot import apihelper
+from config import TELEGRAM_API_URL, TELEGRAM_POOL_SIZE, TELEGRAM_CONNECT_TIMEOUT, TELEGRAM_READ_TIMEOUT, TELEGRAM_CONNECT_RETRIES
+
+logger = logging.getLogger(__name__)
+
+
+def configure_telegram_api(pool_size: int = TELEGRAM_POOL_SIZE, connect_timeout: float = TELEGRAM_CONNECT_TIMEOUT,
+                           read_timeout: float = TELEGRAM_READ_TIMEOUT, connect_retries: int = TELEGRAM_CONNECT_RETRIES,
+                           api_url: str = TELEGRAM_API_URL) -> requests.Session:
+    """Ставит telebot один общий для всех потоков пул keep-alive соединений к Bot API.
+
+    По умолчанию apihelper держит отдельную сессию в каждом потоке и пересоздаёт её
+    раз в 10 минут, так что после сброса каждая рассылка начинается с нового TLS-рукопожатия.
+
+    Повторы на уровне транспорта — только при ошибке соединения: запрос тогда точно
+    не дошёл до Telegram. Таймаут чтения, 5xx и 4xx не повторяются, чтобы не отправить
+    сообщение дважды; 429 обрабатывает NotificationService по retry_after.
+    """
+    retries = Retry(total=connect_retries, connect=connect_retries, read=0, status=0, other=0, redirect=0,
+                    backoff_factor=0.5, allowed_methods=None, raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retries)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    apihelper.session = session
+    apihelper.SESSION_TIME_TO_LIVE = None # иначе apihelper периодически подменяет сессию своей
+    apihelper.CONNECT_TIMEOUT = connect_timeout
+    apihelper.READ_TIMEOUT = read_timeout
+    if api_url:
+        apihelper.API_URL = api_url
+    logger.info(f"Telegram API client: pool of {pool_size} keep-alive connection(s), "
+                f"timeouts {connect_timeout}s/{read_timeout}s{f', endpoint {api_url}' if api_url else ''}.")
+    return session
@@ -0,0 +1,145 @@
+import hashlib
+import hmac
+import json
+import logging
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+import telebot
+from config import BOT_TOKEN, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_QUEUE_SIZE, WEBHOOK_WORKERS
+
+logger = logging.getLogger(__name__)
+
+MAX_UPDATE_BYTES = 1024 * 1024
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def webhook_secret() -> str:
+    # Telegram допускает в секрете только A-Z, a-z, 0-9, _ и -.
+    if WEBHOOK_SECRET:
+        return WEBHOOK_SECRET
+    return hashlib.sha256(b"webhook:" + BOT_TOKEN.encode('utf-8')).hexdigest()
+
+
+class WebhookService:
+    """Принимает обновления Telegram по HTTP и передаёт их обработчикам бота через ограниченную очередь.
+
+    Запрос проверяется по заголовку X-Telegram-Bot-Api-Secret-Token. Обработчики
+    выполняют workers потоков, читающих очередь, прямо в своём потоке — бот для этого
+    режима создаётся с threaded=False. Поэтому очередь действительно заполняется, когда
+    обработчики не успевают, и тогда сервер отвечает 503 с Retry-After — Telegram
+    повторит доставку позже. Обновления обрабатываются параллельно, как и в пуле
+    TeleBot при опросе: порядок между ними не гарантируется.
+    """
+
+    def __init__(self, bot_instance: telebot.TeleBot, listen: str = WEBHOOK_LISTEN, port: int = WEBHOOK_PORT,
+                 path: str = WEBHOOK_PATH, secret: Optional[str] = None, queue_size: int = WEBHOOK_QUEUE_SIZE,
+                 workers: int = WEBHOOK_WORKERS):
+        self.bot = bot_instance
+        self.listen = listen
+        self.port = port
+        self.path = path
+        self.secret = secret if secret is not None else webhook_secret()
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.workers = max(1, workers)
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._stop_event = threading.Event()
+        self._threads = []
+
+    def _make_handler(self):
+        service = self
+
+        class WebhookRequestHandler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                logger.debug(f"Webhook {self.address_string()} - {format % args}")
+
+            def _reply(self, status: int, retry_after: Optional[int] = None):
+                self.send_response(status)
+                if retry_after is not None:
+                    self.send_header("Retry-After", str(retry_after))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_POST(self):
+                if self.path != service.path:
+                    return self._reply(404)
+                token = self.headers.get(SECRET_HEADER, "")
+                if not hmac.compare_digest(token.encode('utf-8'), service.secret.encode('utf-8')):
+                    logger.warning(f"Webhook request from {self.address_string()} rejected: bad secret token.")
+                    return self._reply(403)
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                except ValueError:
+                    return self._reply(400)
+                if length <= 0 or length > MAX_UPDATE_BYTES:
+                    return self._reply(413 if length > 0 else 400)
+                try:
+                    update = json.loads(self.rfile.read(length))
+                except ValueError:
+                    return self._reply(400)
+                if not isinstance(update, dict) or "update_id" not in update:
+                    return self._reply(400)
+                try:
+                    service.queue.put_nowait(update)
+                except queue.Full:
+                    logger.warning(f"Webhook queue is full ({service.queue.maxsize}), asking Telegram to retry update {update['update_id']}.")
+                    return self._reply(503, retry_after=1)
+                self._reply(200)
+
+            def do_GET(self):
+                self._reply(405)
+
+        return WebhookRequestHandler
+
+    def start(self):
+        self._server = ThreadingHTTPServer((self.listen, self.port), self._make_handler())
+        self._server.daemon_threads = True
+        self._threads = [threading.Thread(target=self._server.serve_forever, name="WebhookServer", daemon=True)]
+        self._threads += [threading.Thread(target=self._dispatch, name=f"WebhookDispatcher-{i}", daemon=True)
+                          for i in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+        logger.info(f"Webhook server listening on {self.listen}:{self.server_port}{self.path}, {self.workers} handler thread(s).")
+
+    @property
+    def server_port(self) -> int:
+        return self._server.server_address[1] if self._server else self.port
+
+    def _dispatch(self):
+        while not self._stop_event.is_set():
+            try:
+                update = self.queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            try:
+                self.bot.process_new_updates([telebot.types.Update.de_json(update)])
+            except Exception as e:
+                logger.error(f"Error dispatching update {update.get('update_id')}: {e}", exc_info=True)
+            finally:
+                self.queue.task_done()
+
+    def set_webhook(self, public_url: str, max_connections: int = 40):
+        url = public_url.rstrip("/") + self.path
+        self.bot.set_webhook(url=url, secret_token=self.secret, max_connections=max_connections)
+        logger.info(f"Telegram webhook set to {url}.")
+
+    def stop(self, timeout: Optional[float] = None):
+        """Перестаёт принимать обновления и дорабатывает очередь до срока: на них уже ответили 200,
+        и Telegram их повторно не пришлёт."""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    break
+                self.queue.all_tasks_done.wait(remaining)
+        self._stop_event.set()
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()) if deadline is not None else None)
+        if self.queue.qsize():
+            logger.warning(f"Webhook stopped with {self.queue.qsize()} accepted update(s) not processed.")
@@ -0,0 +1,257 @@
+import hashlib
+import hmac
+import logging
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlparse, parse_qs
+import requests
+from config import (BOT_TOKEN, USER_AGENT, MAX_FEED_BYTES, WEBSUB_CALLBACK_URL, WEBSUB_LISTEN, WEBSUB_PORT, WEBSUB_PATH,
+                    WEBSUB_SECRET, WEBSUB_LEASE_SECONDS)
+from data_manager import DataManager
+from services.monitoring_service import MonitoringService
+
+logger = logging.getLogger(__name__)
+
+PUSH_QUEUE_SIZE = 100
+SUBSCRIBE_TIMEOUT_SECONDS = 10
+PENDING_INTENT_SECONDS = 600 # столько ждём проверки намерения от хаба, прежде чем повторить запрос
+SIGNATURE_HEADER = "X-Hub-Signature"
+SIGNATURE_ALGORITHMS = {"sha1": hashlib.sha1, "sha256": hashlib.sha256, "sha384": hashlib.sha384, "sha512": hashlib.sha512}
+
+
+def websub_master_secret() -> bytes:
+    if WEBSUB_SECRET:
+        return WEBSUB_SECRET.encode('utf-8')
+    return hashlib.sha256(b"websub:" + BOT_TOKEN.encode('utf-8')).digest()
+
+
+def link_callback_id(normalized_url: str) -> str:
+    return hashlib.sha256(normalized_url.encode('utf-8')).hexdigest()[:24]
+
+
+class WebSubService:
+    """Push-подписки WebSub (PubSubHubbub) для лент, объявляющих <link rel="hub">.
+
+    Хаб находит MonitoringService при обычной проверке и сохраняет в ссылке;
+    renew_subscriptions() (по расписанию) подписывается и продлевает аренду.
+    Встроенный HTTP-сервер отвечает на проверку намерения (hub.challenge) и
+    принимает содержимое ленты, подписанное HMAC (X-Hub-Signature) секретом
+    этой ссылки. Принятое передаётся в MonitoringService.process_pushed_content
+    через ограниченную очередь, опрос таких ссылок становится страховочным.
+    """
+
+    def __init__(self, dm: DataManager, ms: MonitoringService, callback_base: str = WEBSUB_CALLBACK_URL,
+                 listen: str = WEBSUB_LISTEN, port: int = WEBSUB_PORT, path: str = WEBSUB_PATH,
+                 lease_seconds: int = WEBSUB_LEASE_SECONDS, queue_size: int = PUSH_QUEUE_SIZE):
+        self.data_manager = dm
+        self.monitoring_service = ms
+        self.callback_base = callback_base.rstrip("/")
+        self.listen = listen
+        self.port = port
+        self.path = path.rstrip("/")
+        self.lease_seconds = lease_seconds
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._master_secret = websub_master_secret()
+        self._callbacks: Dict[str, str] = {} # id из пути колбэка -> url ссылки
+        self._pending: Dict[Tuple[str, str], float] = {} # (url, mode) -> время запроса к хабу
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._stop_event = threading.Event()
+        self._threads = []
+
+    def _secret_for(self, normalized_url: str) -> str:
+        return hmac.new(self._master_secret, normalized_url.encode('utf-8'), hashlib.sha256).hexdigest()
+
+    def _callback_url(self, normalized_url: str) -> str:
+        return f"{self.callback_base}{self.path}/{link_callback_id(normalized_url)}"
+
+    def _resolve_callback(self, callback_id: str) -> Optional[str]:
+        # Только поиск в памяти: запрос на колбэк не аутентифицирован, и неизвестный id
+        # не должен запускать обход всех ссылок под link_data_lock. Карта обновляется
+        # при запуске сервера, при продлении подписок и при каждом запросе к хабу —
+        # других адресов колбэка хаб знать не может.
+        with self._lock:
+            return self._callbacks.get(callback_id)
+
+    def _refresh_callbacks(self):
+        callbacks = {link_callback_id(url): url for url, _, _, _ in self.data_manager.get_websub_links()}
+        with self._lock:
+            self._callbacks = callbacks
+
+    def verify_signature(self, normalized_url: str, body: bytes, header: Optional[str]) -> bool:
+        algorithm, _, signature = (header or "").partition("=")
+        digest = SIGNATURE_ALGORITHMS.get(algorithm.strip().lower())
+        if digest is None or not signature:
+            return False
+        expected = hmac.new(self._secret_for(normalized_url).encode('utf-8'), body, digest).hexdigest()
+        return hmac.compare_digest(expected, signature.strip().lower())
+
+    def request_subscription(self, normalized_url: str, hub_url: str, topic: str, mode: str = "subscribe") -> bool:
+        """Отправляет хабу запрос подписки (или отписки); подтверждение придёт отдельным GET на колбэк."""
+        data = {"hub.mode": mode, "hub.topic": topic, "hub.callback": self._callback_url(normalized_url)}
+        if mode == "subscribe":
+            data.update({"hub.secret": self._secret_for(normalized_url), "hub.lease_seconds": str(self.lease_seconds)})
+        with self._lock:
+            self._callbacks[link_callback_id(normalized_url)] = normalized_url
+            self._pending[(normalized_url, mode)] = time.monotonic()
+        try:
+            response = requests.post(hub_url, data=data, timeout=SUBSCRIBE_TIMEOUT_SECONDS, headers={'User-Agent': USER_AGENT})
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"WebSub {mode} request to hub {hub_url} for {normalized_url} failed: {e}")
+            return False
+        if response.status_code not in (202, 204):
+            logger.warning(f"WebSub hub {hub_url} rejected {mode} for {normalized_url}: {response.status_code} {response.text[:200]}")
+            return False
+        logger.info(f"WebSub {mode} for {normalized_url} requested from hub {hub_url}.")
+        return True
+
+    def renew_subscriptions(self):
+        """Подписывает ссылки с хабом без подписки и продлевает аренду, истекающую в пределах десятой части срока."""
+        now = time.time()
+        renew_margin = self.lease_seconds / 10
+        links = self.data_manager.get_websub_links()
+        self._refresh_callbacks()
+        for normalized_url, hub_url, topic, lease_until in links:
+            if self._stop_event.is_set():
+                return
+            if lease_until and lease_until - now > renew_margin:
+                continue
+            with self._lock:
+                requested_at = self._pending.get((normalized_url, "subscribe"))
+            if requested_at is not None and time.monotonic() - requested_at < PENDING_INTENT_SECONDS:
+                continue
+            self.request_subscription(normalized_url, hub_url, topic)
+
+    def _verify_intent(self, normalized_url: str, params: Dict[str, str]) -> Optional[str]:
+        """Проверка намерения от хаба: challenge, если запрос действительно отправляли мы, иначе None."""
+        mode, topic = params.get("hub.mode"), params.get("hub.topic")
+        link = self.data_manager.get_link(normalized_url)
+        if link is None or not link.hub_url:
+            return None
+        if topic != (link.hub_topic or link.url):
+            return None
+        # Отказ хаба — ответ на наш запрос подписки: без него чужой GET мог бы снять действующую подписку.
+        with self._lock:
+            requested_at = self._pending.pop((normalized_url, "subscribe" if mode == "denied" else mode), None)
+        if requested_at is None:
+            return None
+        if mode == "denied":
+            logger.warning(f"WebSub hub denied subscription for {normalized_url}: {params.get('hub.reason', 'no reason')}")
+            self.data_manager.set_link_websub_lease(normalized_url, None)
+            return ""
+        if mode == "subscribe":
+            try:
+                lease_seconds = int(params.get("hub.lease_seconds") or self.lease_seconds)
+            except ValueError:
+                lease_seconds = self.lease_seconds
+            self.data_manager.set_link_websub_lease(normalized_url, int(time.time()) + lease_seconds)
+            logger.info(f"WebSub subscription for {normalized_url} confirmed for {lease_seconds}s.")
+        elif mode == "unsubscribe":
+            self.data_manager.set_link_websub_lease(normalized_url, None)
+        else:
+            return None
+        return params.get("hub.challenge", "")
+
+    def _make_handler(self):
+        service = self
+
+        class WebSubRequestHandler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                logger.debug(f"WebSub {self.address_string()} - {format % args}")
+
+            def _reply(self, status: int, body: bytes = b"", retry_after: Optional[int] = None):
+                self.send_response(status)
+                if retry_after is not None:
+                    self.send_header("Retry-After", str(retry_after))
+                self.send_header("Content-Type", "text/plain; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _link_url(self) -> Tuple[Optional[str], str]:
+                parsed = urlparse(self.path)
+                prefix, _, callback_id = parsed.path.rpartition("/")
+                if prefix != service.path or not callback_id:
+                    return None, parsed.query
+                return service._resolve_callback(callback_id), parsed.query
+
+            def do_GET(self):
+                normalized_url, query = self._link_url()
+                if normalized_url is None:
+                    return self._reply(404)
+                params = {key: values[0] for key, values in parse_qs(query).items()}
+                challenge = service._verify_intent(normalized_url, params)
+                if challenge is None:
+                    logger.warning(f"WebSub intent verification for {normalized_url} refused: {params.get('hub.mode')}")
+                    return self._reply(404)
+                self._reply(200, challenge.encode('utf-8'))
+
+            def do_POST(self):
+                normalized_url, _ = self._link_url()
+                if normalized_url is None:
+                    return self._reply(404)
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                except ValueError:
+                    return self._reply(400)
+                if length <= 0 or length > MAX_FEED_BYTES:
+                    return self._reply(413 if length > 0 else 400)
+                body = self.rfile.read(length)
+                # По спецификации на неверную подпись отвечаем 2xx, но содержимое игнорируем.
+                if not service.verify_signature(normalized_url, body, self.headers.get(SIGNATURE_HEADER)):
+                    logger.warning(f"WebSub content for {normalized_url} from {self.address_string()} ignored: bad signature.")
+                    return self._reply(202)
+                try:
+                    service.queue.put_nowait((normalized_url, body))
+                except queue.Full:
+                    logger.warning(f"WebSub push queue is full ({service.queue.maxsize}), asking hub to retry {normalized_url}.")
+                    return self._reply(503, retry_after=5)
+                self._reply(202)
+
+        return WebSubRequestHandler
+
+    def start(self):
+        self._refresh_callbacks()
+        self._server = ThreadingHTTPServer((self.listen, self.port), self._make_handler())
+        self._server.daemon_threads = True
+        self._threads = [
+            threading.Thread(target=self._server.serve_forever, name="WebSubServer", daemon=True),
+            threading.Thread(target=self._dispatch, name="WebSubDispatcher", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        logger.info(f"WebSub callback server listening on {self.listen}:{self.server_port}{self.path}/, public base {self.callback_base}.")
+
+    @property
+    def server_port(self) -> int:
+        return self._server.server_address[1] if self._server else self.port
+
+    def _dispatch(self):
+        while not self._stop_event.is_set():
+            # Пока доставка не успевает, новое из очереди не берём: она заполнится,
+            # и хабы получат 503 с Retry-After — перегрузка доходит до источника.
+            backpressure = self.monitoring_service.backpressure
+            if backpressure is not None and backpressure.is_engaged():
+                self._stop_event.wait(1)
+                continue
+            try:
+                normalized_url, body = self.queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            try:
+                self.monitoring_service.process_pushed_content(normalized_url, body)
+            except Exception as e:
+                logger.error(f"Error processing WebSub content for {normalized_url}: {e}", exc_info=True)
+            finally:
+                self.queue.task_done()
+
+    def stop(self, timeout: Optional[float] = None):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        self._stop_event.set()
+        for thread in self._threads:
+            thread.join(timeout)
@@ -0,0 +1,197 @@
+import argparse
+import bisect
+import hashlib
+import logging
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing.managers import BaseManager
+from typing import Callable, List, Optional, Tuple, Union
+from apscheduler.schedulers.blocking import BlockingScheduler
+from apscheduler.triggers.interval import IntervalTrigger
+
+from config import BOT_TOKEN, CHECK_INTERVAL_SECONDS, MONITOR_MANAGER_ADDRESS, MONITOR_AUTHKEY
+from logging_setup import setup_logging
+from services.fetcher_service import FetcherService
+from services.parser_service import ParserService
+from services.link_service import LinkService
+from services.monitoring_service import MonitoringService
+from services.delivery_service import Backpressure
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Методы DataManager, доступные воркерам мониторинга через менеджер.
+WORKER_STORE_METHODS = (
+    "get_active_link_urls",
+    "get_overdue_link_urls",
+    "get_link",
+    "diff_and_record",
+    "record_link_check_results",
+    "set_link_hub",
+    "get_push_covered_urls",
+    "record_check_cycle",
+    "get_active_recipients_for_link",
+    "get_outbox_backlog",
+)
+WORKER_QUEUE_METHODS = ("put", "qsize")
+
+
+class ShardRing:
+    """Консистентное хеширование нормализованных URL по шардам."""
+
+    def __init__(self, shard_count: int, replicas: int = 64):
+        self.shard_count = shard_count
+        ring = []
+        for shard_index in range(shard_count):
+            for replica in range(replicas):
+                ring.append((self._hash(f"shard-{shard_index}-{replica}"), shard_index))
+        ring.sort()
+        self._points = [point for point, _ in ring]
+        self._shards = [shard for _, shard in ring]
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode('utf-8')).digest()[:8], 'big')
+
+    def shard_for(self, normalized_url: str) -> int:
+        index = bisect.bisect(self._points, self._hash(normalized_url)) % len(self._points)
+        return self._shards[index]
+
+    def owner_filter(self, shard_index: int) -> Callable[[str], bool]:
+        return lambda normalized_url: self.shard_for(normalized_url) == shard_index
+
+
+def parse_manager_address(value: str) -> Union[Tuple[str, int], str]:
+    host, _, port = value.rpartition(":")
+    if host and port.isdigit():
+        return host, int(port)
+    return value # путь к unix-сокету
+
+def manager_authkey() -> bytes:
+    if MONITOR_AUTHKEY:
+        return MONITOR_AUTHKEY.encode('utf-8')
+    return hashlib.sha256(BOT_TOKEN.encode('utf-8')).digest()
+
+
+class StoreManager(BaseManager):
+    pass
+
+StoreManager.register("get_data_manager", exposed=WORKER_STORE_METHODS)
+StoreManager.register("get_delivery_queue", exposed=WORKER_QUEUE_METHODS)
+
+
+class WorkerService:
+    """Сторона фронтенда: отдаёт DataManager и очередь доставки воркерам и запускает их процессы."""
+
+    def __init__(self, data_manager, delivery_queue, worker_count: int, address: str = MONITOR_MANAGER_ADDRESS):
+        self.data_manager = data_manager
+        self.delivery_queue = delivery_queue
+        self.worker_count = worker_count
+        self.address = parse_manager_address(address)
+        self._server = None
+        self._processes: List[subprocess.Popen] = []
+
+    def start(self):
+        class FrontendManager(BaseManager):
+            pass
+
+        FrontendManager.register("get_data_manager", callable=lambda: self.data_manager, exposed=WORKER_STORE_METHODS)
+        FrontendManager.register("get_delivery_queue", callable=lambda: self.delivery_queue, exposed=WORKER_QUEUE_METHODS)
+        self._server = FrontendManager(address=self.address, authkey=manager_authkey()).get_server()
+        threading.Thread(target=self._server.serve_forever, name="StoreManagerServer", daemon=True).start()
+        logger.info(f"Store manager listening on {self.address}.")
+
+        for shard_index in range(self.worker_count):
+            cmd = [sys.executable, "-m", "services.worker_service",
+                   "--shard", str(shard_index), "--shards", str(self.worker_count),
+                   "--parent-pid", str(os.getpid())]
+            self._processes.append(subprocess.Popen(cmd, cwd=BASE_DIR))
+        logger.info(f"Started {self.worker_count} monitor worker process(es).")
+
+    def stop(self, timeout: float = 10):
+        for process in self._processes:
+            if process.poll() is None:
+                process.terminate()
+        for process in self._processes:
+            try:
+                process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                logger.warning(f"Monitor worker {process.pid} did not stop in time, killing it.")
+                process.kill()
+        if self._server is not None:
+            self._server.stop_event.set()
+
+
+def run_worker(shard_index: int, shard_count: int, parent_pid: Optional[int] = None,
+               parser_service: Optional[ParserService] = None):
+    manager = StoreManager(address=parse_manager_address(MONITOR_MANAGER_ADDRESS), authkey=manager_authkey())
+    for attempt in range(30):
+        try:
+            manager.connect()
+            break
+        except (ConnectionError, FileNotFoundError):
+            time.sleep(1)
+    else:
+        logger.critical(f"Worker {shard_index}: could not connect to the store manager at {MONITOR_MANAGER_ADDRESS}.")
+        sys.exit(1)
+
+    store = manager.get_data_manager()
+    ring = ShardRing(shard_count)
+    monitoring_service = MonitoringService(
+        store, FetcherService(), parser_service or ParserService(), LinkService(store), manager.get_delivery_queue(),
+        owns_link=ring.owner_filter(shard_index), cycle_label=f"shard {shard_index}/{shard_count}",
+        backpressure=Backpressure(store.get_outbox_backlog)
+    )
+
+    scheduler = BlockingScheduler(timezone="Europe/Moscow")
+    scheduler.add_job(
+        monitoring_service.check_all_active_links,
+        trigger=IntervalTrigger(seconds=CHECK_INTERVAL_SECONDS),
+        id="link_checker_job",
+        name=f"Periodic Link Checker (shard {shard_index}/{shard_count})",
+        replace_existing=True,
+        jitter=min(60, CHECK_INTERVAL_SECONDS) # разброс не длиннее самого интервала
+    )
+
+    def stop_worker():
+        # Текущая проверка дорабатывает уже взятые ссылки (пул потоков ждут при выходе
+        # интерпретатора), новые ссылки не берутся.
+        monitoring_service.stop(timeout=0)
+        scheduler.shutdown(wait=False)
+
+    def stop_if_orphaned():
+        if parent_pid and os.getppid() != parent_pid:
+            logger.warning(f"Worker {shard_index}: front-end process is gone, stopping.")
+            stop_worker()
+
+    scheduler.add_job(stop_if_orphaned, trigger=IntervalTrigger(seconds=5), id="parent_watchdog")
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_worker())
+
+    logger.info(f"Monitor worker {shard_index}/{shard_count} started.")
+    scheduler.start()
+    logger.info(f"Monitor worker {shard_index}/{shard_count} stopped.")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Monitor worker process for one shard of links.")
+    parser.add_argument("--shard", type=int, required=True)
+    parser.add_argument("--shards", type=int, required=True)
+    parser.add_argument("--parent-pid", type=int, default=None)
+    args = parser.parse_args()
+
+    parser_service = ParserService() # до setup_logging: пул разбора форкается, пока в процессе один поток
+    log_listener = setup_logging('%(asctime)s - %(name)s - %(levelname)s - %(processName)s[shard ' + str(args.shard) + '] - %(threadName)s - %(message)s')
+    logging.getLogger("apscheduler.scheduler").setLevel(logging.WARNING)
+    logging.getLogger("apscheduler.executors.default").setLevel(logging.WARNING)
+
+    try:
+        run_worker(args.shard, args.shards, args.parent_pid, parser_service)
+    finally:
+        parser_service.close()
+        if log_listener is not None:
+            log_listener.stop()
@@ -0,0 +1,164 @@
+"""Журнал DataManager: миграция старого снимка, воспроизведение после close(), сжатие с outbox и перезагрузка.
+
+Файлы данных задаются относительными путями, поэтому каждый тест работает во временном каталоге.
+Запуск из корня репозитория: python -m pytest tests (или python -m unittest discover tests).
+"""
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+os.environ.setdefault("BOT_TOKEN", "0:test")
+
+from data_manager import DataManager, JOURNAL_FILE, LINK_DATA_FILE, OUTBOX_DATA_FILE, USER_DATA_FILE
+from models import Lot
+
+FEED_URL = "https://example.com/rss?q=1"
+OTHER_FEED_URL = "https://example.com/rss?q=2"
+
+
+def make_lot(guid: str) -> Lot:
+    return Lot(guid, f"Лот {guid}", f"https://example.com/lot/{guid}", None)
+
+
+class DataManagerJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.previous_cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        self.managers = []
+
+    def tearDown(self):
+        for dm in self.managers:
+            dm.close()
+        os.chdir(self.previous_cwd)
+        self.tmp.cleanup()
+
+    def open_store(self) -> DataManager:
+        # Порог сжатия не достигается: фоновое сжатие не должно вмешиваться в проверки.
+        dm = DataManager(fsync_policy="never", compact_threshold_bytes=1 << 40)
+        self.managers.append(dm)
+        return dm
+
+    def reopen_store(self, dm: DataManager) -> DataManager:
+        dm.close()
+        self.managers.remove(dm)
+        return self.open_store()
+
+    def subscribe(self, dm: DataManager, user_id: int, url: str = FEED_URL):
+        dm.get_or_create_user(user_id, user_id * 10, f"user{user_id}", None)
+        dm.add_subscriptions_bulk(user_id, [(url, url, None)])
+
+    def test_migrates_baseline_snapshot(self):
+        # Формат исходной версии: подписки списком строк, даты в ISO, GUID списком.
+        with open(USER_DATA_FILE, "w", encoding="utf-8") as f:
+            json.dump({"42": {"chat_id": 420, "first_name": "A", "username": None, "is_active": True,
+                              "subscriptions": [FEED_URL, OTHER_FEED_URL], "joined_at": "2024-01-01T00:00:00+00:00"}}, f)
+        with open(LINK_DATA_FILE, "w", encoding="utf-8") as f:
+            json.dump({FEED_URL: {"original_url_example": FEED_URL, "last_checked": "2024-01-02T00:00:00+00:00",
+                                  "error_count": 0, "is_active": True, "known_lot_guids": ["g1", "g2"],
+                                  "added_at": "2024-01-01T00:00:00+00:00"}}, f)
+
+        dm = self.open_store()
+        user = dm.get_user(42)
+        self.assertEqual(user.chat_id, 420)
+        self.assertEqual([(s.url, s.alias) for s in user.subscriptions], [(FEED_URL, None), (OTHER_FEED_URL, None)])
+        self.assertEqual(user.joined_at, 1704067200)
+        self.assertEqual(dm.get_link(FEED_URL).last_checked, 1704153600)
+        new_lots = dm.diff_and_record(FEED_URL, [make_lot("g1"), make_lot("g3")])
+        self.assertEqual([lot.guid for lot, _ in new_lots], ["g3"])
+
+        # Снимок в новом формате читается обратно так же.
+        self.assertTrue(dm.compact())
+        dm = self.reopen_store(dm)
+        self.assertEqual([s.url for s in dm.get_user(42).subscriptions], [FEED_URL, OTHER_FEED_URL])
+        self.assertEqual(list(dm.get_link(FEED_URL).known_lot_guids), ["g1", "g2", "g3"])
+        self.assertEqual(dm.get_user(42).joined_at, 1704067200)
+
+    def test_replays_journal_after_close(self):
+        dm = self.open_store()
+        self.subscribe(dm, 1)
+        self.subscribe(dm, 2)
+        dm.set_subscription_alias(1, FEED_URL, "дом")
+        dm.diff_and_record(FEED_URL, [make_lot("g1")], notify=False)
+        (_, outbox_id), = dm.diff_and_record(FEED_URL, [make_lot("g1"), make_lot("g2")])
+        dm.ack_outbox(outbox_id, [1])
+        dm.set_user_active_status(2, False)
+
+        dm = self.reopen_store(dm)
+        self.assertFalse(os.path.exists(USER_DATA_FILE), "state must come from the journal alone")
+        self.assertEqual(dm.get_subscription_alias(1, FEED_URL), "дом")
+        self.assertFalse(dm.get_user(2).is_active)
+        self.assertEqual(list(dm.get_link(FEED_URL).known_lot_guids), ["g1", "g2"])
+        entry = dm.get_outbox_entry(outbox_id)
+        self.assertEqual(entry.lot.guid, "g2")
+        self.assertEqual(list(entry.recipients), [2])
+        self.assertEqual(dm.get_outbox_backlog(), 1)
+
+    def test_compaction_keeps_outbox_and_later_changes(self):
+        dm = self.open_store()
+        self.subscribe(dm, 1)
+        self.subscribe(dm, 2)
+        dm.diff_and_record(FEED_URL, [make_lot("g0")], notify=False)
+        recorded = dm.diff_and_record(FEED_URL, [make_lot("g1"), make_lot("g2")])
+        (first_id, second_id) = [outbox_id for _, outbox_id in recorded]
+        dm.ack_outbox(first_id, [1])
+
+        self.assertTrue(dm.compact())
+        self.assertEqual(os.path.getsize(JOURNAL_FILE), 0)
+        with open(OUTBOX_DATA_FILE, encoding="utf-8") as f:
+            self.assertEqual(set(json.load(f)), {first_id, second_id})
+
+        # Изменения после сжатия ложатся в новый журнал поверх снимка.
+        dm.ack_outbox(first_id, [2])
+        dm.ack_outbox(second_id, [1])
+        dm = self.reopen_store(dm)
+        self.assertIsNone(dm.get_outbox_entry(first_id))
+        self.assertEqual(list(dm.get_outbox_entry(second_id).recipients), [2])
+        self.assertEqual(dm.get_pending_outbox_ids(), [second_id])
+        self.assertEqual(dm.get_outbox_backlog(), 1)
+
+    def test_changes_after_torn_record_survive_next_restart(self):
+        dm = self.open_store()
+        self.subscribe(dm, 1)
+        dm.close()
+        self.managers.remove(dm)
+        # Процесс упал посреди записи: последняя строка журнала оборвана и без перевода строки.
+        with open(JOURNAL_FILE, "a", encoding="utf-8") as f:
+            f.write('{"ts":1,"ops":[{"c":"users","op":"se')
+
+        dm = self.open_store()
+        self.assertEqual([s.url for s in dm.get_user(1).subscriptions], [FEED_URL])
+        self.subscribe(dm, 1, OTHER_FEED_URL)
+        self.subscribe(dm, 2)
+
+        dm = self.reopen_store(dm)
+        self.assertEqual([s.url for s in dm.get_user(1).subscriptions], [FEED_URL, OTHER_FEED_URL])
+        self.assertEqual([s.url for s in dm.get_user(2).subscriptions], [FEED_URL])
+
+    def test_reload_after_interrupted_compaction(self):
+        dm = self.open_store()
+        self.subscribe(dm, 1)
+        dm.diff_and_record(FEED_URL, [make_lot("g1")], notify=False)
+        # Сжатие прервано после ротации журнала, до записи снимков.
+        dm.journal.rotate()
+        self.subscribe(dm, 1, OTHER_FEED_URL)
+        dm.close()
+        self.managers.remove(dm)
+        self.assertTrue(os.path.exists(dm.journal.rotated_filename))
+
+        dm = self.open_store()
+        self.assertEqual([s.url for s in dm.get_user(1).subscriptions], [FEED_URL, OTHER_FEED_URL])
+        self.assertEqual(list(dm.get_link(FEED_URL).known_lot_guids), ["g1"])
+        # Загрузка доделывает сжатие в фоновом потоке.
+        for thread in threading.enumerate():
+            if thread.name == "JournalCompaction":
+                thread.join(10)
+        self.assertFalse(os.path.exists(dm.journal.rotated_filename))
+        dm = self.reopen_store(dm)
+        self.assertEqual([s.url for s in dm.get_user(1).subscriptions], [FEED_URL, OTHER_FEED_URL])
+
+
+if __name__ == "__main__":
+    unittest.main()
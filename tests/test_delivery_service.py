@@ -0,0 +1,177 @@
+"""Доставка уведомлений: DeliveryService и RecentDeliveries.
+
+Подтверждения отправок пишутся в журнал пачкой по лоту; RecentDeliveries проверяется
+на поддельных часах — окно дедупликации и вытеснение сверх max_entries.
+"""
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+os.environ.setdefault("BOT_TOKEN", "0:test")
+
+from data_manager import DataManager, JOURNAL_FILE
+from models import Lot
+from services import delivery_service
+from services.delivery_service import ACK_BATCH_SIZE, JOB_NEW_LOT, DeliveryService, RecentDeliveries
+from services.notification_service import SEND_FAILED_PERMANENTLY, SEND_FAILED_TRANSIENTLY, SEND_OK
+
+FEED_URL = "https://example.com/rss?q=1"
+
+
+class FakeClock:
+    """Подменяет модуль time в delivery_service: время идёт только по advance()."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def time(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+class ScriptedNotifications:
+    """Вместо NotificationService: итог отправки каждому получателю задан заранее, по умолчанию SEND_OK."""
+
+    def __init__(self, outcomes=None):
+        self.outcomes = outcomes or {}
+        self.sent_to = []
+
+    def send_new_lot_notifications(self, bot_instance, recipients, lot_data, source_url_normalized, on_recipient_done=None):
+        for chat_id, user_id in recipients:
+            self.sent_to.append(user_id)
+            if on_recipient_done is not None and not on_recipient_done(user_id, self.outcomes.get(user_id, SEND_OK)):
+                break
+
+
+class DeliveryAckBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.previous_cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        self.dm = DataManager(fsync_policy="never", compact_threshold_bytes=1 << 40)
+
+    def tearDown(self):
+        self.dm.close()
+        os.chdir(self.previous_cwd)
+        self.tmp.cleanup()
+
+    def queue_lot(self, subscribers: int) -> str:
+        for user_id in range(1, subscribers + 1):
+            self.dm.get_or_create_user(user_id, user_id * 10, f"user{user_id}", None)
+            self.dm.add_subscriptions_bulk(user_id, [(FEED_URL, FEED_URL, None)])
+        self.dm.diff_and_record(FEED_URL, [Lot("old", "Старый", "https://example.com/lot/old", None)], notify=False)
+        (_, outbox_id), = self.dm.diff_and_record(FEED_URL, [Lot("new", "Новый", "https://example.com/lot/new", None)])
+        return outbox_id
+
+    def journal_acks(self) -> list:
+        with open(JOURNAL_FILE, encoding="utf-8") as f:
+            return [op["v"] for line in f for op in json.loads(line)["ops"] if op["op"] == "ack"]
+
+    def deliver(self, outbox_id: str, notifications: ScriptedNotifications) -> DeliveryService:
+        service = DeliveryService(None, notifications, self.dm)
+        service._deliver((JOB_NEW_LOT, outbox_id))
+        return service
+
+    def test_one_journal_record_per_lot(self):
+        outbox_id = self.queue_lot(3)
+        service = self.deliver(outbox_id, ScriptedNotifications({2: SEND_FAILED_PERMANENTLY, 3: SEND_FAILED_TRANSIENTLY}))
+
+        self.assertEqual(self.journal_acks(), [[1, 2]])
+        self.assertEqual(list(self.dm.get_outbox_entry(outbox_id).recipients), [3])
+        self.assertEqual(self.dm.get_outbox_backlog(), 1)
+        self.assertEqual(list(service._retry_ids), [outbox_id])
+
+    def test_recipients_skipped_as_duplicates_share_the_record(self):
+        outbox_id = self.queue_lot(3)
+        notifications = ScriptedNotifications()
+        service = DeliveryService(None, notifications, self.dm)
+        service.recent_deliveries.add(1, "new") # уже получил этот лот из другой ленты
+        service._deliver((JOB_NEW_LOT, outbox_id))
+
+        self.assertEqual(notifications.sent_to, [2, 3])
+        self.assertEqual(self.journal_acks(), [[1, 2, 3]])
+        self.assertIsNone(self.dm.get_outbox_entry(outbox_id))
+
+    def test_large_fanout_is_acked_every_batch_size_sends(self):
+        subscribers = 2 * ACK_BATCH_SIZE + 10
+        outbox_id = self.queue_lot(subscribers)
+        self.deliver(outbox_id, ScriptedNotifications())
+
+        self.assertEqual([len(user_ids) for user_ids in self.journal_acks()], [ACK_BATCH_SIZE, ACK_BATCH_SIZE, 10])
+        self.assertIsNone(self.dm.get_outbox_entry(outbox_id))
+        self.assertEqual(self.dm.get_outbox_backlog(), 0)
+
+    def test_sends_acked_before_abort_are_written(self):
+        outbox_id = self.queue_lot(3)
+        notifications = ScriptedNotifications()
+        service = DeliveryService(None, notifications, self.dm)
+        service._abort_event.set() # остановка бота: рассылка прерывается после первой отправки
+        service._deliver((JOB_NEW_LOT, outbox_id))
+
+        self.assertEqual(notifications.sent_to, [1])
+        self.assertEqual(self.journal_acks(), [[1]])
+        self.assertEqual(list(self.dm.get_outbox_entry(outbox_id).recipients), [2, 3])
+
+
+class RecentDeliveriesTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(delivery_service, "time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_dedup_within_window_only(self):
+        recent = RecentDeliveries(window_seconds=60, max_entries=100)
+        self.assertFalse(recent.was_delivered(1, "lot-a"))
+        recent.add(1, "lot-a")
+        self.assertTrue(recent.was_delivered(1, "lot-a"))
+        self.assertFalse(recent.was_delivered(2, "lot-a"))
+        self.assertFalse(recent.was_delivered(1, "lot-b"))
+
+        self.clock.advance(59)
+        self.assertTrue(recent.was_delivered(1, "lot-a"))
+        self.clock.advance(1)
+        self.assertFalse(recent.was_delivered(1, "lot-a"))
+        self.assertEqual(recent.stats(), {"entries": 1, "lookups": 6, "hits": 2, "hit_rate": 0.333})
+
+    def test_repeated_add_restarts_the_window(self):
+        recent = RecentDeliveries(window_seconds=60, max_entries=100)
+        recent.add(1, "lot-a")
+        self.clock.advance(50)
+        recent.add(1, "lot-a")
+        self.clock.advance(50)
+        self.assertTrue(recent.was_delivered(1, "lot-a"))
+
+    def test_expired_entries_are_evicted_on_add(self):
+        recent = RecentDeliveries(window_seconds=60, max_entries=100)
+        for user_id in range(10):
+            recent.add(user_id, "lot-a")
+        self.clock.advance(30)
+        recent.add(100, "lot-b")
+        self.clock.advance(30)
+        recent.add(101, "lot-b")
+        self.assertEqual(recent.stats()["entries"], 2)
+
+    def test_oldest_entries_are_evicted_over_max_entries(self):
+        recent = RecentDeliveries(window_seconds=3600, max_entries=3)
+        for user_id in range(5):
+            recent.add(user_id, "lot-a")
+            self.clock.advance(1)
+        self.assertEqual(recent.stats()["entries"], 3)
+        self.assertEqual([recent.was_delivered(user_id, "lot-a") for user_id in range(5)], [False, False, True, True, True])
+
+        # Повторная доставка переносит запись в хвост: вытесняется следующая по возрасту.
+        recent.add(2, "lot-a")
+        recent.add(5, "lot-a")
+        self.assertEqual([recent.was_delivered(user_id, "lot-a") for user_id in range(6)], [False, False, True, False, True, True])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+"""HostController на поддельных часах: AIMD-лимит, предохранитель (открыт, полуоткрыт, закрыт) и Retry-After."""
+import os
+import threading
+import unittest
+from unittest import mock
+
+os.environ.setdefault("BOT_TOKEN", "0:test")
+
+from services import fetcher_service
+from services.fetcher_service import CircuitOpenError, HostController, MAX_RETRY_AFTER_SECONDS, parse_retry_after
+
+HOST = "torgi.gov.ru"
+
+
+class FakeClock:
+    """Подменяет модуль time в fetcher_service: время идёт только по advance()."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+class HostControllerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(fetcher_service, "time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.controller = HostController(max_concurrency=4, min_interval=0, latency_target=5.0,
+                                         failure_threshold=3, cooldown=300)
+
+    def request(self, latency: float = 0.1, ok=True, retry_after=None):
+        self.controller.acquire(HOST)
+        self.clock.advance(latency)
+        self.controller.release(HOST, latency, ok, retry_after)
+
+    def limit(self) -> float:
+        return self.controller._hosts[HOST].limit
+
+    def circuit(self) -> str:
+        return self.controller.get_stats()[HOST]["circuit"]
+
+    def test_limit_grows_additively_up_to_max_concurrency(self):
+        self.request()
+        self.assertEqual(self.limit(), 2.0)
+        self.request()
+        self.assertEqual(self.limit(), 2.5)
+        for _ in range(20):
+            self.request()
+        self.assertEqual(self.limit(), 4.0)
+        self.assertEqual(self.controller.get_stats()[HOST]["limit"], 4)
+
+    def test_slow_responses_and_failures_halve_the_limit(self):
+        for _ in range(20):
+            self.request()
+        self.request(latency=6.0)
+        self.assertEqual(self.limit(), 2.0)
+        self.request(ok=False)
+        self.assertEqual(self.limit(), 1.0)
+        self.request(ok=False)
+        self.assertEqual(self.limit(), 1.0) # не ниже одного запроса
+
+    def test_host_independent_failure_changes_nothing(self):
+        self.request()
+        self.request(latency=30.0, ok=None) # лента больше лимита: хост ни при чём
+        self.assertEqual(self.limit(), 2.0)
+        self.assertEqual(self.controller.get_stats()[HOST]["error_rate"], 0.0)
+
+    def test_circuit_opens_after_consecutive_failures_and_probes_once_when_half_open(self):
+        self.request(ok=False)
+        self.request(ok=False)
+        self.request()
+        self.request(ok=False)
+        self.request(ok=False)
+        self.assertEqual(self.circuit(), "closed") # успех посередине обнуляет серию
+        self.request(ok=False)
+        self.assertEqual(self.circuit(), "open")
+        with self.assertRaises(CircuitOpenError) as raised:
+            self.controller.acquire(HOST)
+        self.assertAlmostEqual(raised.exception.retry_in, 300) # отсчёт от итога последнего запроса
+        self.assertEqual(self.controller.get_stats()[HOST]["skipped"], 1)
+
+        # По истечении паузы — полуоткрыт: проходит один пробный запрос, остальные ждут его итога.
+        self.clock.advance(300)
+        self.assertEqual(self.circuit(), "half-open")
+        self.controller.acquire(HOST)
+        waiting = threading.Thread(target=self.controller.acquire, args=(HOST,), daemon=True)
+        waiting.start()
+        waiting.join(0.3)
+        self.assertTrue(waiting.is_alive())
+
+        self.controller.release(HOST, 0.1, True)
+        waiting.join(5)
+        self.assertFalse(waiting.is_alive())
+        self.assertEqual(self.circuit(), "closed")
+        self.controller.release(HOST, 0.1, True)
+
+    def test_failed_probe_reopens_the_circuit(self):
+        for _ in range(3):
+            self.request(ok=False)
+        self.clock.advance(300)
+        self.request(ok=False)
+        self.assertEqual(self.circuit(), "open")
+        self.assertRaises(CircuitOpenError, self.controller.acquire, HOST)
+        self.clock.advance(299)
+        self.assertRaises(CircuitOpenError, self.controller.acquire, HOST)
+        self.clock.advance(1)
+        self.assertEqual(self.circuit(), "half-open")
+
+    def test_retry_after_pauses_host_even_below_failure_threshold(self):
+        self.request(ok=False, retry_after=120)
+        self.assertEqual(self.circuit(), "open")
+        with self.assertRaises(CircuitOpenError) as raised:
+            self.controller.acquire(HOST)
+        self.assertAlmostEqual(raised.exception.retry_in, 120)
+        self.clock.advance(120)
+        self.request()
+        self.assertEqual(self.circuit(), "closed")
+
+    def test_retry_after_never_shortens_an_open_circuit(self):
+        self.request(ok=False)
+        self.request(ok=False)
+        self.request(ok=False, retry_after=10) # третья ошибка открывает предохранитель на 300 с
+        with self.assertRaises(CircuitOpenError) as raised:
+            self.controller.acquire(HOST)
+        self.assertAlmostEqual(raised.exception.retry_in, 300)
+
+
+class ParseRetryAfterTest(unittest.TestCase):
+    def test_seconds_date_and_bounds(self):
+        self.assertEqual(parse_retry_after("120"), 120.0)
+        self.assertEqual(parse_retry_after(str(10 * MAX_RETRY_AFTER_SECONDS)), MAX_RETRY_AFTER_SECONDS)
+        self.assertEqual(parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT"), 0.0) # дата в прошлом
+        self.assertIsNone(parse_retry_after("скоро"))
+        self.assertIsNone(parse_retry_after(None))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,147 @@
+"""LotHistory: добавление и поиск, часовые секции, обратный индекс, перечитывание с диска и удаление старых секций."""
+import os
+import tempfile
+import time
+import unittest
+
+os.environ.setdefault("BOT_TOKEN", "0:test")
+
+from lot_history import LotHistory, PARTITION_SECONDS
+from models import Lot
+
+SOURCE = "https://example.com/rss?q=1"
+OTHER_SOURCE = "https://example.com/rss?q=2"
+CADASTRAL_NUMBER = "50:21:0120114:1234"
+
+
+def make_lot(guid: str, title: str, cadastral_number: str = None) -> Lot:
+    return Lot(guid, title, f"https://example.com/lot/{guid}", cadastral_number)
+
+
+def titles(results) -> list:
+    return [title for _, _, title, _, _ in results]
+
+
+class LotHistoryTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self.tmp.name, "lot_history")
+        self.histories = []
+        now = int(time.time())
+        self.hour = now - now % PARTITION_SECONDS # начало текущего часа
+
+    def tearDown(self):
+        for history in self.histories:
+            history.close()
+        self.tmp.cleanup()
+
+    def open_history(self, load: bool = True, **kwargs) -> LotHistory:
+        kwargs.setdefault("retention_days", 14)
+        kwargs.setdefault("max_lots", 1000)
+        history = LotHistory(self.directory, **kwargs)
+        self.histories.append(history)
+        if load:
+            history.load()
+        return history
+
+    def test_search_matches_all_words_in_user_sources_newest_first(self):
+        history = self.open_history()
+        history.add(SOURCE, [make_lot("1", "Земельный участок, Подмосковье"), make_lot("2", "Квартира в Москве")], self.hour - 2 * PARTITION_SECONDS)
+        history.add(SOURCE, [make_lot("3", "Участок под ИЖС, Подмосковье")], self.hour - PARTITION_SECONDS)
+        history.add(OTHER_SOURCE, [make_lot("4", "Участок в Подмосковье")], self.hour)
+        history.add(SOURCE, [make_lot("5", "Участок у озера", CADASTRAL_NUMBER)], self.hour)
+
+        self.assertEqual(titles(history.search([SOURCE], "участок подмосковье", 10)),
+                         ["Участок под ИЖС, Подмосковье", "Земельный участок, Подмосковье"])
+        self.assertEqual(titles(history.search([SOURCE, OTHER_SOURCE], "УЧАСТОК", 2)),
+                         ["Участок у озера", "Участок в Подмосковье"])
+        self.assertEqual(titles(history.search([SOURCE], CADASTRAL_NUMBER, 10)), ["Участок у озера"])
+        self.assertEqual(history.search([SOURCE], "участок дача", 10), [])
+        self.assertEqual(history.search([OTHER_SOURCE], "квартира", 10), [])
+        self.assertEqual(history.search(["https://example.com/unknown"], "участок", 10), [])
+        self.assertEqual(history.search([SOURCE], "!", 10), [])
+
+        source_url, seen_at, _, url, cadastral_number = history.search([SOURCE], "озера", 1)[0]
+        self.assertEqual((source_url, seen_at, url, cadastral_number), (SOURCE, self.hour, "https://example.com/lot/5", CADASTRAL_NUMBER))
+
+    def test_search_normalizes_yo(self):
+        history = self.open_history()
+        history.add(SOURCE, [make_lot("1", "Нежилое помещение, Орёл")], self.hour)
+        self.assertEqual(titles(history.search([SOURCE], "орел", 10)), ["Нежилое помещение, Орёл"])
+
+    def test_lots_are_partitioned_by_hour_with_one_file_each(self):
+        history = self.open_history()
+        history.add(SOURCE, [make_lot("1", "Первый")], self.hour - PARTITION_SECONDS + 5)
+        history.add(SOURCE, [make_lot("2", "Второй")], self.hour - 1)
+        history.add(SOURCE, [make_lot("3", "Третий")], self.hour + 1)
+
+        self.assertEqual(list(history._partitions), [self.hour - PARTITION_SECONDS, self.hour])
+        self.assertEqual(sorted(os.listdir(self.directory)), sorted([f"{self.hour - PARTITION_SECONDS}.jsonl", f"{self.hour}.jsonl"]))
+        self.assertEqual(len(history._partitions[self.hour - PARTITION_SECONDS].lots), 2)
+
+    def test_inverted_index_postings_and_both_scan_orders(self):
+        history = self.open_history()
+        # В одном источнике много лотов со словом «участок», в другом — единственный.
+        history.add(SOURCE, [make_lot(str(i), f"Участок номер {i}") for i in range(50)], self.hour)
+        history.add(OTHER_SOURCE, [make_lot("x", "Участок у реки")], self.hour)
+        partition = history._partitions[self.hour]
+        source_id, other_source_id = history._source_ids[SOURCE], history._source_ids[OTHER_SOURCE]
+
+        self.assertEqual(list(partition.tokens["участок"]), list(range(51)))
+        self.assertEqual(list(partition.tokens["реки"]), [50])
+        self.assertEqual(list(partition.sources[other_source_id]), [50])
+        self.assertNotIn("у", partition.tokens) # короче MIN_TOKEN_LENGTH
+
+        # Перебор лотов источника (их меньше) и перебор редкого токена дают то же, что и полный перебор.
+        self.assertEqual(partition.search(["участок"], {other_source_id}), [50])
+        self.assertEqual(partition.search(["12", "участок"], {source_id, other_source_id}), [12])
+        self.assertEqual(partition.search(["реки", "участок"], {source_id}), [])
+        self.assertEqual(partition.search(["нет"], {source_id}), [])
+
+    def test_load_reads_partitions_back_without_duplicates(self):
+        history = self.open_history()
+        history.add(SOURCE, [make_lot("1", "Участок старый")], self.hour - PARTITION_SECONDS)
+        history.add(SOURCE, [make_lot("2", "Участок новый")], self.hour)
+        history.close()
+        # Сбой посреди записи оставляет недописанную строку.
+        with open(os.path.join(self.directory, f"{self.hour}.jsonl"), "a", encoding="utf-8") as f:
+            f.write('["https://example.com/rss?q=1", 1')
+
+        reloaded = self.open_history(load=False)
+        # Лоты, пришедшие до окончания load(), попадают в память только из файла — один раз.
+        reloaded.add(SOURCE, [make_lot("3", "Участок во время загрузки")], self.hour)
+        self.assertEqual(reloaded.search([SOURCE], "участок", 10), [])
+        reloaded.load()
+        self.assertEqual(titles(reloaded.search([SOURCE], "участок", 10)),
+                         ["Участок во время загрузки", "Участок новый", "Участок старый"])
+        self.assertEqual(reloaded._size, 3)
+
+    def test_expired_partitions_are_dropped_with_their_files(self):
+        history = self.open_history(load=False, retention_days=1)
+        expired = self.hour - 25 * PARTITION_SECONDS
+        history.add(SOURCE, [make_lot("1", "Участок давний")], expired)
+        history.add(SOURCE, [make_lot("2", "Участок вчерашний")], self.hour - 23 * PARTITION_SECONDS)
+        history.add(SOURCE, [make_lot("3", "Участок свежий")], self.hour)
+        history.load()
+
+        self.assertEqual(titles(history.search([SOURCE], "участок", 10)), ["Участок свежий", "Участок вчерашний"])
+        self.assertNotIn(expired, history._partitions)
+        self.assertFalse(os.path.exists(os.path.join(self.directory, f"{expired}.jsonl")))
+
+    def test_max_lots_evicts_oldest_partitions_whole(self):
+        history = self.open_history(max_lots=4)
+        for age, count in ((3, 2), (2, 2), (1, 1)):
+            start = self.hour - age * PARTITION_SECONDS
+            history.add(SOURCE, [make_lot(f"{age}-{i}", f"Участок {age}") for i in range(count)], start)
+        self.assertEqual(history._size, 5 - 2)
+        self.assertEqual(list(history._partitions), [self.hour - 2 * PARTITION_SECONDS, self.hour - PARTITION_SECONDS])
+        self.assertFalse(os.path.exists(os.path.join(self.directory, f"{self.hour - 3 * PARTITION_SECONDS}.jsonl")))
+
+        # Текущая секция остаётся, даже если одна превышает лимит.
+        history.add(SOURCE, [make_lot(f"now-{i}", "Участок сейчас") for i in range(6)], self.hour)
+        self.assertEqual(list(history._partitions), [self.hour])
+        self.assertEqual(history._size, 6)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+"""ParserService с пулом процессов: зависший разбор убивается, и его место занимает запасной пул."""
+import os
+import time
+import unittest
+
+os.environ.setdefault("BOT_TOKEN", "0:test")
+
+from services.parser_service import ParserService
+
+FEED = ('<?xml version="1.0" encoding="utf-8"?><rss version="2.0"><channel><title>Лоты</title>'
+        '<item><title>Лот</title><link>https://example.com/lot/1</link><guid>1</guid></item>'
+        '</channel></rss>').encode()
+
+
+def parser_pid(feed_content: bytes) -> int:
+    return os.getpid()
+
+
+def hang(feed_content: bytes):
+    time.sleep(60)
+
+
+class ParserPoolTimeoutTest(unittest.TestCase):
+    def setUp(self):
+        self.service = ParserService(processes=1, timeout=0.5, spare_pools=1)
+
+    def tearDown(self):
+        self.service.close()
+
+    def test_timed_out_worker_is_killed_and_replaced_by_spare(self):
+        stuck_pid = self.service._run(parser_pid, FEED)
+        stuck_workers = list(self.service._workers)
+
+        started = time.monotonic()
+        self.assertRaises(TimeoutError, self.service._run, hang, FEED)
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertFalse(any(process.is_alive() for process in stuck_workers))
+
+        # Следующие ленты разбирает запасной пул, а не процесс, занятый зависшей лентой.
+        self.assertNotEqual(self.service._run(parser_pid, FEED), stuck_pid)
+        self.assertNotEqual(self.service._run(parser_pid, FEED), os.getpid())
+        lots, _ = self.service.parse_feed(FEED)
+        self.assertEqual([lot.guid for lot in lots], ["1"])
+
+    def test_parses_in_calling_thread_when_no_spare_is_left(self):
+        self.assertRaises(TimeoutError, self.service._run, hang, FEED)
+        self.assertRaises(TimeoutError, self.service._run, hang, FEED)
+        self.assertEqual(self.service._run(parser_pid, FEED), os.getpid())
+        lots, _ = self.service.parse_feed(FEED)
+        self.assertEqual([lot.guid for lot in lots], ["1"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+"""TokenBuckets и RateLimitService на поддельных часах: пополнение ведра, одно предупреждение и удаление простаивающих вёдер."""
+import os
+import unittest
+from unittest import mock
+
+os.environ.setdefault("BOT_TOKEN", "0:test")
+
+from services import rate_limit_service
+from services.rate_limit_service import COST_CHEAP, COST_EXPENSIVE, RateLimitService, TokenBuckets
+
+
+class FakeClock:
+    """Подменяет модуль time в rate_limit_service: время идёт только по advance()."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+class FakeClockTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(rate_limit_service, "time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class TokenBucketsTest(FakeClockTestCase):
+    def test_burst_then_refill_at_rate(self):
+        buckets = TokenBuckets(rate_per_minute=6, burst=3) # токен раз в 10 с
+        self.assertEqual([buckets.acquire(1)[0] for _ in range(3)], [True, True, True])
+        self.assertEqual(buckets.acquire(1), (False, 10.0, True))
+
+        self.clock.advance(4)
+        allowed, retry_after, notify = buckets.acquire(1)
+        self.assertFalse(allowed)
+        self.assertAlmostEqual(retry_after, 6.0)
+        self.assertFalse(notify) # о превышении уже сообщили
+
+        self.clock.advance(6)
+        self.assertEqual(buckets.acquire(1), (True, 0.0, False))
+        self.assertEqual(buckets.acquire(1), (False, 10.0, True)) # после разрешённой команды — снова одно предупреждение
+
+        # Долгий простой не копит токенов сверх burst.
+        self.clock.advance(3600)
+        self.assertEqual([buckets.acquire(1)[0] for _ in range(4)], [True, True, True, False])
+        self.assertEqual(buckets.stats(), {"users": 1, "allowed": 7, "throttled": 4})
+
+    def test_users_have_separate_buckets(self):
+        buckets = TokenBuckets(rate_per_minute=6, burst=1)
+        self.assertTrue(buckets.acquire(1)[0])
+        self.assertFalse(buckets.acquire(1)[0])
+        self.assertTrue(buckets.acquire(2)[0])
+
+    def test_zero_rate_disables_limit(self):
+        buckets = TokenBuckets(rate_per_minute=0, burst=1)
+        self.assertFalse(buckets.enabled)
+        self.assertEqual([buckets.acquire(1) for _ in range(3)], [(True, 0.0, False)] * 3)
+        self.assertEqual(buckets.stats()["users"], 0)
+
+    def test_idle_buckets_are_evicted_only_once_full_again(self):
+        # idle_seconds меньше времени наполнения ведра (3 токена по 10 с) поднимается до 30 с.
+        buckets = TokenBuckets(rate_per_minute=6, burst=3, idle_seconds=5, max_entries=100)
+        self.assertEqual(buckets.idle_seconds, 30)
+        for _ in range(3):
+            buckets.acquire(1)
+        self.clock.advance(29)
+        buckets.acquire(2)
+        self.assertEqual(list(buckets._buckets), [1, 2]) # ведро 1 ещё не наполнилось
+
+        self.clock.advance(1)
+        buckets.acquire(3)
+        self.assertEqual(list(buckets._buckets), [2, 3])
+        # Новое ведро вместо удалённого так же полно, как было бы старое.
+        self.assertEqual([buckets.acquire(1)[0] for _ in range(4)], [True, True, True, False])
+
+    def test_least_recently_used_buckets_are_evicted_over_max_entries(self):
+        buckets = TokenBuckets(rate_per_minute=6, burst=3, idle_seconds=600, max_entries=2)
+        buckets.acquire(1)
+        buckets.acquire(2)
+        buckets.acquire(1)
+        buckets.acquire(3)
+        self.assertEqual(list(buckets._buckets), [1, 3])
+
+
+class RateLimitServiceTest(FakeClockTestCase):
+    def test_expensive_commands_use_both_buckets(self):
+        service = RateLimitService(commands_per_minute=60, commands_burst=5, expensive_per_minute=1, expensive_burst=2)
+        self.assertTrue(service.check(1, COST_EXPENSIVE)[0])
+        self.assertTrue(service.check(1, COST_EXPENSIVE)[0])
+        allowed, retry_after, notify = service.check(1, COST_EXPENSIVE)
+        self.assertEqual((allowed, notify), (False, True))
+        self.assertAlmostEqual(retry_after, 60.0)
+        self.assertTrue(service.check(1)[0]) # дешёвые команды идут дальше
+        self.assertEqual(service.get_stats()[COST_CHEAP]["allowed"], 4)
+
+    def test_command_refused_by_cheap_bucket_keeps_expensive_token(self):
+        service = RateLimitService(commands_per_minute=60, commands_burst=1, expensive_per_minute=1, expensive_burst=1)
+        self.assertTrue(service.check(1)[0])
+        self.assertFalse(service.check(1, COST_EXPENSIVE)[0])
+        self.clock.advance(1)
+        self.assertTrue(service.check(1, COST_EXPENSIVE)[0])
+        self.assertEqual(service.get_stats()[COST_EXPENSIVE], {"users": 1, "allowed": 1, "throttled": 0})
+
+
+if __name__ == "__main__":
+    unittest.main()
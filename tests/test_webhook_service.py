@@ -0,0 +1,102 @@
+"""WebhookService: записанные обновления Telegram отправляются POST на локальный сервер.
+
+Проверяются ответ 200 и вызов обработчика, 403 при неверном секрете, 503 при заполненной
+очереди и доработка принятых обновлений при остановке.
+"""
+import copy
+import os
+import threading
+import unittest
+
+os.environ.setdefault("BOT_TOKEN", "0:test")
+
+import requests
+import telebot
+
+from services.webhook_service import SECRET_HEADER, WebhookService
+
+SECRET = "test-secret_1"
+PATH = "/telegram/webhook"
+# Обновление в том виде, в каком его присылает Telegram.
+RECORDED_UPDATE = {
+    "update_id": 812345001,
+    "message": {
+        "message_id": 1017,
+        "from": {"id": 111222333, "is_bot": False, "first_name": "Иван", "username": "ivan", "language_code": "ru"},
+        "chat": {"id": 111222333, "first_name": "Иван", "username": "ivan", "type": "private"},
+        "date": 1760800000,
+        "text": "/mylinks",
+        "entities": [{"offset": 0, "length": 8, "type": "bot_command"}],
+    },
+}
+
+
+def recorded_update(update_id: int, text: str) -> dict:
+    update = copy.deepcopy(RECORDED_UPDATE)
+    update["update_id"] = update_id
+    update["message"]["text"] = text
+    return update
+
+
+class WebhookServiceTest(unittest.TestCase):
+    def setUp(self):
+        self.handled = []
+        self.handler_started = threading.Event()
+        self.release_handler = threading.Event()
+        self.release_handler.set()
+        bot = telebot.TeleBot("0:test", threaded=False)
+
+        @bot.message_handler(func=lambda message: True)
+        def record(message):
+            self.handler_started.set()
+            self.release_handler.wait(10)
+            self.handled.append(message.text)
+
+        self.service = WebhookService(bot, listen="127.0.0.1", port=0, path=PATH, secret=SECRET, queue_size=1, workers=1)
+        self.service.start()
+        self.url = f"http://127.0.0.1:{self.service.server_port}{PATH}"
+
+    def tearDown(self):
+        self.release_handler.set()
+        self.service.stop(timeout=5)
+
+    def post(self, update: dict, secret: str = SECRET) -> requests.Response:
+        return requests.post(self.url, json=update, headers={SECRET_HEADER: secret}, timeout=5)
+
+    def test_accepts_update_and_runs_handler(self):
+        self.assertEqual(self.post(RECORDED_UPDATE).status_code, 200)
+        self.service.queue.join()
+        self.assertEqual(self.handled, ["/mylinks"])
+
+    def test_rejects_bad_secret_token(self):
+        self.assertEqual(self.post(RECORDED_UPDATE, secret="wrong").status_code, 403)
+        self.service.queue.join()
+        self.assertEqual(self.handled, [])
+
+    def test_full_queue_answers_503_while_handlers_are_busy(self):
+        self.release_handler.clear()
+        self.assertEqual(self.post(recorded_update(1, "first")).status_code, 200)
+        self.assertTrue(self.handler_started.wait(5))
+        # Единственный обработчик занят, второе обновление занимает единственное место в очереди.
+        self.assertEqual(self.post(recorded_update(2, "second")).status_code, 200)
+        response = self.post(recorded_update(3, "third"))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers.get("Retry-After"), "1")
+
+        self.release_handler.set()
+        self.service.queue.join()
+        self.assertEqual(self.handled, ["first", "second"])
+
+    def test_stop_processes_accepted_updates(self):
+        self.release_handler.clear()
+        self.assertEqual(self.post(recorded_update(1, "first")).status_code, 200)
+        self.assertTrue(self.handler_started.wait(5))
+        self.assertEqual(self.post(recorded_update(2, "second")).status_code, 200)
+
+        threading.Timer(0.2, self.release_handler.set).start()
+        self.service.stop(timeout=5)
+        self.assertEqual(self.handled, ["first", "second"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,185 @@
+"""WebSubService против локальной замены хаба.
+
+Хаб принимает запрос подписки и проверяет намерение GET-запросом на колбэк, как настоящий.
+Проверяются подтверждение подписки по _pending, отказ при чужой проверке, игнорирование
+содержимого с неверной X-Hub-Signature, запись подписанного содержимого через
+diff_and_record и пауза диспетчера, пока включён backpressure доставки.
+"""
+import hashlib
+import hmac
+import http.server
+import os
+import queue
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from urllib.parse import parse_qs
+
+os.environ.setdefault("BOT_TOKEN", "0:test")
+
+import requests
+
+from data_manager import DataManager
+from models import Lot
+from services.delivery_service import JOB_NEW_LOT, Backpressure
+from services.fetcher_service import FetcherService
+from services.link_service import LinkService
+from services.monitoring_service import MonitoringService
+from services.parser_service import ParserService
+from services.websub_service import SIGNATURE_HEADER, WebSubService
+
+FEED_URL = "https://example.com/rss?q=1"
+FEED = ('<?xml version="1.0" encoding="utf-8"?><rss version="2.0"><channel><title>Лоты</title>'
+        '<item><title>Старый</title><link>https://example.com/lot/old</link><guid>old</guid></item>'
+        '<item><title>Новый</title><link>https://example.com/lot/new</link><guid>new</guid></item>'
+        '</channel></rss>').encode()
+
+
+class HubHandler(http.server.BaseHTTPRequestHandler):
+    """Хаб: отвечает 202 на запрос подписки и затем проверяет намерение на колбэке."""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        params = {key: values[0] for key, values in parse_qs(self.rfile.read(length).decode()).items()}
+        self.server.requests.append(params)
+        self.send_response(202)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+        threading.Thread(target=self.server.verify_intent, args=(params,), daemon=True).start()
+
+
+class HubStandIn(http.server.ThreadingHTTPServer):
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), HubHandler)
+        self.requests = []
+        self.verifications = queue.Queue()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/hub"
+
+    def verify_intent(self, params: dict):
+        challenge = f"challenge-{len(self.requests)}"
+        response = requests.get(params["hub.callback"], timeout=5, params={
+            "hub.mode": params["hub.mode"], "hub.topic": params["hub.topic"],
+            "hub.challenge": challenge, "hub.lease_seconds": "3600"})
+        self.verifications.put((challenge, response.status_code, response.text))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class WebSubServiceTest(unittest.TestCase):
+    def setUp(self):
+        self.previous_cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+
+        self.hub = HubStandIn()
+        threading.Thread(target=self.hub.serve_forever, daemon=True).start()
+
+        self.dm = DataManager(fsync_policy="never", compact_threshold_bytes=1 << 40)
+        self.dm.get_or_create_user(1, 10, "user1", None)
+        self.dm.add_subscriptions_bulk(1, [(FEED_URL, FEED_URL, None)])
+        self.dm.diff_and_record(FEED_URL, [Lot("old", "Старый", "https://example.com/lot/old", None)], notify=False)
+        self.dm.set_link_hub(FEED_URL, self.hub.url, FEED_URL)
+
+        self.backlog = 0
+        self.backpressure = Backpressure(lambda: self.backlog, high_watermark=10, low_watermark=5, poll_interval=0)
+        self.delivery_queue = queue.Queue()
+        monitoring_service = MonitoringService(self.dm, FetcherService(), ParserService(), LinkService(self.dm),
+                                               self.delivery_queue, backpressure=self.backpressure)
+        port = free_port()
+        self.service = WebSubService(self.dm, monitoring_service, callback_base=f"http://127.0.0.1:{port}",
+                                     listen="127.0.0.1", port=port, path="/websub", queue_size=1)
+        self.callback_url = self.service._callback_url(FEED_URL)
+
+    def tearDown(self):
+        self.service.stop(timeout=5)
+        self.hub.shutdown()
+        self.hub.server_close()
+        self.dm.close()
+        os.chdir(self.previous_cwd)
+        self.tmp.cleanup()
+
+    def subscribe(self) -> dict:
+        self.assertTrue(self.service.request_subscription(FEED_URL, self.hub.url, FEED_URL))
+        challenge, status, body = self.hub.verifications.get(timeout=5)
+        self.assertEqual((status, body), (200, challenge))
+        return self.hub.requests[-1]
+
+    def push(self, body: bytes, secret: str) -> requests.Response:
+        signature = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+        return requests.post(self.callback_url, data=body, timeout=5,
+                             headers={SIGNATURE_HEADER: f"sha256={signature}", "Content-Type": "application/rss+xml"})
+
+    def wait_for_job(self) -> tuple:
+        return self.delivery_queue.get(timeout=5)
+
+    def test_subscribe_handshake_confirms_lease_once(self):
+        self.service.start()
+        request = self.subscribe()
+        self.assertEqual((request["hub.mode"], request["hub.topic"], request["hub.callback"]),
+                         ("subscribe", FEED_URL, self.callback_url))
+        self.assertEqual(self.service._pending, {})
+        lease_until = self.dm.get_link(FEED_URL).websub_lease_until
+        self.assertAlmostEqual(lease_until, time.time() + 3600, delta=60)
+
+        # Повтор проверки намерения без нашего запроса отвергается и аренду не трогает.
+        self.hub.verify_intent({"hub.mode": "unsubscribe", "hub.topic": FEED_URL, "hub.callback": self.callback_url})
+        _, status, _ = self.hub.verifications.get(timeout=5)
+        self.assertEqual(status, 404)
+        self.assertEqual(self.dm.get_link(FEED_URL).websub_lease_until, lease_until)
+
+    def test_content_with_bad_signature_is_ignored(self):
+        self.service.start()
+        self.subscribe()
+        response = self.push(FEED, "not-the-subscription-secret")
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.service.queue.qsize(), 0)
+        self.assertRaises(queue.Empty, self.delivery_queue.get, timeout=1.5)
+        self.assertEqual(list(self.dm.get_link(FEED_URL).known_lot_guids), ["old"])
+
+    def test_signed_content_is_recorded_as_new_lot(self):
+        self.service.start()
+        secret = self.subscribe()["hub.secret"]
+        self.assertEqual(self.push(FEED, secret).status_code, 202)
+
+        kind, outbox_id = self.wait_for_job()
+        self.assertEqual(kind, JOB_NEW_LOT)
+        entry = self.dm.get_outbox_entry(outbox_id)
+        self.assertEqual(entry.lot.guid, "new")
+        self.assertEqual(list(entry.recipients), [1])
+        self.assertEqual(list(self.dm.get_link(FEED_URL).known_lot_guids), ["old", "new"])
+
+    def test_dispatcher_waits_while_backpressure_is_engaged(self):
+        self.backlog = 10
+        self.assertTrue(self.backpressure.is_engaged())
+        self.service.start()
+        secret = self.subscribe()["hub.secret"]
+
+        # Диспетчер не разбирает очередь, она заполняется, и хаб получает 503.
+        self.assertEqual(self.push(FEED, secret).status_code, 202)
+        response = self.push(FEED, secret)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers.get("Retry-After"), "5")
+        self.assertRaises(queue.Empty, self.delivery_queue.get, timeout=1.5)
+        self.assertEqual(self.service.queue.qsize(), 1)
+
+        # Ниже нижней границы доставка снова успевает, принятое содержимое обрабатывается.
+        self.backlog = 4
+        kind, outbox_id = self.wait_for_job()
+        self.assertEqual(self.dm.get_outbox_entry(outbox_id).lot.guid, "new")
+        self.assertEqual(self.service.queue.qsize(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+"""Шардирование проверок: ShardRing и менеджер хранилища с двумя процессами-воркерами на localhost.
+
+Интеграционный тест запускает WorkerService над временным хранилищем, раздаёт ленты
+локальным HTTP-сервером и ждёт, пока оба шарда сделают полный цикл проверок.
+"""
+import http.server
+import os
+import queue
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+os.environ.setdefault("BOT_TOKEN", "0:test")
+
+from data_manager import DataManager
+from models import Lot
+from services.monitoring_service import JOB_NEW_LOT
+from services.worker_service import ShardRing, WorkerService
+
+LINKS = 12
+SHARDS = 2
+
+
+class ShardRingTest(unittest.TestCase):
+    URLS = [f"https://example.com/rss?region={i}&cat=2" for i in range(2000)]
+
+    def test_spreads_links_evenly(self):
+        ring = ShardRing(4)
+        counts = [0] * 4
+        for url in self.URLS:
+            counts[ring.shard_for(url)] += 1
+        for count in counts:
+            self.assertTrue(0.15 * len(self.URLS) < count < 0.35 * len(self.URLS), counts)
+
+    def test_adding_a_worker_only_moves_links_to_it(self):
+        before, after = ShardRing(4), ShardRing(5)
+        moved = [url for url in self.URLS if before.shard_for(url) != after.shard_for(url)]
+        self.assertTrue(all(after.shard_for(url) == 4 for url in moved))
+        self.assertTrue(0.1 * len(self.URLS) < len(moved) < 0.3 * len(self.URLS), len(moved))
+
+    def test_owner_filters_partition_links(self):
+        ring = ShardRing(SHARDS)
+        filters = [ring.owner_filter(shard) for shard in range(SHARDS)]
+        for url in self.URLS:
+            self.assertEqual(sum(owns(url) for owns in filters), 1)
+
+
+class FeedHandler(http.server.BaseHTTPRequestHandler):
+    """Лента /feed/<n>: старый лот, уже известный хранилищу, и один новый."""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        n = self.path.rsplit("/", 1)[-1]
+        self.server.requests.append(self.path)
+        items = "".join(f"<item><title>Лот {guid}</title><link>https://example.com/lot/{guid}</link><guid>{guid}</guid></item>"
+                        for guid in (f"old-{n}", f"new-{n}"))
+        body = f'<?xml version="1.0" encoding="utf-8"?><rss version="2.0"><channel><title>{n}</title>{items}</channel></rss>'.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/rss+xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class WorkerServiceTest(unittest.TestCase):
+    def setUp(self):
+        self.previous_cwd = os.getcwd()
+        self.previous_env = dict(os.environ)
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+
+        self.feeds = http.server.ThreadingHTTPServer(("127.0.0.1", 0), FeedHandler)
+        self.feeds.requests = []
+        threading.Thread(target=self.feeds.serve_forever, daemon=True).start()
+
+        # Воркеры читают настройки из окружения: короткий цикл, без паузы между запросами к одному хосту.
+        address = f"127.0.0.1:{free_port()}"
+        os.environ.update(MONITOR_MANAGER_ADDRESS=address, CHECK_INTERVAL_SECONDS="1", HOST_MIN_INTERVAL_SECONDS="0",
+                          PARSER_PROCESSES="0", LOG_LEVEL="WARNING")
+        self.dm = DataManager(fsync_policy="never")
+        self.urls = [f"http://127.0.0.1:{self.feeds.server_port}/feed/{n}" for n in range(LINKS)]
+        self.dm.get_or_create_user(1, 10, "user", None)
+        self.dm.add_subscriptions_bulk(1, [(url, url, None) for url in self.urls])
+        for n, url in enumerate(self.urls):
+            self.dm.diff_and_record(url, [Lot(f"old-{n}", "old", "https://example.com/lot/old", None)], notify=False)
+
+        self.delivery_queue = queue.Queue()
+        self.workers = WorkerService(self.dm, self.delivery_queue, SHARDS, address=address)
+
+    def tearDown(self):
+        self.workers.stop(timeout=10)
+        self.feeds.shutdown()
+        self.dm.close()
+        os.environ.clear()
+        os.environ.update(self.previous_env)
+        os.chdir(self.previous_cwd)
+        self.tmp.cleanup()
+
+    def test_each_link_is_checked_by_one_shard_and_recorded_in_parent_store(self):
+        self.workers.start()
+        ring = ShardRing(SHARDS)
+        expected = {f"shard {shard}/{SHARDS}": sum(ring.shard_for(url) == shard for url in self.urls) for shard in range(SHARDS)}
+
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            cycles = self.dm.get_check_cycles()
+            if set(cycles) == set(expected) and all(self.dm.get_link(url).last_checked for url in self.urls):
+                break
+            time.sleep(0.2)
+        else:
+            self.fail(f"workers did not finish a check cycle: {self.dm.get_check_cycles()}")
+
+        # Каждый шард берёт ровно свою часть ссылок, вместе — все.
+        for label, links in expected.items():
+            self.assertEqual(cycles[label]["links"], links, label)
+        self.assertEqual(sum(expected.values()), LINKS)
+        self.assertEqual({path.rsplit("/", 1)[-1] for path in self.feeds.requests}, {str(n) for n in range(LINKS)})
+
+        # diff_and_record и record_link_check_results через прокси изменили хранилище родителя.
+        for n, url in enumerate(self.urls):
+            link = self.dm.get_link(url)
+            self.assertEqual(list(link.known_lot_guids), [f"old-{n}", f"new-{n}"])
+            self.assertEqual(link.error_count, 0)
+        jobs = []
+        while not self.delivery_queue.empty():
+            jobs.append(self.delivery_queue.get_nowait())
+        self.assertEqual(len(jobs), LINKS)
+        self.assertTrue(all(kind == JOB_NEW_LOT and self.dm.get_outbox_entry(outbox_id) is not None for kind, outbox_id in jobs))
+        self.assertEqual({self.dm.get_outbox_entry(outbox_id).lot.guid for _, outbox_id in jobs}, {f"new-{n}" for n in range(LINKS)})
+
+
+if __name__ == "__main__":
+    unittest.main()